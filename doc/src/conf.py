@@ -140,6 +140,15 @@ latex_documents = [
 # One entry per manual page. List of tuples
 # (source start file, name, description, authors, manual section).
 man_pages = [
+    ('icatconvert', 'icatconvert',
+     'Convert an ICAT dump file to another format',
+     [author], 1),
+    ('icatcopy', 'icatcopy',
+     'Copy the content of an ICAT to another ICAT server',
+     [author], 1),
+    ('icatdiff', 'icatdiff',
+     'Compare the content of two ICAT dump files',
+     [author], 1),
     ('icatdump', 'icatdump',
      'Dump the content of the ICAT to a file',
      [author], 1),
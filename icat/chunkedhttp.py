@@ -38,13 +38,27 @@ def stringiterator(buffer):
     if len(buffer) > 0:
         yield buffer
 
-def fileiterator(f, chunksize=8192):
-    """Yield the content of a file by chunks of a given size at a time."""
-    while True:
-        chunk = f.read(chunksize)
-        if not chunk:
-            break
-        yield chunk
+def fileiterator(f, chunksize=1048576):
+    """Yield the content of a file by chunks of a given size at a time.
+
+    If the file supports readinto(), the chunks are read into one
+    reusable buffer and yielded as memoryview.  Each chunk is only
+    valid until the next one is requested.
+    """
+    if hasattr(f, 'readinto'):
+        buf = bytearray(chunksize)
+        view = memoryview(buf)
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            yield view[:n]
+    else:
+        while True:
+            chunk = f.read(chunksize)
+            if not chunk:
+                break
+            yield chunk
 
 class HTTPConnectionMixin:
     """Implement chunked transfer encoding in HTTP.
@@ -98,9 +112,12 @@ class HTTPConnectionMixin:
                 raise TypeError("expect either a string, a file, "
                                 "or an iterable")
             if chunked:
+                # Send the chunk separately rather then concatenating
+                # it with the framing, to avoid copying large chunks.
                 for chunk in bodyiter:
-                    self.send(hex(len(chunk))[2:].encode('ascii') 
-                              + b"\r\n" + chunk + b"\r\n")
+                    self.send(hex(len(chunk))[2:].encode('ascii') + b"\r\n")
+                    self.send(chunk)
+                    self.send(b"\r\n")
                 self.send(b"0\r\n\r\n")
             else:
                 for chunk in bodyiter:
@@ -4,13 +4,17 @@ This is the only module that needs to be imported to use the icat.
 """
 
 import os
+import copy
 from warnings import warn
 import time
 import re
+import errno
+import socket
 import logging
 from distutils.version import StrictVersion as Version
 import atexit
 import urlparse
+from urllib2 import URLError, HTTPError
 
 import suds
 import suds.client
@@ -23,6 +27,7 @@ from icat.exception import *
 from icat.ids import *
 from icat.sslcontext import create_ssl_context, HTTPSTransport
 from icat.helper import simpleqp_unquote, parse_attr_val, ms_timestamp
+from icat.helper import WorkerPool
 
 __all__ = ['Client']
 
@@ -36,6 +41,99 @@ def _complete_url(url, default_path="/ICATService/ICAT?wsdl"):
         return url
     return "%s://%s%s" % (o.scheme, o.netloc, default_path)
 
+def _checkputdata(datafile):
+    """Check that a Datafile object is suitable to be uploaded to IDS.
+    """
+    if not datafile.name:
+        raise ValueError("datafile.name is not set.")
+    if not datafile.dataset or not datafile.dataset.id:
+        raise ValueError("datafile.dataset is not set.")
+    if not datafile.datafileFormat or not datafile.datafileFormat.id:
+        raise ValueError("datafile.datafileFormat is not set.")
+
+# Error numbers of socket errors that indicate a failed connection.
+_connerrnos = { errno.ECONNREFUSED, errno.ECONNRESET, errno.ECONNABORTED, 
+                errno.EPIPE, errno.ETIMEDOUT, errno.EHOSTUNREACH, 
+                errno.ENETUNREACH }
+
+def _isconnerror(e):
+    """Check whether an exception is a connection level error.
+
+    Errors having an HTTP status and errors reading the input file
+    are not.
+    """
+    if isinstance(e, HTTPError):
+        return False
+    if isinstance(e, URLError):
+        e = e.reason
+    if isinstance(e, socket.timeout):
+        return True
+    return isinstance(e, socket.error) and e.errno in _connerrnos
+
+def _putdata(ids, infile, datafile, retries=0):
+    """Upload a datafile to IDS.
+
+    Return a tuple of the id of the Datafile created by IDS and the
+    number of bytes uploaded.  Retry the upload up to `retries` times
+    on connection level errors while sending the data, if `infile`
+    can be rewound.  Any error reported by IDS, such as an internal
+    error or a checksum mismatch, may be raised after IDS already
+    created the Datafile, so it is never retried.  Errors reading
+    `infile` are not retried either.
+    """
+    if not hasattr(infile, 'read'):
+        if isinstance(infile, basestring):
+            # We got a file name as infile.  Open the file and
+            # recursively call the function again with the open file
+            # as argument.  This is the easiest way to guarantee that
+            # the file will finally get closed also in case of errors.
+            with open(infile, 'rb') as f:
+                return _putdata(ids, f, datafile, retries)
+        else:
+            raise TypeError("invalid infile type '%s': "
+                            "must either be a file or a file name." % 
+                            type(infile))
+
+    modTime = ms_timestamp(datafile.datafileModTime)
+    if not modTime:
+        try:
+            # Try our best to get the mtime from the fileno, but
+            # don't bother if this doesn't work, e.g. if it cannot
+            # be fstated.  Note that fstat() yields seconds since
+            # epoch as float, while IDS expects milliseconds since
+            # epoch as int.
+            modTime = int(1000*os.fstat(infile.fileno()).st_mtime)
+        except:
+            pass
+    createTime = ms_timestamp(datafile.datafileCreateTime)
+    if not createTime:
+        createTime = modTime
+
+    try:
+        start = infile.tell()
+    except (AttributeError, IOError):
+        start = None
+    attempt = 0
+    while True:
+        try:
+            dfid = ids.put(infile, datafile.name, 
+                           datafile.dataset.id, datafile.datafileFormat.id, 
+                           datafile.description, datafile.doi, 
+                           createTime, modTime)
+            break
+        except (URLError, socket.error) as e:
+            if attempt >= retries or start is None or not _isconnerror(e):
+                raise
+            attempt += 1
+            log.warning("Upload of %s failed, retry %d of %d: %s", 
+                        datafile.name, attempt, retries, e)
+            infile.seek(start)
+    if start is not None:
+        size = infile.tell() - start
+    else:
+        size = 0
+    return dfid, size
+
 class Client(suds.client.Client):
  
     """A client accessing an ICAT service.
@@ -672,6 +770,115 @@ class Client(suds.client.Client):
                                     % (a, obj.BeanName))
         return self.assertedSearch(query)[0]
 
+    def searchMatchingMany(self, objs, includes=None, chunksize=100):
+        """Search the matching objects for a list of objects.
+
+        This is the equivalent of calling
+        :meth:`~icat.client.Client.searchMatching` on each object in
+        `objs`, but it needs far less searches: the objects are
+        grouped by type and by the values of all but one of the
+        attributes in the uniqueness constraint.  Each group is then
+        searched at once with an IN condition on the remaining
+        attribute.  The objects found are assigned to the objects in
+        `objs` locally.
+
+        Objects can only be searched this way if the uniqueness
+        constraint consists of string attributes and of relations to
+        objects that have an id.  The result for other objects,
+        e.g. objects not having a uniqueness constraint, objects
+        related to objects that are not yet created, or objects
+        having a constraint on a Date attribute, is always
+        :const:`None`.  The caller may still try
+        :meth:`~icat.client.Client.searchMatching` on these.
+
+        :param objs: entity objects having the attributes for the
+            uniqueness constraint set accordingly.
+        :type objs: :class:`list` of :class:`icat.entity.Entity`
+        :param includes: list of related objects to add to the INCLUDE
+            clause of the search queries.
+            See :meth:`icat.query.Query.addIncludes` for details.
+        :type includes: iterable of :class:`str`
+        :param chunksize: maximum number of values in one IN
+            condition.
+        :type chunksize: :class:`int`
+        :return: a list having the same length as `objs`, with the
+            corresponding object found or :const:`None` for each
+            item in `objs`.
+        :rtype: :class:`list`
+        """
+        def quote(v):
+            return "'%s'" % unicode(v).replace("'", "''")
+
+        result = [None] * len(objs)
+        # Collect the values of the constraint attributes for all
+        # objects that can be searched, grouped by the entity class.
+        values = {}
+        for i, obj in enumerate(objs):
+            cls = type(obj)
+            if 'id' in cls.Constraint:
+                continue
+            vals = []
+            for a in cls.Constraint:
+                if a in cls.InstAttr:
+                    if cls.getAttrInfo(self, a).type != "String":
+                        break
+                    v = getattr(obj, a)
+                    if v is None:
+                        break
+                    vals.append(unicode(v))
+                else:
+                    r = getattr(obj, a)
+                    if r is None or not r.id:
+                        break
+                    vals.append(r.id)
+            else:
+                values.setdefault(cls, []).append((i, tuple(vals)))
+        for cls, items in values.items():
+            constraint = list(cls.Constraint)
+            # Vary the attribute having the most distinct values and
+            # group by the others.
+            nvals = [len({v[k] for _, v in items})
+                     for k in range(len(constraint))]
+            k = nvals.index(max(nvals))
+            groups = {}
+            for i, v in items:
+                fixed = v[:k] + v[k+1:]
+                groups.setdefault(fixed, {}).setdefault(v[k], []).append(i)
+            va = constraint[k]
+            fa = constraint[:k] + constraint[k+1:]
+            vrel = va not in cls.InstAttr
+            for fixed, idx in groups.items():
+                conditions = {}
+                for a, v in zip(fa, fixed):
+                    if a in cls.InstAttr:
+                        conditions[a] = "= %s" % quote(v)
+                    else:
+                        conditions["%s.id" % a] = "= %d" % v
+                vvals = sorted(idx.keys())
+                for s in range(0, len(vvals), chunksize):
+                    chunk = vvals[s:s+chunksize]
+                    if vrel:
+                        c = {"%s.id" % va:
+                             "IN (%s)" % ", ".join(["%d" % v for v in chunk])}
+                        if includes == "1":
+                            incl = includes
+                        else:
+                            incl = set(includes or ()) | {va}
+                    else:
+                        c = {va: "IN (%s)" % ", ".join(map(quote, chunk))}
+                        incl = includes
+                    query = Query(self, cls.BeanName, includes=incl)
+                    query.addConditions(conditions)
+                    query.addConditions(c)
+                    for o in self.search(query):
+                        if vrel:
+                            v = getattr(o, va).id
+                        else:
+                            v = unicode(getattr(o, va))
+                        for i in idx.get(v, ()):
+                            result[i] = o
+        return result
+
     def createUser(self, name, search=False, **kwargs):
         """Search a user by name or create a new user.
 
@@ -778,47 +985,104 @@ class Client(suds.client.Client):
 
         if not self.ids:
             raise RuntimeError("no IDS.")
-        if not datafile.name:
-            raise ValueError("datafile.name is not set.")
-        if not datafile.dataset or not datafile.dataset.id:
-            raise ValueError("datafile.dataset is not set.")
-        if not datafile.datafileFormat or not datafile.datafileFormat.id:
-            raise ValueError("datafile.datafileFormat is not set.")
-
-        if not hasattr(infile, 'read'):
-            if isinstance(infile, basestring):
-                # We got a file name as infile.  Open the file and
-                # recursively call the method again with the open file
-                # as argument.  This is the easiest way to guarantee
-                # that the file will finally get closed also in case
-                # of errors.
-                with open(infile, 'rb') as f:
-                    return self.putData(f, datafile)
-            else:
-                raise TypeError("invalid infile type '%s': "
-                                "must either be a file or a file name." % 
-                                type(infile))
+        _checkputdata(datafile)
+        dfid, _ = _putdata(self.ids, infile, datafile)
+        return self.get(datafile.BeanName, dfid)
 
-        modTime = ms_timestamp(datafile.datafileModTime)
-        if not modTime:
+    def putDataMany(self, items, workers=4, retries=2, window=None, 
+                    progress=None, chunksize=100):
+        """Upload many datafiles to IDS concurrently.
+
+        The uploads are dispatched to a pool of `workers` threads,
+        each having its own connection to the IDS.  At most `window`
+        uploads are in flight at any time, so that `items` may be a
+        generator yielding a large number of files.  Uploads that
+        fail with a connection level error while sending the data are
+        retried up to `retries` times, provided that the input can be
+        rewound.  Errors reported by the IDS, such as an internal
+        error or a checksum mismatch, are not retried, because the
+        Datafile may already have been created in this case.  If any
+        upload fails, no further uploads are started.  The uploads in
+        flight are completed and
+        :exc:`~icat.exception.UploadError` is raised.
+
+        The created Datafile objects are searched from ICAT after all
+        uploads are done, in batches of `chunksize`.  The ICAT client
+        itself is only used from the calling thread.
+
+        :param items: the files to upload as pairs of `infile` and
+            `datafile`, see :meth:`~icat.client.Client.putData`.
+        :type items: iterable of :class:`tuple`
+        :param workers: number of concurrent uploads.
+        :type workers: :class:`int`
+        :param retries: maximum number of retries per file.
+        :type retries: :class:`int`
+        :param window: maximum number of uploads in flight.  The
+            default is twice the number of workers.
+        :type window: :class:`int`
+        :param progress: if set, this is called in the calling thread
+            after each completed upload with the number of files and
+            the number of bytes uploaded so far and the elapsed time
+            in seconds as arguments.
+        :type progress: callable
+        :param chunksize: number of Datafile objects to fetch in one
+            search.
+        :type chunksize: :class:`int`
+        :return: the Datafile objects created by IDS, in the order
+            of `items`.
+        :rtype: :class:`list` of :class:`icat.entity.Entity`
+        :raise ValueError: if any `datafile` is not suitable to be
+            uploaded.  Files already uploaded will not be removed.
+        :raise icat.exception.UploadError: if any upload failed.  The
+            ids of the Datafiles created by the successful uploads are
+            in its attribute `datafileIds`.
+        """
+        if not self.ids:
+            raise RuntimeError("no IDS.")
+        idsclients = [ copy.copy(self.ids) for i in range(workers) ]
+        pool = WorkerPool(idsclients, window=window, ordered=True)
+        dfids = []
+        errors = []
+        nbytes = 0
+        start = time.time()
+        def fetch():
+            n = len(dfids) + len(errors)
             try:
-                # Try our best to get the mtime from the fileno, but
-                # don't bother if this doesn't work, e.g. if it cannot
-                # be fstated.  Note that fstat() yields seconds since
-                # epoch as float, while IDS expects milliseconds since
-                # epoch as int.
-                modTime = int(1000*os.fstat(infile.fileno()).st_mtime)
-            except:
-                pass
-        createTime = ms_timestamp(datafile.datafileCreateTime)
-        if not createTime:
-            createTime = modTime
-
-        dfid = self.ids.put(infile, datafile.name, 
-                            datafile.dataset.id, datafile.datafileFormat.id, 
-                            datafile.description, datafile.doi, 
-                            createTime, modTime)
-        return self.get(datafile.BeanName, dfid)
+                dfid, size = pool.get()
+            except Exception as e:
+                errors.append((n, e))
+                return 0
+            dfids.append(dfid)
+            if progress:
+                progress(len(dfids), nbytes + size, time.time() - start)
+            return size
+        try:
+            for infile, datafile in items:
+                _checkputdata(datafile)
+                if pool.pending() >= pool.window:
+                    nbytes += fetch()
+                if errors:
+                    break
+                pool.submit(_putdata, infile, datafile, retries)
+            while pool.pending():
+                nbytes += fetch()
+        finally:
+            pool.close()
+        elapsed = time.time() - start
+        log.info("Uploaded %d files, %d bytes in %.1f s (%.1f MB/s)", 
+                 len(dfids), nbytes, elapsed, 
+                 nbytes / (1e6 * elapsed) if elapsed > 0 else 0.0)
+        if errors:
+            raise UploadError(errors, dfids)
+
+        datafiles = {}
+        for i in range(0, len(dfids), chunksize):
+            idlist = ", ".join(str(n) for n in dfids[i:i+chunksize])
+            query = Query(self, "Datafile", 
+                          conditions={"id": "IN (%s)" % idlist})
+            for df in self.search(query):
+                datafiles[df.id] = df
+        return [ datafiles[n] for n in dfids ]
 
     def getData(self, objs, compressFlag=False, zipFlag=False, outname=None, 
                 offset=0):
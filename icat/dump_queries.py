@@ -21,18 +21,208 @@ here is the following:
 
 The functions defined in this module each return a list of queries
 needed to fetch all objects to be included in one of these chunkes.
+
+All functions accept an optional argument `since` to restrict the
+queries to objects modified after a given time, in order to create
+incremental dumps.  In this case, related objects in one to many
+relations are not embedded in the relating object, but searched on
+their own, because they may have been modified independently.
+
+The dump may also be restricted to a selection of investigations,
+see :func:`getInvestigationConditions`.  The conditions returned by
+this function are to be applied to the search for the investigation
+ids and passed as argument `invconditions` to
+:func:`getAuthQueries` and :func:`getOtherQueries`.  If the selection
+is restricted to one facility, the argument `facility` should also be
+passed to :func:`getAuthQueries`, :func:`getStaticQueries`, and
+:func:`getStaticKeyIndex`, so that only the static objects of this
+facility are included.
 """
 
 import icat
+from icat.dumpfile import entitytypes
 from icat.query import Query
 
 __all__ = [ 'getAuthQueries', 'getStaticQueries', 
-            'getInvestigationQueries', 'getOtherQueries' ]
+            'getInvestigationQueries', 'getOtherQueries', 
+            'getModifiedInvestigationIds', 'getStaticKeyIndex', 
+            'getInvestigationConditions', 'getWatermark', 
+            'getServerTimezone' ]
+
+
+def _quote(v):
+    return "'%s'" % unicode(v).replace("'", "''")
+
+def _timestamp(d):
+    # The ICAT server takes the timestamp literal in its local time.
+    # A datetime value having timezone info is formatted in its own
+    # timezone, so it must already be in the timezone of the server,
+    # such as the values returned by the server, see getWatermark().
+    return "{ts %s}" % d.strftime("%Y-%m-%d %H:%M:%S")
+
+def _prefixed(conditions, prefix):
+    """Prepend a path to the attributes in conditions.
+    """
+    return { prefix + a: c for a, c in conditions.items() }
+
+def _searchIds(client, entity, conditions):
+    """Search the ids of the objects matching the conditions.
+    """
+    aggregate = "DISTINCT" if client.apiversion >= "4.7.0" else None
+    query = Query(client, entity, attribute="id", aggregate=aggregate, 
+                  conditions=conditions)
+    return set(client.searchChunked(query))
+
+def _idcondition(ids):
+    """Return a condition selecting the objects having one of the ids.
+    """
+    return "IN (%s)" % ", ".join(str(i) for i in sorted(ids))
 
 
-def getAuthQueries(client):
+def _keyincludes(client, entity, prefix=""):
+    """Return the related objects needed to build the unique key.
+    """
+    includes = set()
+    for a in entity.Constraint:
+        if a in entity.InstRel:
+            rname = entity.getAttrInfo(client, a).type
+            rclass = client.getEntityClass(rname)
+            includes.add(prefix + a)
+            includes |= _keyincludes(client, rclass, "%s%s." % (prefix, a))
+    return includes
+
+def _backref(client, entity, rel):
+    """Return the relation in the related objects pointing back to entity.
+    """
+    rclass = client.getEntityClass(entity.getAttrInfo(client, rel).type)
+    refs = [ a for a in rclass.InstRel 
+             if rclass.getAttrInfo(client, a).type == entity.BeanName ]
+    if len(refs) != 1:
+        raise ValueError("Cannot determine the relation from %s back to %s." 
+                         % (rclass.BeanName, entity.BeanName))
+    return rclass, refs[0]
+
+def _restoreindex(client, entity):
+    """Return a function to sort relations of entity in restore order.
+    """
+    def key(rel):
+        rname = entity.getAttrInfo(client, rel).type
+        return (entitytypes.index(rname[0].lower() + rname[1:]), rel)
+    return key
+
+def _modifiedQueries(query, since):
+    """Split a query into queries for the objects modified after since.
+    """
+    client = query.client
+    entity = query.entity
+    includes = set()
+    mrels = {}
+    for i in query.includes:
+        r, _, sub = i.partition('.')
+        if r in entity.InstMRel:
+            mrels.setdefault(r, set())
+            if sub:
+                mrels[r].add(sub)
+        else:
+            includes.add(i)
+    q = query.copy()
+    q.includes = includes
+    q.addConditions({"modTime": "> %s" % _timestamp(since)})
+    queries = [q]
+    # Emit the queries for the related objects in the order in which
+    # they must be restored, so that the writer can keep them in the
+    # same chunk.
+    for r in sorted(mrels.keys(), key=_restoreindex(client, entity)):
+        rclass, ref = _backref(client, entity, r)
+        conditions = { "%s.%s" % (ref, a): c 
+                       for a, c in query.conditions.items() }
+        rincludes = mrels[r] | {ref} | _keyincludes(client, rclass)
+        rincludes |= _keyincludes(client, entity, "%s." % ref)
+        rquery = Query(client, rclass, order=["id"], 
+                       conditions=conditions, includes=rincludes)
+        queries.extend(_modifiedQueries(rquery, since))
+    return queries
+
+def _slimincludes(includes):
+    """Drop the facility from the static objects in includes.
+
+    The keys of the static objects are taken from a key index
+    prepared by :func:`getStaticKeyIndex`, so their facility need not
+    be included.
+    """
+    return { i[:-len(".facility")] if i.endswith(".facility") else i
+             for i in includes }
+
+def _modified(queries, since):
+    res = []
+    for q in queries:
+        res.extend(_modifiedQueries(q, since))
+    return res
+
+
+
+def getAuthQueries(client, since=None, invconditions=None, facility=None):
     """Return the queries to fetch all objects related to authorization.
+
+    If `invconditions` is set, the dump is restricted to the
+    investigations selected by these conditions, see
+    :func:`getInvestigationConditions`.  Users and groups are then
+    restricted to those referenced by the selected data: the users
+    of the selected investigations, the owners of their studies, the
+    members of their groups, and the instrument scientists of the
+    instruments of the facility having the name `facility` or of all
+    instruments if `facility` is not set.  Rules are fetched if they
+    do not refer to any group or to one of these groups.  The ids of
+    the users and groups are searched right away in this case.
     """
+    if since is not None:
+        return _modified(getAuthQueries(client, invconditions=invconditions, 
+                                        facility=facility), 
+                         since)
+    if invconditions:
+        groupids = set()
+        if client.apiversion >= '4.4.0':
+            groupids |= _searchIds(client, "Grouping", 
+                                   _prefixed(invconditions, 
+                                             "investigationGroups."
+                                             "investigation."))
+        if facility is not None:
+            iscond = {"instrumentScientists.instrument.facility.name": 
+                      "= %s" % _quote(facility)}
+        else:
+            iscond = {"instrumentScientists.id": "IS NOT NULL"}
+        userids = _searchIds(client, "User", 
+                             _prefixed(invconditions, 
+                                       "investigationUsers.investigation."))
+        userids |= _searchIds(client, "User", 
+                              _prefixed(invconditions, 
+                                        "studies.studyInvestigations."
+                                        "investigation."))
+        userids |= _searchIds(client, "User", iscond)
+        if groupids:
+            userids |= _searchIds(client, "User", 
+                                  {"userGroups.grouping.id": 
+                                   _idcondition(groupids)})
+        queries = []
+        if userids:
+            queries.append(Query(client, "User", order=True, 
+                                 conditions={"id": _idcondition(userids)}))
+        if groupids:
+            queries.append(Query(client, "Grouping", order=True, 
+                                 conditions={"id": _idcondition(groupids)}, 
+                                 includes={"userGroups", "userGroups.user"}))
+        queries.append(Query(client, "Rule", order=["what", "id"], 
+                             conditions={"grouping": "IS NULL"}))
+        if groupids:
+            queries.append(Query(client, "Rule", 
+                                 order=["grouping.name", "what", "id"], 
+                                 conditions={"grouping": "IS NOT NULL", 
+                                             "grouping.id": 
+                                             _idcondition(groupids)}, 
+                                 includes={"grouping"}))
+        queries.append(Query(client, "PublicStep", order=True))
+        return queries
+
     return [ Query(client, "User", order=True), 
              Query(client, "Grouping", order=True, 
                    includes={"userGroups", "userGroups.user"}),
@@ -43,30 +233,52 @@ def getAuthQueries(client):
                    includes={"grouping"}), 
              Query(client, "PublicStep", order=True) ]
 
-def getStaticQueries(client):
+def getStaticQueries(client, since=None, facility=None):
     """Return the queries to fetch all static objects.
+
+    If `facility` is set, only fetch the static objects belonging to
+    the facility having this name.
     """
-    return [ Query(client, "Facility", order=True), 
-             Query(client, "Instrument", order=True, 
+    if since is not None:
+        return _modified(getStaticQueries(client, facility=facility), since)
+    if facility is not None:
+        fcond = {"facility.name": "= %s" % _quote(facility)}
+        facility_query = Query(client, "Facility", order=True, 
+                               conditions={"name": "= %s" % _quote(facility)})
+    else:
+        fcond = None
+        facility_query = Query(client, "Facility", order=True)
+    return [ facility_query, 
+             Query(client, "Instrument", order=True, conditions=fcond, 
                    includes={"facility", "instrumentScientists.user"}), 
-             Query(client, "ParameterType", order=True, 
+             Query(client, "ParameterType", order=True, conditions=fcond, 
                    includes={"facility", "permissibleStringValues"}), 
-             Query(client, "InvestigationType", order=True, 
+             Query(client, "InvestigationType", order=True, conditions=fcond, 
                    includes={"facility"}), 
-             Query(client, "SampleType", order=True, 
+             Query(client, "SampleType", order=True, conditions=fcond, 
                    includes={"facility"}), 
-             Query(client, "DatasetType", order=True, 
+             Query(client, "DatasetType", order=True, conditions=fcond, 
                    includes={"facility"}), 
-             Query(client, "DatafileFormat", order=True, 
+             Query(client, "DatafileFormat", order=True, conditions=fcond, 
                    includes={"facility"}), 
-             Query(client, "FacilityCycle", order=True, 
+             Query(client, "FacilityCycle", order=True, conditions=fcond, 
                    includes={"facility"}), 
-             Query(client, "Application", order=True, 
+             Query(client, "Application", order=True, conditions=fcond, 
                    includes={"facility"}) ]
 
-def getInvestigationQueries(client, invid):
+def getInvestigationQueries(client, invid, since=None, preloaded=False):
     """Return the queries to fetch all objects related to an investigation.
+
+    If `preloaded` is :const:`True`, the queries do not include the
+    facility of related static objects, such as the type of the
+    investigation or the datafile format.  This reduces the size of
+    the search results considerably.  The objects can then only be
+    written using a key index that already contains the keys of all
+    static objects, see :func:`getStaticKeyIndex`.  The argument is
+    ignored if `since` is set.
     """
+    if since is not None:
+        return _modified(getInvestigationQueries(client, invid), since)
     # Compatibility between ICAT versions:
     # - ICAT 4.4.0 added InvestigationGroups.
     # - ICAT 4.10.0 added relation between Shift and Instrument.
@@ -81,26 +293,60 @@ def getInvestigationQueries(client, invid):
     if client.apiversion >= '4.10.0':
         inv_includes |= { "shifts.instrument.facility" }
 
+    sample_includes = { "investigation", "type.facility", 
+                        "parameters", "parameters.type.facility" }
+    dataset_includes = { "investigation", "type.facility", 
+                         "sample", "parameters.type.facility" }
+    datafile_includes = { "dataset", "datafileFormat.facility", 
+                          "parameters.type.facility" }
+    if preloaded:
+        inv_includes = _slimincludes(inv_includes)
+        sample_includes = _slimincludes(sample_includes)
+        dataset_includes = _slimincludes(dataset_includes)
+        datafile_includes = _slimincludes(datafile_includes)
+
     return [ Query(client, "Investigation", 
                    conditions={"id": "= %d" % invid}, 
                    includes=inv_includes), 
              Query(client, "Sample", order=["name"], 
                    conditions={"investigation.id": "= %d" % invid}, 
-                   includes={"investigation", "type.facility", 
-                             "parameters", "parameters.type.facility"}), 
+                   includes=sample_includes), 
              Query(client, "Dataset", order=["name"], 
                    conditions={"investigation.id": "= %d" % invid}, 
-                   includes={"investigation", "type.facility", 
-                             "sample", "parameters.type.facility"}), 
+                   includes=dataset_includes), 
              Query(client, "Datafile", order=["dataset.name", "name"], 
                    conditions={"dataset.investigation.id": "= %d" % invid}, 
-                   includes={"dataset", "datafileFormat.facility", 
-                             "parameters.type.facility"}) ]
+                   includes=datafile_includes) ]
 
-def getOtherQueries(client):
+def getOtherQueries(client, since=None, invconditions=None):
     """Return the queries to fetch all other objects, 
     e.g. not static and not directly related to an investigation.
+
+    If `invconditions` is set, the dump is restricted to the
+    investigations selected by these conditions, see
+    :func:`getInvestigationConditions`.  Studies, data collections,
+    and jobs may span any number of investigations.  They are
+    restricted through their relations in this case:
+
+    + Studies are fetched if they refer to any selected
+      investigation.  Their study investigations are fetched
+      separately and only for the selected investigations.
+    + Related datafiles are fetched if both ends are in the selected
+      investigations.
+    + Data collections are fetched if they contain any dataset or
+      datafile in the selected investigations.  Their data collection
+      datasets and datafiles are fetched separately and only for the
+      selected investigations.
+    + Jobs are fetched if both their input and output data collection
+      are fetched.
+
+    The ids of the studies and data collections are searched right
+    away in this case.
     """
+    if since is not None:
+        return _modified(getOtherQueries(client, 
+                                         invconditions=invconditions), 
+                         since)
     # Compatibility ICAT 4.3.0 vs. ICAT 4.3.1 and later: name of the
     # parameters relation in DataCollection.
     if client.apiversion < '4.3.1':
@@ -108,6 +354,65 @@ def getOtherQueries(client):
     else:
         datacolparamname = 'parameters'
 
+    if invconditions:
+        def conditions(*prefixes):
+            c = {}
+            for p in prefixes:
+                c.update(_prefixed(invconditions, p + "investigation."))
+            return c
+        # Studies and data collections are related to the selected
+        # investigations through one to many relations.  Search their
+        # ids first, so that each object is fetched only once.
+        studyids = _searchIds(client, "Study", 
+                              conditions("studyInvestigations."))
+        dcids = _searchIds(client, "DataCollection", 
+                           conditions("dataCollectionDatasets.dataset."))
+        dcids |= _searchIds(client, "DataCollection", 
+                            conditions("dataCollectionDatafiles."
+                                       "datafile.dataset."))
+        queries = []
+        if studyids:
+            queries.append(Query(client, "Study", order=True, 
+                                 conditions={"id": _idcondition(studyids)}, 
+                                 includes={"user"}))
+        queries.append(Query(client, "StudyInvestigation", order=True, 
+                             conditions=conditions(""), 
+                             includes={"study", "investigation.facility"}))
+        queries.append(Query(client, "RelatedDatafile", order=True, 
+                             conditions=conditions("sourceDatafile.dataset.", 
+                                                   "destDatafile.dataset."), 
+                             includes={("sourceDatafile.dataset."
+                                        "investigation.facility"), 
+                                       ("destDatafile.dataset."
+                                        "investigation.facility")}))
+        if dcids:
+            dccond = _idcondition(dcids)
+            queries.extend([ Query(client, "DataCollection", order=True, 
+                                   conditions={"id": dccond}, 
+                                   includes={"%s.type.facility" 
+                                             % datacolparamname}), 
+                             Query(client, "DataCollectionDataset", 
+                                   order=True, 
+                                   conditions=conditions("dataset."), 
+                                   includes={"dataCollection", 
+                                             ("dataset.investigation."
+                                              "facility")}), 
+                             Query(client, "DataCollectionDatafile", 
+                                   order=True, 
+                                   conditions=conditions("datafile.dataset."), 
+                                   includes={"dataCollection", 
+                                             ("datafile.dataset."
+                                              "investigation.facility")}), 
+                             Query(client, "Job", order=True, 
+                                   conditions={"inputDataCollection.id": 
+                                               dccond, 
+                                               "outputDataCollection.id": 
+                                               dccond}, 
+                                   includes={"application.facility", 
+                                             "inputDataCollection", 
+                                             "outputDataCollection"}) ])
+        return queries
+
     return [ Query(client, "Study", order=True, 
                    includes={"user", "studyInvestigations", 
                              "studyInvestigations.investigation.facility"}), 
@@ -123,3 +428,140 @@ def getOtherQueries(client):
              Query(client, "Job", order=True, 
                    includes={"application.facility", 
                              "inputDataCollection", "outputDataCollection"}) ]
+
+def getModifiedInvestigationIds(client, since, invconditions=None):
+    """Return the ids of all investigations having any related object
+    modified after `since`.
+
+    If `invconditions` is set, only consider the investigations
+    selected by these conditions, see
+    :func:`getInvestigationConditions`.
+    """
+    ids = set()
+    for q in getInvestigationQueries(client, 0, since=since):
+        # The query has two conditions: the one on modTime and the one
+        # selecting the investigation that tells us the path to the
+        # investigation id.
+        idattr = [ a for a in q.conditions.keys() if a != "modTime" ][0]
+        aggregate = "DISTINCT" if client.apiversion >= "4.7.0" else None
+        idquery = Query(client, q.entity, attribute=idattr, 
+                        aggregate=aggregate, order=[idattr], 
+                        conditions={"modTime": q.conditions["modTime"]})
+        if invconditions:
+            prefix = idattr[:-len("id")]
+            idquery.addConditions(_prefixed(invconditions, prefix))
+        ids.update(client.searchChunked(idquery))
+    return ids
+
+def getWatermark(client):
+    """Return the latest modification time of any object in the ICAT.
+
+    Objects created or modified after this call will have a later
+    :attr:`~icat.entity.Entity.modTime`.  So the result may be taken
+    as the starting time before dumping and passed as `since` to the
+    other functions in the next incremental dump.  Since the value
+    is taken from the server, it does not depend on the clock of the
+    client and it is in the timezone of the server, as needed to
+    compare with the modification time in the search.
+
+    :param client: the client to use.
+    :type client: :class:`icat.client.Client`
+    :return: the latest modification time or :const:`None` if the
+        ICAT is empty.
+    :rtype: :class:`datetime.datetime`
+    """
+    watermark = None
+    for name in sorted(client.typemap.keys()):
+        if client.typemap[name].BeanName is None:
+            continue
+        query = Query(client, name, attribute="modTime", aggregate="MAX")
+        res = client.search(query)
+        if res and res[0] is not None:
+            if watermark is None or res[0] > watermark:
+                watermark = res[0]
+    return watermark
+
+def getServerTimezone(client):
+    """Return the timezone of the ICAT server.
+
+    The timezone is taken from the modification time of a facility.
+    This needs only one search, as opposed to :func:`getWatermark`.
+
+    :param client: the client to use.
+    :type client: :class:`icat.client.Client`
+    :return: the timezone or :const:`None` if there is no facility or
+        if the client does not create timezone aware datetime values.
+    :rtype: :class:`datetime.tzinfo`
+    """
+    query = Query(client, "Facility", attribute="modTime", aggregate="MAX")
+    res = client.search(query)
+    if res and res[0] is not None:
+        return res[0].tzinfo
+    return None
+
+def getStaticKeyIndex(client, facility=None):
+    """Return a key index with the keys of all static objects.
+
+    The index contains the keys of the facilities and of all static
+    objects that the investigation data refers to.  It is suitable to
+    be passed as `keyindex` to
+    :meth:`icat.dumpfile.DumpFileWriter.writechunks` in order to
+    write the results of the queries returned by
+    :func:`getInvestigationQueries` with `preloaded` set to
+    :const:`True`.  If `facility` is set, the index is restricted to
+    the static objects belonging to the facility having this name.
+    """
+    keyindex = {}
+    if facility is not None:
+        queries = [ Query(client, "Facility", 
+                          conditions={"name": "= %s" % _quote(facility)}) ]
+        fcond = {"facility.name": "= %s" % _quote(facility)}
+    else:
+        queries = [ Query(client, "Facility") ]
+        fcond = None
+    for t in ("Instrument", "ParameterType", "InvestigationType", 
+              "SampleType", "DatasetType", "DatafileFormat"):
+        queries.append(Query(client, t, conditions=fcond, 
+                             includes={"facility"}))
+    for q in queries:
+        for obj in client.searchChunked(q):
+            obj.getUniqueKey(keyindex=keyindex)
+    return keyindex
+
+def getInvestigationConditions(facility=None, names=None, 
+                               startfrom=None, startto=None):
+    """Return conditions on Investigation to select a subset.
+
+    The conditions are suitable to be passed to
+    :class:`icat.query.Query` to search for investigations.  All
+    criteria that are set must be met.
+
+    :param facility: only select investigations of the facility
+        having this name.
+    :type facility: :class:`str`
+    :param names: only select investigations having one of these
+        names.
+    :type names: :class:`list` of :class:`str`
+    :param startfrom: only select investigations having a startDate
+        not earlier than this.
+    :type startfrom: :class:`datetime.datetime`
+    :param startto: only select investigations having a startDate
+        earlier than this.
+    :type startto: :class:`datetime.datetime`
+    :return: the conditions.  This is empty if none of the criteria
+        is set.
+    :rtype: :class:`dict`
+    """
+    conditions = {}
+    if facility is not None:
+        conditions["facility.name"] = "= %s" % _quote(facility)
+    if names:
+        conditions["name"] = "IN (%s)" % ", ".join(_quote(n) for n in names)
+    dateconds = []
+    if startfrom is not None:
+        dateconds.append(">= %s" % _timestamp(startfrom))
+    if startto is not None:
+        dateconds.append("< %s" % _timestamp(startto))
+    if dateconds:
+        conditions["startDate"] = dateconds
+    return conditions
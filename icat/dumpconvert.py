@@ -0,0 +1,215 @@
+"""Convert ICAT data files between formats without an ICAT server.
+
+Reading a data file with :meth:`icat.dumpfile.DumpFileReader.getobjs`
+requires a connection to an ICAT server: the objects are created
+using the client and references to objects from other chunks are
+searched at the server.  This module allows to convert a data file
+from one format to another one without any server.  The records are
+passed from the reader to the writer as plain dicts, using
+:meth:`icat.dumpfile.DumpFileReader.getrecords_from_data` and
+:meth:`icat.dumpfile.DumpFileWriter.writerecord`, without creating
+entity objects.  References are passed on as references.
+
+The information on the ICAT schema needed for the conversion, e.g.
+the types of the attributes and which attributes are relations to
+other objects, is taken from a
+:class:`~icat.dumpconvert.SchemaSnapshot` instead of the server.
+The snapshot needs to be created once from an ICAT server and may
+then be saved in a file for later use.
+"""
+
+import datetime
+import json
+
+__all__ = ['SchemaSnapshot', 'convertdump']
+
+
+def _boolean(value):
+    try:
+        return {'true': True, 'false': False}[value.lower()]
+    except KeyError:
+        raise ValueError("invalid boolean value '%s'" % value)
+
+# Functions to convert string values by attribute type.  Note that
+# the writers represent floating point values as strings.
+_converters = {
+    'Boolean': _boolean,
+    'Integer': int,
+    'Long': int,
+}
+
+
+class SchemaSnapshot(object):
+    """A snapshot of the ICAT schema to be used offline.
+
+    The snapshot records for each entity type the types of its
+    attributes and the entity types of its related objects.  It also
+    keeps the URL and the API version of the ICAT server it has been
+    taken from as attributes `url` and `apiversion`, so that it may be
+    passed in place of a client to a
+    :class:`~icat.dumpfile.DumpFileWriter` to write the header of the
+    data file.
+
+    :param data: the content of the snapshot, as returned by
+        :meth:`~icat.dumpconvert.SchemaSnapshot.as_dict`.
+    :type data: :class:`dict`
+    """
+
+    def __init__(self, data):
+        self.url = data['service']
+        self.apiversion = data['apiversion']
+        self.entities = data['entities']
+
+    @classmethod
+    def fromclient(cls, client):
+        """Take a snapshot of the schema from an ICAT server.
+
+        :param client: the client connected to the ICAT server.
+        :type client: :class:`icat.client.Client`
+        :return: the snapshot.
+        :rtype: :class:`icat.dumpconvert.SchemaSnapshot`
+        """
+        insttypemap = { c.BeanName:t for t,c in client.typemap.iteritems() }
+        entities = {}
+        for name, ecls in client.typemap.iteritems():
+            if ecls.BeanName is None:
+                continue
+            info = client.getEntityInfo(ecls.BeanName)
+            types = { str(f['name']): str(f['type']) for f in info.fields }
+            entities[name] = {
+                'attrs': { a: types[a] for a in ecls.InstAttr if a != 'id' },
+                'rels': { a: insttypemap[types[a]] for a in ecls.InstRel },
+                'mrels': { a: insttypemap[types[a]] for a in ecls.InstMRel },
+                'alias': dict(ecls.AttrAlias),
+            }
+        return cls({
+            'service': client.url,
+            'apiversion': str(client.apiversion),
+            'entities': entities,
+        })
+
+    @classmethod
+    def load(cls, filename):
+        """Read a snapshot from a file.
+
+        :param filename: name of the file.
+        :type filename: :class:`str`
+        :return: the snapshot.
+        :rtype: :class:`icat.dumpconvert.SchemaSnapshot`
+        """
+        with open(filename, "rt") as f:
+            return cls(json.load(f))
+
+    def as_dict(self):
+        """Return the content of the snapshot as a dict.
+        """
+        return {
+            'service': self.url,
+            'apiversion': self.apiversion,
+            'entities': self.entities,
+        }
+
+    def save(self, filename):
+        """Write the snapshot to a file.
+
+        :param filename: name of the file.
+        :type filename: :class:`str`
+        """
+        with open(filename, "wt") as f:
+            json.dump(self.as_dict(), f, indent=1, sort_keys=True)
+            f.write("\n")
+
+    def getattrtype(self, name, attr):
+        """Get the kind and the type of an attribute.
+
+        :param name: the entity type name.
+        :type name: :class:`str`
+        :param attr: name of the attribute.
+        :type attr: :class:`str`
+        :return: a tuple of the kind, one of `'attr'`, `'rel'`, or
+            `'mrel'`, and the type.  The type is the name of the
+            attribute type for attributes and the entity type name of
+            the related objects for relations.
+        :rtype: :class:`tuple`
+        :raise ValueError: if the entity type or the attribute is not
+            found in the schema.
+        """
+        try:
+            entity = self.entities[name]
+        except KeyError:
+            raise ValueError("Unknown entity type '%s'" % name)
+        attr = entity['alias'].get(attr, attr)
+        for kind in ('attr', 'rel', 'mrel'):
+            types = entity[kind + 's']
+            if attr in types:
+                return kind, types[attr]
+        raise ValueError("invalid attribute '%s' in '%s'" % (attr, name))
+
+    def typedrecord(self, name, d):
+        """Convert the attribute values in a record to their types.
+
+        Data files in some formats, such as XML, represent all
+        attribute values as strings.  Convert them to the type of the
+        attribute according to the schema.  The result has the values
+        as the writers would represent them: booleans and integers
+        have their type, dates are strings in ISO 8601 format, and all
+        other values are strings.
+
+        :param name: the entity type name.
+        :type name: :class:`str`
+        :param d: the attributes of the object, as yielded by
+            :meth:`icat.dumpfile.DumpFileReader.getrecords_from_data`.
+        :type d: :class:`dict`
+        :return: a new dict of attributes having typed values.
+        :rtype: :class:`dict`
+        :raise ValueError: if an attribute is not valid or if a
+            related object is not referenced by its key.
+        """
+        td = {}
+        for attr, v in d.items():
+            kind, atype = self.getattrtype(name, attr)
+            if kind == 'attr':
+                if v is None or isinstance(v, (bool, int, long)):
+                    pass
+                elif isinstance(v, basestring):
+                    if atype in _converters:
+                        v = _converters[atype](v)
+                elif isinstance(v, datetime.datetime):
+                    if v.utcoffset() is not None:
+                        v = v.isoformat()
+                    else:
+                        v = v.isoformat() + 'Z'
+                else:
+                    v = str(v)
+            elif kind == 'rel':
+                if not (v is None or isinstance(v, basestring)):
+                    raise ValueError("related object '%s' in '%s' must be "
+                                     "referenced by key" % (attr, name))
+            else:
+                v = [ self.typedrecord(atype, rd) for rd in v ]
+            td[attr] = v
+        return td
+
+
+def convertdump(reader, writer, schema):
+    """Copy the content of a data file to another data file.
+
+    The records are streamed from `reader` to `writer` chunk by chunk,
+    without creating entity objects and without a connection to an
+    ICAT server.  Both may use different formats.  Neither the reader
+    nor the writer need to have a client, the writer may use `schema`
+    in its place.
+
+    :param reader: the reader for the input data file.
+    :type reader: :class:`icat.dumpfile.DumpFileReader`
+    :param writer: the writer for the output data file.
+    :type writer: :class:`icat.dumpfile.DumpFileWriter`
+    :param schema: the schema snapshot.
+    :type schema: :class:`icat.dumpconvert.SchemaSnapshot`
+    """
+    for data in reader.getdata():
+        writer.startdata()
+        for name, key, d in reader.getrecords_from_data(data, refs=True):
+            if d is not None:
+                d = schema.typedrecord(name, d)
+            writer.writerecord(name, key, d, schema)
@@ -0,0 +1,102 @@
+"""Compare the content of two ICAT data files.
+
+The objects in the data files are compared by their unique key,
+without creating entity objects and without a connection to an ICAT
+server.  Within each chunk, the objects in a data file are ordered by
+their sort key rather than by their unique key, and the chunks in two
+data files need not be aligned.  The records from each file are
+therefore sorted by unique key first and then merge-joined.  The sort
+is done in memory for small files and by merging sorted runs written
+to temporary files for large files, so the memory consumption is
+bounded.
+
+Note that the comparison relies on the unique keys being the same in
+both files for the same object.  This is the case for all objects
+having a uniqueness constraint, but not for objects that are
+identified by a generic numbered key, such as Rules or Jobs.  These
+may show up as removed and added if they have been dumped in a
+different order.
+"""
+
+import heapq
+from icat.dumpfile import _spillrun, _readrun
+
+__all__ = ['diffdumps']
+
+
+def _sortedrecords(reader, buffersize):
+    """Iterate over the records from a reader sorted by key.
+    """
+    items = []
+    runs = []
+    try:
+        for seq, (n, name, key, d) in enumerate(reader.getrecords()):
+            items.append((key, seq, (name, d)))
+            if len(items) >= buffersize:
+                runs.append(_spillrun(items, totree=lambda r: r))
+                items = []
+        if runs:
+            if items:
+                runs.append(_spillrun(items, totree=lambda r: r))
+            items = heapq.merge(*[_readrun(f) for f in runs])
+        else:
+            items.sort(key=lambda i: i[:2])
+        for key, seq, (name, d) in items:
+            yield name, key, d
+    finally:
+        for f in runs:
+            f.close()
+
+def _diffattrs(d1, d2):
+    """Compare the attributes of two records.
+
+    Return a list of tuples of the attribute name, the old, and the
+    new value for each attribute that differs.  Attributes missing in
+    one of the records are reported with value :const:`None`.
+    """
+    changes = []
+    for attr in sorted(set(d1.keys()) | set(d2.keys())):
+        v1 = d1.get(attr)
+        v2 = d2.get(attr)
+        if v1 != v2:
+            changes.append((attr, v1, v2))
+    return changes
+
+def diffdumps(reader1, reader2, buffersize=10000):
+    """Compare the content of two data files.
+
+    Iterate over the differences between the objects read from
+    `reader1` and `reader2`.  For each difference, yield a tuple of a
+    status, the entity type name, the key, and a list of attribute
+    changes.  The status is one of `'added'`, `'removed'`, or
+    `'changed'`.  The attribute changes are tuples of the attribute
+    name, the old, and the new value, the list is empty unless the
+    status is `'changed'`.  The differences are yielded in the order
+    of the keys.
+
+    :param reader1: reader for the old data file.
+    :type reader1: :class:`icat.dumpfile.DumpFileReader`
+    :param reader2: reader for the new data file.
+    :type reader2: :class:`icat.dumpfile.DumpFileReader`
+    :param buffersize: maximum number of records from each file to
+        sort in memory.  Larger files are sorted using temporary
+        files.
+    :type buffersize: :class:`int`
+    """
+    recs1 = _sortedrecords(reader1, buffersize)
+    recs2 = _sortedrecords(reader2, buffersize)
+    r1 = next(recs1, None)
+    r2 = next(recs2, None)
+    while r1 is not None or r2 is not None:
+        if r2 is None or (r1 is not None and r1[1] < r2[1]):
+            yield ('removed', r1[0], r1[1], [])
+            r1 = next(recs1, None)
+        elif r1 is None or r2[1] < r1[1]:
+            yield ('added', r2[0], r2[1], [])
+            r2 = next(recs2, None)
+        else:
+            changes = _diffattrs(r1[2], r2[2])
+            if changes:
+                yield ('changed', r2[0], r2[1], changes)
+            r1 = next(recs1, None)
+            r2 = next(recs2, None)
@@ -49,8 +49,485 @@ file.  The related object must have its own list entry.
 
 import sys
 import os
+import bz2
+import copy
+import datetime
+import gzip
+import hashlib
+import heapq
+import io
+import itertools
+import json
+import logging
+import pickle
+import tempfile
+import threading
+import zlib
+try:
+    import lzma
+except ImportError:
+    lzma = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    from suds.sax.date import FixedOffsetTimezone
+except ImportError:
+    # Original Suds does not create timezone aware datetime values.
+    FixedOffsetTimezone = None
 import icat
+import icat.keyindex
 from icat.query import Query
+from icat.exception import ChunkError
+from icat.helper import WorkerPool
+
+log = logging.getLogger(__name__)
+
+
+# ------------------------------------------------------------
+# Compressed data files
+# ------------------------------------------------------------
+
+# Supported compression formats: name, file name extensions, and
+# magic bytes at the start of the file.
+_compressions = [
+    ('gzip', ('.gz',), b"\x1f\x8b"),
+    ('bzip2', ('.bz2',), b"BZh"),
+    ('xz', ('.xz',), b"\xfd7zXZ\x00"),
+    ('zstd', ('.zst', '.zstd'), b"\x28\xb5\x2f\xfd"),
+]
+
+def _getcompression(filename, mode):
+    """Determine the compression format of a file.
+
+    When reading, the format is detected from the content of the
+    file, otherwise from the file name extension.  Return
+    :const:`None` if the file is not compressed.
+    """
+    if 'r' in mode:
+        with open(filename, 'rb') as f:
+            head = f.read(8)
+        for name, exts, magic in _compressions:
+            if head.startswith(magic):
+                return name
+    else:
+        for name, exts, magic in _compressions:
+            if filename.endswith(exts):
+                return name
+    return None
+
+def _gzip_compress(data):
+    c = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return c.compress(data) + c.flush()
+
+def _bzip2_compress(data):
+    return bz2.compress(data)
+
+def _xz_compress(data):
+    return lzma.compress(data)
+
+
+class _BlockCompressor(io.BufferedIOBase):
+    """A binary file object that compresses the data in parallel.
+
+    The data written is split into blocks that are compressed
+    independently in worker threads and written in order as
+    consecutive streams to the underlying file.  The result is a valid
+    compressed file for formats that allow concatenated streams, such
+    as gzip, bzip2, and xz.  The compression libraries release the
+    global interpreter lock, so this scales with the number of
+    threads.
+    """
+
+    blocksize = 4*1024*1024
+    """Size of the blocks to compress in one task.
+    """
+
+    def __init__(self, fileobj, compress, threads):
+        super(_BlockCompressor, self).__init__()
+        self.fileobj = fileobj
+        self.compress = compress
+        self.pool = WorkerPool([None]*threads, ordered=True)
+        self.blockdata = []
+        self.blocklen = 0
+
+    def writable(self):
+        return True
+
+    def _writeresults(self, window):
+        while self.pool.pending() >= window:
+            self.fileobj.write(self.pool.get())
+
+    def _submit(self):
+        self._writeresults(self.pool.window)
+        block = b"".join(self.blockdata)
+        self.blockdata = []
+        self.blocklen = 0
+        self.pool.submit(lambda c, data: self.compress(data), block)
+
+    def write(self, b):
+        if self.closed:
+            raise ValueError("write to closed file")
+        b = bytes(b)
+        self.blockdata.append(b)
+        self.blocklen += len(b)
+        if self.blocklen >= self.blocksize:
+            self._submit()
+        return len(b)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self.blocklen:
+                self._submit()
+            self._writeresults(1)
+        finally:
+            self.pool.close()
+            self.fileobj.close()
+            super(_BlockCompressor, self).close()
+
+
+def open_compressed(filename, mode, threads=None):
+    """Open a file, transparently compressing or decompressing it.
+
+    When reading, the compression format is detected from the content
+    of the file.  When writing, it is selected by the file name
+    extension: `.gz`, `.bz2`, `.xz`, or `.zst`.  Files that are not
+    compressed are opened as regular files.  zstd compression
+    requires the `zstandard` package.
+
+    :param filename: the name of the file.
+    :type filename: :class:`str`
+    :param mode: the file mode as for :func:`open`.
+    :type mode: :class:`str`
+    :param threads: number of threads to use for compressing.  If
+        this is larger then one, gzip, bzip2, and xz files are written
+        as a sequence of blocks that are compressed in parallel.
+    :type threads: :class:`int`
+    :return: a file object.
+    :raise ImportError: if the module needed for the compression
+        format is not available.
+    """
+    compression = _getcompression(filename, mode)
+    if compression is None:
+        return open(filename, mode)
+    if compression == 'xz' and lzma is None:
+        raise ImportError("The lzma module is needed for xz compression.")
+    if compression == 'zstd':
+        if zstandard is None:
+            raise ImportError("The zstandard package is needed "
+                              "for zstd compression.")
+        if 'w' in mode:
+            cctx = zstandard.ZstdCompressor(threads=threads or 0)
+            return zstandard.open(filename, mode, cctx=cctx)
+        else:
+            return zstandard.open(filename, mode)
+    if 'w' in mode and threads and threads > 1:
+        compress = {
+            'gzip': _gzip_compress,
+            'bzip2': _bzip2_compress,
+            'xz': _xz_compress,
+        }[compression]
+        f = _BlockCompressor(open(filename, 'wb'), compress, threads)
+        if 'b' not in mode:
+            f = io.TextIOWrapper(f)
+        return f
+    if compression == 'gzip':
+        return gzip.open(filename, mode, compresslevel=6)
+    elif compression == 'bzip2':
+        # bz2.open() is not available in Python 2.
+        return getattr(bz2, 'open', bz2.BZ2File)(filename, mode)
+    else:
+        return lzma.open(filename, mode)
+
+
+# ------------------------------------------------------------
+# Sorting entity objects with bounded memory
+# ------------------------------------------------------------
+
+def _entity2tree(obj):
+    """Convert an entity object to a tree of plain Python objects.
+    """
+    attrs = {}
+    tzoffsets = {}
+    for a in obj.InstAttr:
+        v = getattr(obj, a, None)
+        if isinstance(v, basestring):
+            v = unicode(v)
+        elif isinstance(v, datetime.datetime) and v.tzinfo is not None:
+            # The timezone objects created by Suds cannot be pickled.
+            tzoffsets[a] = v.utcoffset()
+            v = v.replace(tzinfo=None)
+        if v is not None:
+            attrs[a] = v
+    rels = {}
+    for r in obj.InstRel:
+        o = getattr(obj, r, None)
+        if o is not None:
+            rels[r] = _entity2tree(o)
+    for r in obj.InstMRel:
+        l = getattr(obj, r)
+        if l:
+            rels[r] = [ _entity2tree(o) for o in l ]
+    return (obj.instancetype, attrs, tzoffsets, rels)
+
+def _tree2entity(client, tree):
+    """Recreate an entity object from a tree made by _entity2tree().
+    """
+    instancetype, attrs, tzoffsets, rels = tree
+    kwargs = dict(attrs)
+    for a, offset in tzoffsets.items():
+        kwargs[a] = attrs[a].replace(tzinfo=FixedOffsetTimezone(offset))
+    for r, v in rels.items():
+        if isinstance(v, list):
+            kwargs[r] = [ _tree2entity(client, t) for t in v ]
+        else:
+            kwargs[r] = _tree2entity(client, v)
+    return client.new(instancetype, **kwargs)
+
+def _spillrun(items, totree=_entity2tree):
+    """Sort items and write them to a temporary file.
+
+    The items are tuples of a sort key, a sequence number, and an
+    object that is converted to something that can be pickled using
+    `totree`.
+    """
+    items.sort(key=lambda i: i[:2])
+    f = tempfile.TemporaryFile()
+    for key, seq, obj in items:
+        pickle.dump((key, seq, totree(obj)), f, 
+                    pickle.HIGHEST_PROTOCOL)
+    f.seek(0)
+    return f
+
+def _readrun(f):
+    while True:
+        try:
+            yield pickle.load(f)
+        except EOFError:
+            break
+
+def _sortobjs(client, objs, buffersize, presorted=False):
+    """Sort entity objects by :meth:`icat.entity.Entity.__sortkey__`.
+
+    Objects are sorted in memory as long as there are no more then
+    `buffersize` of them.  Otherwise sorted runs of `buffersize`
+    objects are written to temporary files and merged.  The objects
+    are recreated from the temporary files in this case.  The sort is
+    stable, so the result is the same in both cases.
+
+    If `presorted` is :const:`True`, the objects are expected to be
+    sorted already.  They are passed on as they arrive and their
+    order is verified on the way.  The server might collate strings
+    differently then Python.  If this is detected, the remaining
+    objects are sorted as above.  The objects passed on so far are
+    still in order among themselves.
+    """
+    if presorted:
+        objs = iter(objs)
+        lastkey = None
+        for obj in objs:
+            key = obj.__sortkey__()
+            if lastkey is not None and key < lastkey:
+                log.warning("search result for %s is not in the expected "
+                            "order, sorting the remaining objects.", 
+                            obj.BeanName)
+                objs = itertools.chain([obj], objs)
+                break
+            lastkey = key
+            yield obj
+        else:
+            return
+    items = []
+    runs = []
+    try:
+        for seq, obj in enumerate(objs):
+            items.append((obj.__sortkey__(), seq, obj))
+            if len(items) >= buffersize:
+                runs.append(_spillrun(items))
+                items = []
+        if not runs:
+            items.sort(key=lambda i: i[:2])
+            for key, seq, obj in items:
+                yield obj
+            return
+        if items:
+            runs.append(_spillrun(items))
+            items = []
+        log.debug("merging %d sorted runs", len(runs))
+        for key, seq, tree in heapq.merge(*[_readrun(f) for f in runs]):
+            yield _tree2entity(client, tree)
+    finally:
+        for f in runs:
+            f.close()
+
+def _sortkeycovered(client, entity):
+    """Check whether the natural order fully determines the sort key.
+
+    This is the case if all attributes the sort key is built from are
+    non-nullable strings or non-nullable relations to objects for
+    which this condition holds in turn.
+    """
+    for a in entity.SortAttrs or entity.Constraint:
+        attrInfo = entity.getAttrInfo(client, a)
+        if not attrInfo.notNullable:
+            return False
+        if attrInfo.relType == "ATTRIBUTE":
+            if attrInfo.type != "String":
+                return False
+        elif attrInfo.relType == "ONE":
+            rclass = client.getEntityClass(attrInfo.type)
+            if not _sortkeycovered(client, rclass):
+                return False
+        else:
+            return False
+    return True
+
+def _isnaturalorder(query):
+    """Check whether the result of a query is sorted by the sort key.
+    """
+    if query.attribute or query.aggregate or query.limit:
+        return False
+    if any(d == "DESC" for a, d in query.order):
+        return False
+    order = [ a for a, d in query.order ]
+    natorder = query.entity.getNaturalOrder(query.client)
+    return (order == natorder and 
+            _sortkeycovered(query.client, query.entity))
+
+
+# ------------------------------------------------------------
+# IngestJournal
+# ------------------------------------------------------------
+
+class IngestJournal(object):
+    """Record the progress of reading a data file into ICAT.
+
+    The journal is an append-only file having one JSON object per
+    line.  For each object created, a record holding the chunk
+    number, the object's key and its id is written, for each chunk
+    completed, a record holding the chunk number.  The records are
+    flushed to disk after each batch, so that the journal reflects
+    the state at the ICAT server if the process gets interrupted.  A
+    partially written last line is ignored.
+
+    If `resume` is :const:`True`, an existing journal is read and
+    compacted such that only the records still needed are kept.
+    Otherwise an existing journal is discarded.  The journal is safe
+    to be used from several threads.
+
+    :param filename: the name of the journal file.
+    :type filename: :class:`str`
+    :param resume: whether to continue with an existing journal.
+    :type resume: :class:`bool`
+    """
+
+    def __init__(self, filename, resume=False):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.chunksdone = set()
+        self.ids = {}
+        if resume and os.path.exists(filename):
+            self._read()
+            self._compact()
+            self.file = open(filename, "at")
+        else:
+            self.file = open(filename, "wt")
+
+    def _read(self):
+        with open(self.filename, "rt") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    # Truncated last line from an interrupted write.
+                    break
+                if 'done' in rec:
+                    self.chunksdone.add(rec['done'])
+                    self.ids.pop(rec['done'], None)
+                elif rec['chunk'] not in self.chunksdone:
+                    ids = self.ids.setdefault(rec['chunk'], {})
+                    ids[rec['key']] = rec['id']
+
+    def _compact(self):
+        tmpfname = self.filename + ".tmp"
+        with open(tmpfname, "wt") as f:
+            for n in sorted(self.chunksdone):
+                f.write(json.dumps({'done': n}) + "\n")
+            for n in sorted(self.ids.keys()):
+                for k, i in self.ids[n].iteritems():
+                    rec = {'chunk': n, 'key': k, 'id': i}
+                    f.write(json.dumps(rec) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmpfname, self.filename)
+
+    def _write(self, records):
+        data = "".join([json.dumps(r) + "\n" for r in records])
+        with self.lock:
+            self.file.write(data)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def isdone(self, n):
+        """Check whether chunk `n` has been completed."""
+        return n in self.chunksdone
+
+    def getids(self, n):
+        """Return a dict mapping the keys of the objects already
+        created from chunk `n` to their ids.
+        """
+        with self.lock:
+            return dict(self.ids.get(n, {}))
+
+    def addobjs(self, n, items):
+        """Record objects from chunk `n` as created.
+
+        :param n: the chunk number.
+        :type n: :class:`int`
+        :param items: tuples of key and id of the objects.
+        :type items: iterable of :class:`tuple`
+        """
+        records = [{'chunk': n, 'key': k, 'id': i} for k, i in items]
+        if records:
+            self._write(records)
+
+    def done(self, n):
+        """Record chunk `n` as completed."""
+        self._write([{'done': n}])
+        with self.lock:
+            self.chunksdone.add(n)
+            self.ids.pop(n, None)
+
+    def close(self):
+        """Close the journal file."""
+        if self.file:
+            self.file.close()
+            self.file = None
+
+
+# ------------------------------------------------------------
+# Chunk index
+# ------------------------------------------------------------
+
+def _checksum(f, length):
+    """Return the SHA-256 hex digest of the next length bytes from f."""
+    h = hashlib.sha256()
+    while length > 0:
+        buf = f.read(min(length, 1024*1024))
+        if not buf:
+            raise EOFError("Unexpected end of file.")
+        h.update(buf)
+        length -= len(buf)
+    return h.hexdigest()
 
 
 # ------------------------------------------------------------
@@ -67,10 +544,39 @@ class DumpFileReader(object):
     according to the mode required for the backend.
     """
 
+    indexable = False
+    """Whether the backend supports the chunk index.
+
+    See :meth:`~icat.dumpfile.DumpFileWriter.setindex`.
+    """
+
+    chunks = None
+    """Numbers of the chunks to read.
+
+    If set, :meth:`~icat.dumpfile.DumpFileReader.getobjs` and
+    :meth:`~icat.dumpfile.DumpFileReader.processobjs` only consider
+    the chunks having these numbers.  This must be a sequence in
+    ascending order, typically a range, e.g. `range(10, 20)`.  The
+    chunks are numbered from zero in the order of the data file.  If
+    the data file has a chunk index, the selected chunks are read
+    directly without parsing the chunks before them.
+    """
+
+    objcachesize = None
+    """Maximum number of objects to keep in the internal object index.
+
+    If set, the internal object index used to resolve relations is a
+    :class:`icat.keyindex.ObjIndex` keeping at most this number of
+    objects in memory, rather than a dict.
+    """
+
     def __init__(self, client, infile):
         self.client = client
         self._closefile = False
+        self.filename = None
         if isinstance(infile, basestring):
+            if infile != "-":
+                self.filename = infile
             self.infile = self._file_open(infile)
             self._closefile = True
         else:
@@ -80,7 +586,7 @@ class DumpFileReader(object):
         if filename == "-":
             return sys.stdin
         else:
-            return open(filename, self.mode)
+            return open_compressed(filename, self.mode)
 
     def __enter__(self):
         return self
@@ -107,6 +613,180 @@ class DumpFileReader(object):
         """
         raise NotImplementedError
 
+    def getrecords_from_data(self, data, refs=False):
+        """Iterate over the records of the objects in a data chunk.
+
+        Yield a tuple of the entity type name, the key, and a dict of
+        the attributes for each object, without creating entity
+        objects.  Related objects are represented by their key and
+        objects embedded in one to many relations by lists of such
+        dicts.  References to objects from other chunks are skipped,
+        unless `refs` is set.  In that case, they are yielded having
+        :const:`None` in place of the dict.
+        """
+        raise NotImplementedError
+
+    def detachdata(self, data):
+        """Return a data chunk that stays valid after the iteration.
+
+        Some backends recycle the data object yielded from
+        :meth:`~icat.dumpfile.DumpFileReader.getdata` once the
+        iteration proceeds to the next chunk.  This method returns a
+        data object that may be kept and passed to
+        :meth:`~icat.dumpfile.DumpFileReader.getobjs_from_data` later
+        on, e.g. in another thread.  The default implementation
+        returns data unchanged.  Subclasses should override it if
+        needed.
+        """
+        return data
+
+    def getindex(self):
+        """Read the chunk index of the data file.
+
+        :return: a list having a dict for each chunk with the keys
+            `offset`, `length`, `count`, and `sha256`, or
+            :const:`None` if there is no valid index for the data file.
+        :rtype: :class:`list`
+        """
+        if not self.indexable or not self.filename:
+            return None
+        indexfile = self.filename + ".idx"
+        try:
+            with open(indexfile, "rt") as f:
+                index = json.load(f)
+        except (IOError, OSError):
+            return None
+        if index.get('size') != os.path.getsize(self.filename):
+            log.warning("Ignoring chunk index %s that does not match "
+                        "the data file.", indexfile)
+            return None
+        return index['chunks']
+
+    def _parsechunk(self, buf):
+        """Parse a data chunk from the raw content of the data file.
+
+        Backends supporting the chunk index must implement this.
+        """
+        raise NotImplementedError
+
+    def _enumdata(self):
+        """Iterate over the selected chunks in the data file.
+
+        Yield a tuple of the chunk number and the data object for each
+        chunk selected in :attr:`~icat.dumpfile.DumpFileReader.chunks`.
+        """
+        if self.chunks is None:
+            for n, data in enumerate(self.getdata()):
+                yield n, data
+            return
+        index = self.getindex()
+        if index is not None:
+            with open(self.filename, "rb") as f:
+                for n in self.chunks:
+                    if n >= len(index):
+                        break
+                    c = index[n]
+                    f.seek(c['offset'])
+                    buf = f.read(c['length'])
+                    if hashlib.sha256(buf).hexdigest() != c['sha256']:
+                        raise RuntimeError("Checksum mismatch in chunk %d "
+                                           "of %s." % (n, self.filename))
+                    yield n, self._parsechunk(buf)
+        else:
+            last = self.chunks[-1] if len(self.chunks) else -1
+            for n, data in enumerate(self.getdata()):
+                if n > last:
+                    break
+                if n in self.chunks:
+                    yield n, data
+
+    def _hasrefs(self, data):
+        """Check whether a data chunk starts with references.
+
+        Chunks written by
+        :meth:`~icat.dumpfile.DumpFileWriter.writedata` start with
+        references to objects outside of the chunk if they continue a
+        chunk that has been split.  `data` must have been returned by
+        :meth:`~icat.dumpfile.DumpFileReader.detachdata`.  Backends
+        supporting references should override this.
+        """
+        return False
+
+    def withclient(self, client):
+        """Return a copy of this reader that uses another client.
+
+        The copy shares the input with the original and must only be
+        used to convert data chunks with
+        :meth:`~icat.dumpfile.DumpFileReader.getobjs_from_data`.  The
+        entity objects it creates will be bound to `client`.
+        """
+        reader = copy.copy(self)
+        reader.client = client
+        reader._closefile = False
+        return reader
+
+    def _newobjindex(self):
+        """Create a new internal object index.
+        """
+        if self.objcachesize:
+            return icat.keyindex.ObjIndex(self.client,
+                                          cachesize=self.objcachesize)
+        else:
+            return {}
+
+    def _getchunkitems(self, data, objindex, batchsize=1):
+        """Iterate over batches of key and object pairs in a data chunk.
+
+        Yield lists of up to `batchsize` consecutive (key, obj) tuples
+        having objects of the same type.  The objects are added to
+        `objindex` right away and get truncated after the caller
+        processed the batch.
+        """
+        batch = []
+        for key, obj in self.getobjs_from_data(data, objindex):
+            if batch and obj.BeanName != batch[0][1].BeanName:
+                yield batch
+                for k, o in batch:
+                    o.truncateRelations()
+                batch = []
+            batch.append((key, obj))
+            if key:
+                objindex[key] = obj
+            if len(batch) >= batchsize:
+                yield batch
+                for k, o in batch:
+                    o.truncateRelations()
+                batch = []
+        if batch:
+            yield batch
+            for k, o in batch:
+                o.truncateRelations()
+
+    def getchunkobjs(self, data, objindex):
+        """Iterate over the objects in a data chunk.
+
+        Same as :meth:`~icat.dumpfile.DumpFileReader.getobjs_from_data`,
+        but yield only the objects and add them to `objindex`.
+        """
+        for items in self._getchunkitems(data, objindex):
+            yield items[0][1]
+
+    def getchunkbatches(self, data, objindex, batchsize=100):
+        """Iterate over batches of objects in a data chunk.
+
+        Yield lists of up to `batchsize` consecutive objects of the
+        same type from a data chunk.  This allows the caller to
+        process the objects of a batch at once, e.g. to search for
+        objects already existing at the ICAT server with
+        :meth:`icat.client.Client.searchMatchingMany`.  The objects
+        are added to `objindex` right away, so that subsequent objects
+        may reference them.  The caller must process the objects of a
+        batch in order, such that referenced objects get created
+        before the objects referencing them.
+        """
+        for items in self._getchunkitems(data, objindex, batchsize):
+            yield [o for k, o in items]
+
     def getobjs(self, objindex=None):
         """Iterate over the objects in the data file.
 
@@ -118,19 +798,151 @@ class DumpFileReader(object):
             This serves as a cache of previously retrieved objects,
             used to resolve object relations.  If this is
             :const:`None`, an internal cache will be used that is
-            purged at the start of every new data chunk.
+            purged at the start of every new data chunk, see
+            :attr:`~icat.dumpfile.DumpFileReader.objcachesize`.
         :type objindex: :class:`dict`
         """
         resetindex = (objindex is None)
-        for data in self.getdata():
+        for n, data in self._enumdata():
             self.client.autoRefresh()
             if resetindex:
-                objindex = {}
-            for key, obj in self.getobjs_from_data(data, objindex):
+                objindex = self._newobjindex()
+            for obj in self.getchunkobjs(data, objindex):
                 yield obj
-                obj.truncateRelations()
-                if key:
-                    objindex[key] = obj
+
+    def getrecords(self):
+        """Iterate over the records of the objects in the data file.
+
+        Yield a tuple of the chunk number, the entity type name, the
+        key, and a dict of the attributes for each object, see
+        :meth:`~icat.dumpfile.DumpFileReader.getrecords_from_data`.
+        This does not need a connection to an ICAT server, the reader
+        may be created with `client` set to :const:`None`.
+        """
+        for n, data in self._enumdata():
+            for name, key, d in self.getrecords_from_data(data):
+                yield n, name, key, d
+
+    def _processchunk(self, client, n, data, func, batchsize, journal):
+        """Process all objects from one data chunk using client.
+        """
+        client.autoRefresh()
+        reader = self.withclient(client)
+        if journal:
+            ids = journal.getids(n)
+        else:
+            ids = {}
+        objindex = reader._newobjindex()
+        for items in reader._getchunkitems(data, objindex, batchsize or 1):
+            objs = []
+            for key, obj in items:
+                if key in ids:
+                    # The object has already been created in a
+                    # previous run.
+                    obj.id = ids[key]
+                else:
+                    objs.append(obj)
+            if not objs:
+                continue
+            if batchsize:
+                func(objs)
+            else:
+                func(objs[0])
+            if journal:
+                journal.addobjs(n, [(k, o.id) for k, o in items
+                                    if k and k not in ids])
+        if journal:
+            journal.done(n)
+
+    def processobjs(self, func, clients=None, head=2, tail=1, window=None,
+                    batchsize=None, journal=None):
+        """Call a function on all objects in the data file.
+
+        This is similar to iterating over
+        :meth:`~icat.dumpfile.DumpFileReader.getobjs` and calling
+        `func` on each object, but allows to process data chunks
+        concurrently.  If `clients` is set, the first `head` chunks
+        and the last `tail` chunks are processed serially using this
+        reader's client, while all chunks in between are dispatched to
+        a pool of worker threads, one for each client in `clients`.
+        This assumes the chunks in between to be independent of each
+        other, as it is the case for the investigation chunks written
+        by icatdump.  Chunks that continue a chunk split by the writer
+        depend on the previous ones.  All chunks in flight are
+        completed before such a chunk is dispatched.  The objects
+        passed to `func` are bound to the client of the worker, so
+        `func` should use `obj.client` for any further client calls.
+
+        If any chunk fails in a worker thread, the remaining chunks
+        are still processed.  A :exc:`~icat.exception.ChunkError`
+        listing all failed chunks is raised at the end and the
+        trailing chunks are not processed in this case.
+
+        If `journal` is set, the progress is recorded in the journal.
+        Chunks that the journal marks as completed are skipped without
+        converting their content and objects that the journal records
+        to have been created already are not passed to `func` again.
+        This allows to resume processing after a failure.
+
+        :param func: function to call on each object.  It is
+            supposed to create the object at the ICAT server and must
+            set the object's id.
+        :type func: callable
+        :param clients: clients for the worker threads.  They must be
+            logged in.  If this is :const:`None` or empty, all chunks
+            are processed serially.
+        :type clients: :class:`list` of :class:`icat.client.Client`
+        :param head: number of leading chunks to process before
+            dispatching the following chunks to the workers.
+        :type head: :class:`int`
+        :param tail: number of trailing chunks to process after all
+            other chunks are done.
+        :type tail: :class:`int`
+        :param window: maximum number of chunks in flight.  The
+            default is twice the number of clients.
+        :type window: :class:`int`
+        :param batchsize: if set, `func` is called with lists of
+            objects rather then with single objects, see
+            :meth:`~icat.dumpfile.DumpFileReader.getchunkbatches`.
+        :type batchsize: :class:`int`
+        :param journal: a journal to record the progress.
+        :type journal: :class:`icat.dumpfile.IngestJournal`
+        :raise ChunkError: if processing of any of the chunks in the
+            worker threads failed.
+        """
+        if not clients:
+            for n, data in self._enumdata():
+                if journal and journal.isdone(n):
+                    continue
+                self._processchunk(self.client, n, data, func,
+                                   batchsize, journal)
+            return
+        pool = WorkerPool(clients, window=window)
+        held = []
+        chunknums = {}
+        try:
+            for n, data in self._enumdata():
+                if journal and journal.isdone(n):
+                    continue
+                if n < head:
+                    self._processchunk(self.client, n, data, func,
+                                       batchsize, journal)
+                    continue
+                held.append((n, self.detachdata(data)))
+                if len(held) > tail:
+                    c, chunk = held.pop(0)
+                    if self._hasrefs(chunk):
+                        pool.wait()
+                    seq = pool.submit(self._processchunk, c, chunk, func,
+                                      batchsize, journal)
+                    chunknums[seq] = c
+        finally:
+            errors = pool.close()
+        if errors:
+            raise ChunkError([(chunknums[s], e) for s, e in errors])
+        for n, data in held:
+            self._processchunk(self.client, n, data, func,
+                               batchsize, journal)
 
 
 # ------------------------------------------------------------
@@ -147,21 +959,52 @@ class DumpFileWriter(object):
     according to the mode required for the backend.
     """
 
+    sortbuffer = 10000
+    """Maximum number of objects to sort in memory.
+
+    If a search yields more objects, they are sorted using temporary
+    files in order to limit the memory consumption.
+    """
+
+    keycachesize = None
+    """Maximum number of keys to keep in the internal key index.
+
+    If set, the internal key index is a
+    :class:`icat.keyindex.KeyIndex` keeping at most this number of
+    keys in memory, rather than a dict.
+    """
+
+    indexable = False
+    """Whether the backend supports the chunk index.
+
+    See :meth:`~icat.dumpfile.DumpFileWriter.setindex`.
+    """
+
     def __init__(self, client, outfile):
         self.client = client
         self._closefile = False
+        self.filename = None
         if isinstance(outfile, basestring):
+            if outfile != "-":
+                self.filename = outfile
             self.outfile = self._file_open(outfile)
             self._closefile = True
         else:
             self.outfile = outfile
         self.idcounter = {}
+        self.objcount = 0
+        self.indexfile = None
+        self.chunkindex = None
+        self._partlimit = None
+        self._partobjs = None
+        self._partcount = 0
+        self._partgeneric = False
 
     def _file_open(self, filename):
         if filename == "-":
             return sys.stdout
         else:
-            return open(filename, self.mode)
+            return open_compressed(filename, self.mode)
 
     def __enter__(self):
         self.head()
@@ -170,8 +1013,80 @@ class DumpFileWriter(object):
     def __exit__(self, type, value, traceback):
         if type is None:
             self.finalize()
+            self._indexend()
         if self._closefile:
             self.outfile.close()
+        if type is None and self.indexfile:
+            self._writeindex()
+
+    def setindex(self, indexfile=None):
+        """Write a chunk index along with the data file.
+
+        The index is a JSON file recording for each chunk the byte
+        offset and the length in the data file, the number of objects,
+        and a SHA-256 checksum.  This allows readers to seek directly
+        to a chunk, see :attr:`~icat.dumpfile.DumpFileReader.chunks`.
+        The index is written when leaving the context of the writer.
+        This must be called before writing any data.
+
+        :param indexfile: name of the index file.  The default is the
+            name of the data file with `.idx` appended.  Readers only
+            look for the index file having the default name.
+        :type indexfile: :class:`str`
+        :raise ValueError: if the backend does not support the chunk
+            index or if the data file is not an uncompressed regular
+            file opened by name.
+        """
+        if not self.indexable:
+            raise ValueError("This backend does not support a chunk index.")
+        if not self.filename or _getcompression(self.filename, 'w'):
+            raise ValueError("A chunk index requires an uncompressed "
+                             "data file opened by name.")
+        self.indexfile = indexfile or self.filename + ".idx"
+        self.chunkindex = []
+
+    def _indexobj(self, newchunk, isref=False):
+        """Record an object in the chunk index.
+
+        Backends supporting the chunk index must call this in
+        :meth:`~icat.dumpfile.DumpFileWriter.writeobj` and
+        :meth:`~icat.dumpfile.DumpFileWriter.writeref` before writing
+        anything, setting `newchunk` if the object starts a new chunk
+        in the data file.  References are not counted as objects.
+        """
+        if self.chunkindex is None:
+            return
+        if newchunk:
+            self._indexend()
+            self.chunkindex.append({'offset': self.outfile.tell(), 'count': 0})
+        if not isref:
+            self.chunkindex[-1]['count'] += 1
+
+    def _indexend(self):
+        """Record the end of the current chunk in the chunk index.
+
+        Backends supporting the chunk index must call this in
+        :meth:`~icat.dumpfile.DumpFileWriter.finalize` before writing
+        anything after the last chunk.
+        """
+        if self.chunkindex and 'length' not in self.chunkindex[-1]:
+            c = self.chunkindex[-1]
+            c['length'] = self.outfile.tell() - c['offset']
+
+    def _writeindex(self):
+        """Write the chunk index, adding the checksums.
+        """
+        with open(self.filename, "rb") as f:
+            for c in self.chunkindex:
+                f.seek(c['offset'])
+                c['sha256'] = _checksum(f, c['length'])
+        index = {
+            'size': os.path.getsize(self.filename),
+            'chunks': self.chunkindex,
+        }
+        with open(self.indexfile, "wt") as f:
+            json.dump(index, f, indent=1, sort_keys=True)
+            f.write("\n")
 
     def head(self):
         """Write a header with some meta information to the data file."""
@@ -189,6 +1104,37 @@ class DumpFileWriter(object):
         """Add an entity object to the current data chunk."""
         raise NotImplementedError
 
+    def writeref(self, key, obj):
+        """Add a reference to an entity object to the current data chunk.
+
+        The referenced object is not part of the chunk, but exists
+        already when the chunk is read.  References must be added
+        before any objects.
+        """
+        raise NotImplementedError
+
+    def writerecord(self, name, key, d, schema):
+        """Add a record of an object to the current data chunk.
+
+        This is the counterpart of
+        :meth:`icat.dumpfile.DumpFileReader.getrecords_from_data`.
+        It allows to write the data without entity objects.  If `d`
+        is :const:`None`, a reference is written.  Otherwise, the
+        attribute values in `d` must have the appropriate type, dates
+        being represented as strings in ISO 8601 format.
+
+        :param name: the entity type name.
+        :type name: :class:`str`
+        :param key: the key of the object.
+        :type key: :class:`str`
+        :param d: the attributes of the object.
+        :type d: :class:`dict`
+        :param schema: the schema snapshot, used to distinguish
+            attributes from relations if needed.
+        :type schema: :class:`icat.dumpconvert.SchemaSnapshot`
+        """
+        raise NotImplementedError
+
     def finalize(self):
         """Finalize the data file."""
         raise NotImplementedError
@@ -203,6 +1149,16 @@ class DumpFileWriter(object):
         These objects may only be referenced from the same chunk in
         the data file.
 
+        The objects are written sorted by
+        :meth:`icat.entity.Entity.__sortkey__`.  If `objs` is a query
+        having the natural order of the entity type, the objects are
+        written as they arrive from the server and their order is
+        only verified.  Should this verification fail, the remaining
+        objects are sorted.  Otherwise, they are sorted in memory, or
+        using temporary files if there are more then
+        :attr:`~icat.dumpfile.DumpFileWriter.sortbuffer` of them.  In
+        either case, the result is the same.
+
         :param objs: query to search the objects, either a Query
             object or a string.  It must contain an appropriate
             include clause to include all related objects from
@@ -229,9 +1185,12 @@ class DumpFileWriter(object):
             :meth:`icat.client.Client.searchChunked` for details.
         :type chunksize: :class:`int`
         """
+        presorted = isinstance(objs, Query) and _isnaturalorder(objs)
         if isinstance(objs, Query) or isinstance(objs, basestring):
             objs = self.client.searchChunked(objs, chunksize=chunksize)
-        for obj in sorted(objs, key=icat.entity.Entity.__sortkey__):
+        objs = _sortobjs(self.client, objs, self.sortbuffer, 
+                         presorted=presorted)
+        for obj in objs:
             # Entities without a constraint will use their id to form
             # the unique key as a last resort.  But we want the keys
             # not to depend on volatile attributes such as the id.
@@ -246,9 +1205,59 @@ class DumpFileWriter(object):
                 keyindex[(obj.BeanName, obj.id)] = k
             else:
                 k = obj.getUniqueKey(keyindex=keyindex)
+            self.objcount += 1
+            self._addobj(k, obj, keyindex)
+
+    def _addobj(self, key, obj, keyindex):
+        """Add an entity object, splitting the data chunk if needed.
+
+        Once the current chunk has reached the limit set in
+        :meth:`~icat.dumpfile.DumpFileWriter.writedata`, a new chunk
+        is started.  The objects of this continuation chunk are kept
+        until it is complete, because the references need to be
+        written first.  Objects having a generic key may only be
+        referenced from the same chunk, so the chunk is not split
+        after any of these.
+        """
+        if self._partlimit:
+            if (self._partcount >= self._partlimit and
+                not self._partgeneric):
+                self._flushpart(keyindex)
+                self.startdata()
+                self._partobjs = []
+                self._partcount = 0
+            self._partcount += 1
+            if 'id' in obj.Constraint:
+                self._partgeneric = True
+            if self._partobjs is not None:
+                self._partobjs.append((key, obj))
+                return
+        self.writeobj(key, obj, keyindex)
+
+    def _flushpart(self, keyindex):
+        """Write the objects kept for a continuation chunk.
+
+        The objects are preceded by references to all objects outside
+        of the chunk they are related to in many-to-one relations.
+        """
+        if not self._partobjs:
+            return
+        keys = { k for k, o in self._partobjs }
+        refs = {}
+        for k, obj in self._partobjs:
+            for attr in obj.InstRel:
+                o = getattr(obj, attr, None)
+                if o is not None:
+                    rk = o.getUniqueKey(keyindex=keyindex)
+                    if rk not in keys:
+                        refs[rk] = o
+        for rk in sorted(refs, key=lambda k: (refs[k].instancetype, k)):
+            self.writeref(rk, refs[rk])
+        for k, obj in self._partobjs:
             self.writeobj(k, obj, keyindex)
+        self._partobjs = []
 
-    def writedata(self, objs, keyindex=None, chunksize=100):
+    def writedata(self, objs, keyindex=None, chunksize=100, chunklimit=None):
         """Write a data chunk.
 
         :param objs: an iterable that yields either queries to search
@@ -258,24 +1267,194 @@ class DumpFileWriter(object):
         :param keyindex: cache of generated keys, see
             :meth:`icat.dumpfile.DumpFileWriter.writeobjs` for
             details.  If this is :const:`None`, an internal index will
-            be used.
+            be used, see
+            :attr:`~icat.dumpfile.DumpFileWriter.keycachesize`.
         :type keyindex: :class:`dict`
         :param chunksize: tuning parameter, see
             :meth:`icat.client.Client.searchChunked` for details.
         :type chunksize: :class:`int`
+        :param chunklimit: maximum number of objects in a data chunk.
+            If set, the data is split into several chunks having at
+            most this number of objects each.  The following chunks
+            start with references to the objects from the previous
+            ones, see :meth:`~icat.dumpfile.DumpFileWriter.writeref`.
+            This bounds the memory needed to read the data file.  The
+            objects for one of the following chunks are kept in
+            memory while writing.  The chunk is not split after objects
+            having a generic key.
+        :type chunklimit: :class:`int`
         """
         self.client.autoRefresh()
         if keyindex is None:
-            keyindex = {}
+            keyindex = self._newkeyindex()
         self.startdata()
+        self._partlimit = chunklimit
+        self._partobjs = None
+        self._partcount = 0
+        self._partgeneric = False
+        try:
+            for o in objs:
+                self.writeobjs(o, keyindex, chunksize=chunksize)
+            self._flushpart(keyindex)
+        finally:
+            self._partlimit = None
+            self._partobjs = None
+
+    def _newkeyindex(self, keyindex=None):
+        """Create a new internal key index, layered over keyindex.
+
+        The keys in keyindex are looked up, but not copied.  New keys
+        are only added to the internal index.
+        """
+        if self.keycachesize:
+            index = icat.keyindex.KeyIndex(cachesize=self.keycachesize)
+        else:
+            index = {}
+        if keyindex:
+            index = icat.keyindex.ChainIndex(index, keyindex)
+        return index
+
+    @staticmethod
+    def _fetchchunk(client, objs, chunksize):
+        """Search all objects for one data chunk using client.
+        """
+        client.autoRefresh()
+        objlists = []
         for o in objs:
-            self.writeobjs(o, keyindex, chunksize=chunksize)
+            if isinstance(o, Query) or isinstance(o, basestring):
+                res = client.searchChunked(o, chunksize=chunksize)
+                objlists.append(list(res))
+            else:
+                objlists.append(list(o))
+        return objlists
+
+    def writechunks(self, chunks, clients=None, window=None, chunksize=100,
+                    chunklimit=None, keyindex=None):
+        """Write a sequence of data chunks.
+
+        This is equivalent to calling
+        :meth:`~icat.dumpfile.DumpFileWriter.writedata` for each item
+        in `chunks`, but allows to search the objects for the chunks
+        concurrently.  If `clients` is set, the searches for each
+        chunk are dispatched to a pool of worker threads, one for each
+        client in `clients`.  The results are kept in a reorder buffer
+        and the chunks are written in their original order, so the
+        data file is the same as if the chunks were written serially.
+        The number of chunks searched ahead, and thus the memory
+        consumption, is bounded by `window`.
+
+        The serialization of the objects is always done in the calling
+        thread, because generic keys for objects not having a
+        uniqueness constraint are numbered across chunks.  Each chunk
+        uses its own key index.  If `keyindex` is set, the index of
+        each chunk is layered over it, see
+        :class:`~icat.keyindex.ChainIndex`.
+
+        :param chunks: an iterable that yields the `objs` argument to
+            :meth:`~icat.dumpfile.DumpFileWriter.writedata` for each
+            chunk.
+        :param clients: clients for the worker threads.  They must be
+            logged in.  If this is :const:`None` or empty, all chunks
+            are searched serially using this writer's client.
+        :type clients: :class:`list` of :class:`icat.client.Client`
+        :param window: maximum number of chunks searched ahead.  The
+            default is twice the number of clients.
+        :type window: :class:`int`
+        :param chunksize: tuning parameter, see
+            :meth:`icat.client.Client.searchChunked` for details.
+        :type chunksize: :class:`int`
+        :param chunklimit: maximum number of objects in a data chunk,
+            see :meth:`~icat.dumpfile.DumpFileWriter.writedata`.  Note
+            that the objects searched by the worker threads are kept
+            in memory for the whole chunk before splitting it.
+        :type chunklimit: :class:`int`
+        :param keyindex: keys known in advance, such as the keys of
+            the static objects that the chunks refer to, see
+            :func:`icat.dump_queries.getStaticKeyIndex`.  It is not
+            modified.
+        :type keyindex: :class:`dict`
+        """
+        searched = self._searchchunks(chunks, clients, window, chunksize)
+        try:
+            for objs in searched:
+                self.writedata(objs, keyindex=self._newkeyindex(keyindex),
+                               chunksize=chunksize, chunklimit=chunklimit)
+        finally:
+            searched.close()
+
+    def _searchchunks(self, chunks, clients, window, chunksize):
+        """Iterate over the chunks, searching them ahead concurrently.
+
+        If `clients` is set, yield the lists of objects searched for
+        each chunk by the worker threads in the original order of the
+        chunks.  Otherwise, yield the chunks unchanged.
+        """
+        if not clients:
+            for objs in chunks:
+                yield objs
+            return
+        pool = WorkerPool(clients, window=window, ordered=True)
+        try:
+            for objs in chunks:
+                if pool.pending() >= pool.window:
+                    yield pool.get()
+                pool.submit(self._fetchchunk, objs, chunksize)
+            while pool.pending():
+                yield pool.get()
+        finally:
+            pool.close()
 
 
 # ------------------------------------------------------------
 # Register of backends and open_dumpfile()
 # ------------------------------------------------------------
 
+entitytypes = [
+    'user',
+    'grouping',
+    'userGroup',
+    'rule',
+    'publicStep',
+    'facility',
+    'instrument',
+    'instrumentScientist',
+    'parameterType',
+    'permissibleStringValue',
+    'investigationType',
+    'sampleType',
+    'datasetType',
+    'datafileFormat',
+    'facilityCycle',
+    'application',
+    'investigation',
+    'investigationParameter',
+    'keyword',
+    'publication',
+    'shift',
+    'investigationGroup',
+    'investigationInstrument',
+    'investigationUser',
+    'sample',
+    'sampleParameter',
+    'dataset',
+    'datasetParameter',
+    'datafile',
+    'datafileParameter',
+    'study',
+    'studyInvestigation',
+    'relatedDatafile',
+    'dataCollection',
+    'dataCollectionParameter',
+    'dataCollectionDataset',
+    'dataCollectionDatafile',
+    'job',
+]
+"""The entity types in the order in which they must be restored.
+
+The names are the instance types of the entity objects.
+"""
+
+
 Backends = {}
 """A register of all known backends."""
 
@@ -295,7 +1474,8 @@ def register_backend(formatname, reader, writer):
     """
     Backends[formatname] = (reader, writer)
 
-def open_dumpfile(client, f, formatname, mode):
+def open_dumpfile(client, f, formatname, mode, compressthreads=None,
+                  index=False, chunks=None):
     """Open a data file, either for reading or for writing.
 
     Note that depending on the backend, the file must either be opened
@@ -303,7 +1483,9 @@ def open_dumpfile(client, f, formatname, mode):
     been opened in the appropriate mode according to the backend
     selected by formatname.  The backend classes define a
     corresponding class attribute `mode`.  If f is a file name, the
-    file will be opened in the appropriate mode.
+    file will be opened in the appropriate mode.  Compressed files are
+    supported for file names, see
+    :func:`icat.dumpfile.open_compressed`.
 
     The subclasses of :class:`icat.dumpfile.DumpFileReader` and
     :class:`icat.dumpfile.DumpFileWriter` may be used as context
@@ -318,15 +1500,25 @@ def open_dumpfile(client, f, formatname, mode):
     :type client: :class:`icat.client.Client`
     :param f: the object to read the data from or write the data to,
         according to mode.  What object types are supported depends on
-        the backend.  All backends support at least a file object or
-        the name of file.  The special value of "-" may be used as an
-        alias for :data:`sys.stdin` or :data:`sys.stdout`.
+        the backend.  All backends support at least the name of file,
+        most backends also a file object.  For those, the special
+        value of "-" may be used as an alias for :data:`sys.stdin` or
+        :data:`sys.stdout`.
     :param formatname: name of the file format that has been registered by
         the backend.
     :type formatname: :class:`str`
     :param mode: either "r" or "w" to indicate that the file should be
         opened for reading or writing respectively.
     :type mode: :class:`str`
+    :param compressthreads: number of threads to use for compressing
+        the data file when writing to a file name having the
+        extension of a compression format.
+    :type compressthreads: :class:`int`
+    :param index: when writing, whether to write a chunk index, see
+        :meth:`icat.dumpfile.DumpFileWriter.setindex`.
+    :type index: :class:`bool`
+    :param chunks: when reading, the numbers of the chunks to read,
+        see :attr:`icat.dumpfile.DumpFileReader.chunks`.
     :return: an instance of the appropriate class.  This is either the
         reader or the writer class, according to the mode, that has
         been registered by the backend.
@@ -337,10 +1529,21 @@ def open_dumpfile(client, f, formatname, mode):
         raise ValueError("Unknown data file format '%s'" % formatname)
     if mode == 'r':
         cls = Backends[formatname][0]
-        return cls(client, f)
+        reader = cls(client, f)
+        reader.chunks = chunks
+        return reader
     elif mode == 'w':
         cls = Backends[formatname][1]
-        return cls(client, f)
+        if (compressthreads and compressthreads > 1 and
+            isinstance(f, basestring) and _getcompression(f, mode)):
+            writer = cls(client, open_compressed(f, cls.mode,
+                                                 threads=compressthreads))
+            writer._closefile = True
+        else:
+            writer = cls(client, f)
+        if index:
+            writer.setindex()
+        return writer
     else:
         raise ValueError("Invalid file mode '%s'" % mode)
 
@@ -0,0 +1,364 @@
+"""JSON Lines data file backend for icatdump.py and icatingest.py.
+
+The data file consists of one JSON object per line.  The first line
+is a header with some meta information.  Each data chunk starts with
+a chunk marker, followed by one line for each object in the chunk,
+holding the entity type, the key, and the attributes of the object::
+
+    {"head":{"date":"...","service":"...","apiversion":"4.10",...}}
+    {"chunk":0}
+    {"type":"user","key":"User_name-db=2Fjdoe","obj":{"name":"db/jdoe",...}}
+    ...
+
+The objects are restored in the order in which they appear in the
+file.  If the `orjson`_ package is available, it is used to encode and
+decode JSON, otherwise the :mod:`json` module from the standard
+library.  The output is the same in either case.
+
+.. _orjson: https://github.com/ijl/orjson
+"""
+
+import sys
+import os
+from collections import OrderedDict
+import datetime
+import json
+import icat
+import icat.dumpfile
+try:
+    utc = datetime.timezone.utc
+except AttributeError:
+    try:
+        from suds.sax.date import UtcTimezone
+        utc = UtcTimezone()
+    except ImportError:
+        utc = None
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson:
+    _dumps = orjson.dumps
+    _loads = orjson.loads
+else:
+    def _dumps(obj):
+        s = json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+        if not isinstance(s, bytes):
+            s = s.encode('utf-8')
+        return s
+    def _loads(s):
+        if isinstance(s, bytes):
+            s = s.decode('utf-8')
+        return json.loads(s)
+
+def _sorteddict(d):
+    """Return a copy of a dict of attributes having sorted keys.
+    """
+    items = []
+    for k, v in sorted(d.items()):
+        if isinstance(v, list):
+            v = [ _sorteddict(rd) for rd in v ]
+        items.append((k, v))
+    return OrderedDict(items)
+
+
+# ------------------------------------------------------------
+# JSONLDumpFileReader
+# ------------------------------------------------------------
+
+class _JSONLChunk(object):
+    """A data chunk that is parsed while iterating over its objects.
+
+    Iterating over this object yields the object records from the
+    file until the next chunk marker.  The chunk can only be iterated
+    once.
+    """
+
+    def __init__(self, records):
+        self.records = records
+        self.done = False
+        self.nextmarker = None
+
+    def __iter__(self):
+        if self.done:
+            return
+        for rec in self.records:
+            if 'chunk' in rec:
+                self.nextmarker = rec
+                break
+            yield rec
+        self.done = True
+
+    def skip(self):
+        """Consume the remainder of the chunk."""
+        for rec in self:
+            pass
+
+
+class JSONLDumpFileReader(icat.dumpfile.DumpFileReader):
+    """Backend for reading ICAT data from a JSON Lines file."""
+
+    mode = "rb"
+    """File mode suitable for this backend.
+    """
+
+    indexable = True
+
+    def __init__(self, client, infile):
+        super(JSONLDumpFileReader, self).__init__(client, infile)
+        if client is not None:
+            self.insttypemap = { c.BeanName:t
+                                 for t,c in self.client.typemap.iteritems() }
+
+    def _file_open(self, filename):
+        if filename == "-":
+            f = os.fdopen(os.dup(sys.stdin.fileno()), self.mode)
+            sys.stdin.close()
+            return f
+        else:
+            return icat.dumpfile.open_compressed(filename, self.mode)
+
+    def _dict2entity(self, d, objtype, objindex):
+        """Create an entity object from a dict of attributes."""
+        obj = self.client.new(objtype)
+        for k in d:
+            attr = k
+            if attr in obj.AttrAlias:
+                attr = obj.AttrAlias[attr]
+            if attr in obj.InstAttr:
+                setattr(obj, attr, d[k])
+            elif attr in obj.InstRel:
+                robj = self.client.searchUniqueKey(d[k], objindex)
+                setattr(obj, attr, robj)
+            elif attr in obj.InstMRel:
+                rtype = self.insttypemap[obj.getAttrType(attr)]
+                for rd in d[k]:
+                    robj = self._dict2entity(rd, rtype, objindex)
+                    getattr(obj, attr).append(robj)
+            else:
+                raise ValueError("invalid attribute '%s' in '%s'"
+                                 % (k, objtype))
+        return obj
+
+    def _records(self):
+        """Iterate over the records in the data file."""
+        for line in self.infile:
+            if line.strip():
+                yield _loads(line)
+
+    def getdata(self):
+        """Iterate over the chunks in the data file.
+
+        The chunks are parsed lazily while iterating over their
+        objects, so that only one object at a time needs to be kept
+        in memory.
+        """
+        records = self._records()
+        rec = next(records, None)
+        if rec is not None and 'head' in rec:
+            rec = next(records, None)
+        while rec is not None:
+            if 'chunk' not in rec:
+                raise RuntimeError("Missing chunk marker in the data.")
+            data = _JSONLChunk(records)
+            yield data
+            data.skip()
+            rec = data.nextmarker
+
+    def detachdata(self, data):
+        """Return a data chunk that stays valid after the iteration.
+
+        Read the remaining objects of the chunk into a list.
+        """
+        if isinstance(data, _JSONLChunk):
+            return list(data)
+        else:
+            return data
+
+    def _parsechunk(self, buf):
+        records = [ _loads(l) for l in buf.splitlines() if l.strip() ]
+        if not records or 'chunk' not in records[0]:
+            raise RuntimeError("Missing chunk marker in the data.")
+        return records[1:]
+
+    def _hasrefs(self, data):
+        return bool(data) and data[0]['type'].endswith("Ref")
+
+    def getrecords_from_data(self, data, refs=False):
+        """Iterate over the records of the objects in a data chunk.
+        """
+        for rec in data:
+            if rec.get('obj') is not None:
+                yield rec['type'], rec['key'], rec['obj']
+            elif refs:
+                yield rec['type'][:-3], rec['key'], None
+
+    def getobjs_from_data(self, data, objindex):
+        """Iterate over the objects in a data chunk.
+
+        Yield a new entity object in each iteration.  The object is
+        initialized from the data, but not yet created at the client.
+        """
+        for rec in data:
+            name = rec['type']
+            if name.endswith("Ref") and name[:-3] in self.client.typemap:
+                # rec is a reference to an already existing object.
+                # Do not yield it, but add it to the objindex.
+                key = rec['key']
+                objindex[key] = self.client.searchUniqueKey(key, objindex)
+                continue
+            if name not in self.client.typemap:
+                raise RuntimeError("Unknown entry %s in the data." % name)
+            obj = self._dict2entity(rec['obj'], name, objindex)
+            yield rec['key'], obj
+
+
+# ------------------------------------------------------------
+# JSONLDumpFileWriter
+# ------------------------------------------------------------
+
+class JSONLDumpFileWriter(icat.dumpfile.DumpFileWriter):
+    """Backend for writing ICAT data to a JSON Lines file."""
+
+    mode = "wb"
+    """File mode suitable for this backend.
+    """
+
+    indexable = True
+
+    def __init__(self, client, outfile):
+        super(JSONLDumpFileWriter, self).__init__(client, outfile)
+        self.datastarted = False
+        self.chunkcount = 0
+
+    def _file_open(self, filename):
+        if filename == "-":
+            f = os.fdopen(os.dup(sys.stdout.fileno()), self.mode)
+            sys.stdout.close()
+            return f
+        else:
+            return icat.dumpfile.open_compressed(filename, self.mode)
+
+    def _entity2dict(self, obj, keyindex):
+        """Convert an entity object to a dict, having sorted keys."""
+        d = {}
+        for attr in obj.InstAttr:
+            if attr == 'id':
+                continue
+            v = getattr(obj, attr, None)
+            if v is None:
+                continue
+            elif isinstance(v, bool):
+                pass
+            elif isinstance(v, (int, long)):
+                v = int(v)
+            elif isinstance(v, datetime.datetime):
+                if v.tzinfo is not None and v.tzinfo.utcoffset(v) is not None:
+                    # v has timezone info.  This will be the timezone set
+                    # in the ICAT server.  Convert it to UTC to avoid
+                    # dependency of server settings in the dumpfile.
+                    # Assume v.isoformat() to have a valid timezone
+                    # suffix.
+                    if utc:
+                        v = v.astimezone(utc)
+                    v = v.isoformat()
+                else:
+                    # v has no timezone info, assume it to be UTC, append
+                    # the corresponding timezone suffix.
+                    v = v.isoformat() + 'Z'
+            else:
+                try:
+                    v = str(v)
+                except UnicodeError:
+                    v = unicode(v)
+            d[attr] = v
+        for attr in obj.InstRel:
+            o = getattr(obj, attr, None)
+            if o is not None:
+                d[attr] = o.getUniqueKey(keyindex=keyindex)
+        for attr in obj.InstMRel:
+            if len(getattr(obj, attr)) > 0:
+                d[attr] = []
+                for o in sorted(getattr(obj, attr),
+                                key=icat.entity.Entity.__sortkey__):
+                    d[attr].append(self._entity2dict(o, keyindex=keyindex))
+        return OrderedDict(sorted(d.items()))
+
+    def _writerecord(self, rec):
+        self.outfile.write(_dumps(rec) + b"\n")
+
+    def head(self):
+        """Write a header with some meta information to the data file."""
+        date = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S+00:00")
+        head = OrderedDict([
+            ("date", date),
+            ("service", self.client.url),
+            ("apiversion", str(self.client.apiversion)),
+            ("generator", "icatdump (python-icat %s)" % icat.__version__),
+        ])
+        self._writerecord({"head": head})
+
+    def startdata(self):
+        """Start a new data chunk.
+        """
+        self.datastarted = False
+
+    def _startchunk(self, isref=False):
+        self._indexobj(not self.datastarted, isref=isref)
+        if not self.datastarted:
+            self._writerecord({"chunk": self.chunkcount})
+            self.chunkcount += 1
+            self.datastarted = True
+
+    def writeobj(self, key, obj, keyindex):
+        """Add an entity object to the current data chunk.
+
+        The object is written to the data file right away.
+        """
+        self._startchunk()
+        rec = OrderedDict([
+            ("type", obj.instancetype),
+            ("key", key),
+            ("obj", self._entity2dict(obj, keyindex)),
+        ])
+        self._writerecord(rec)
+
+    def writeref(self, key, obj):
+        """Add a reference to an entity object to the current data chunk.
+
+        The reference is written as a record having the entity type
+        with `Ref` appended and the key of the object.
+        """
+        self._startchunk(isref=True)
+        rec = OrderedDict([
+            ("type", "%sRef" % obj.instancetype),
+            ("key", key),
+        ])
+        self._writerecord(rec)
+
+    def writerecord(self, name, key, d, schema):
+        """Add a record of an object to the current data chunk.
+        """
+        if d is None:
+            self._startchunk(isref=True)
+            rec = OrderedDict([
+                ("type", "%sRef" % name),
+                ("key", key),
+            ])
+        else:
+            self._startchunk()
+            rec = OrderedDict([
+                ("type", name),
+                ("key", key),
+                ("obj", _sorteddict(d)),
+            ])
+        self._writerecord(rec)
+
+    def finalize(self):
+        """Finalize the data file."""
+        self.startdata()
+
+
+icat.dumpfile.register_backend("JSONL", JSONLDumpFileReader,
+                               JSONLDumpFileWriter)
@@ -0,0 +1,135 @@
+"""In-memory queue backend for copying ICAT content between servers.
+
+This backend does not write a data file, but passes the data chunks
+through a :class:`Queue.Queue` from a writer to a reader that
+typically run in different threads.  This allows to create the
+objects at a target ICAT server while the objects are still being
+searched at the source, without the detour through a data file.
+
+The chunks are passed as lists of the same records as written by
+:mod:`icat.dumpfile_jsonl`, but without encoding them as JSON.  If
+the queue has a maximum size, the writer blocks when the reader falls
+behind, so the number of chunks kept in memory is bounded.
+"""
+
+from icat.dumpfile_jsonl import JSONLDumpFileReader, JSONLDumpFileWriter
+
+
+class _WriterError(object):
+    """Marks the failure of the writer in the queue."""
+    def __init__(self, exc):
+        self.exc = exc
+
+
+def put_error(queue, exc):
+    """Mark the failure of the writer in the queue.
+
+    The exception is raised in the reader.  This is meant for errors
+    that occur outside of :class:`~icat.dumpfile_queue.QueueDumpFileWriter`,
+    such as while setting it up, that would otherwise leave the
+    reader waiting for data forever.
+
+    :param queue: the queue the writer puts the data chunks into.
+    :type queue: :class:`Queue.Queue`
+    :param exc: the exception to raise in the reader.
+    :type exc: :exc:`Exception`
+    """
+    queue.put(_WriterError(exc))
+
+
+# ------------------------------------------------------------
+# QueueDumpFileReader
+# ------------------------------------------------------------
+
+class QueueDumpFileReader(JSONLDumpFileReader):
+    """Backend for reading ICAT data from a queue.
+
+    :param client: the client to create the objects with.
+    :type client: :class:`icat.client.Client`
+    :param queue: the queue to get the data chunks from.
+    :type queue: :class:`Queue.Queue`
+    """
+
+    indexable = False
+
+    def getdata(self):
+        """Iterate over the chunks in the queue.
+
+        Stop when the writer has finished.  If the writer failed, the
+        exception is raised here.
+        """
+        while True:
+            data = self.infile.get()
+            if data is None:
+                break
+            elif isinstance(data, _WriterError):
+                raise data.exc
+            yield data
+
+
+# ------------------------------------------------------------
+# QueueDumpFileWriter
+# ------------------------------------------------------------
+
+class QueueDumpFileWriter(JSONLDumpFileWriter):
+    """Backend for writing ICAT data to a queue.
+
+    Each data chunk is put into the queue as a list of records once
+    it is complete.  The end of the data is marked by putting
+    :const:`None` into the queue.  If the writer fails, including
+    while writing the head on entering the context, the exception is
+    put into the queue instead, so that it is raised in the reader.
+    The attribute `closed` is set once either has been put into the
+    queue.
+
+    :param client: the client to search the objects with.
+    :type client: :class:`icat.client.Client`
+    :param queue: the queue to put the data chunks into.
+    :type queue: :class:`Queue.Queue`
+    """
+
+    indexable = False
+
+    def __init__(self, client, queue):
+        super(QueueDumpFileWriter, self).__init__(client, queue)
+        self.chunk = None
+        self.closed = False
+
+    def _close(self, item):
+        self.outfile.put(item)
+        self.closed = True
+
+    def __enter__(self):
+        try:
+            return super(QueueDumpFileWriter, self).__enter__()
+        except Exception as e:
+            self._close(_WriterError(e))
+            raise
+
+    def __exit__(self, type, value, traceback):
+        try:
+            super(QueueDumpFileWriter, self).__exit__(type, value, traceback)
+        except Exception as e:
+            if not self.closed:
+                self._close(_WriterError(e))
+            raise
+        if type is not None and not self.closed:
+            self._close(_WriterError(value))
+
+    def _putchunk(self):
+        if self.chunk is not None:
+            self.outfile.put(self.chunk)
+            self.chunk = None
+
+    def _writerecord(self, rec):
+        if 'chunk' in rec:
+            self._putchunk()
+            self.chunk = []
+        elif 'head' not in rec:
+            self.chunk.append(rec)
+
+    def finalize(self):
+        """Put the last chunk and the end marker into the queue."""
+        super(QueueDumpFileWriter, self).finalize()
+        self._putchunk()
+        self._close(None)
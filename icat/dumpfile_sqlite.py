@@ -0,0 +1,296 @@
+"""SQLite data file backend for icatdump.py and icatingest.py.
+
+The data file is a SQLite database.  The objects are stored in the
+table `objects`, one row per object, having the number of the chunk,
+the entity type, the key, and the attributes of the object encoded
+in JSON in the same way as in the JSON Lines backend.  The table
+`head` holds some meta information as name and value pairs.
+
+In contrast to the other backends, this backend allows random access
+to the data: a single chunk or a single object may be read directly
+without reading the data file from the start.  Only file names are
+supported, not file objects or the special value "-" for standard
+input or output.
+"""
+
+import os
+import threading
+import datetime
+import sqlite3
+import icat
+import icat.dumpfile
+from icat.dumpfile_jsonl import (_dumps, _loads, _sorteddict,
+                                 JSONLDumpFileReader, JSONLDumpFileWriter)
+
+_schema = """
+CREATE TABLE head (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE objects (
+    seq INTEGER PRIMARY KEY,
+    chunk INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    key TEXT,
+    obj TEXT NOT NULL
+);
+"""
+
+_indexes = """
+CREATE INDEX IF NOT EXISTS objects_chunk ON objects (chunk);
+CREATE INDEX IF NOT EXISTS objects_type ON objects (type);
+CREATE INDEX IF NOT EXISTS objects_key ON objects (key);
+"""
+
+
+# ------------------------------------------------------------
+# SQLiteDumpFileReader
+# ------------------------------------------------------------
+
+class SQLiteDumpFileReader(JSONLDumpFileReader):
+    """Backend for reading ICAT data from a SQLite database file.
+
+    The data chunks yielded by
+    :meth:`~icat.dumpfile_sqlite.SQLiteDumpFileReader.getdata` are
+    the chunk numbers.  They may also be passed directly to
+    :meth:`~icat.dumpfile.DumpFileReader.getobjs_from_data` in order
+    to read a single chunk.  Each thread uses its own database
+    connection, so that several threads may read chunks in parallel.
+    All these connections are closed when the reader is closed.
+    """
+
+    mode = "rb"
+    """File mode suitable for this backend.
+
+    Only used to check that the file can be opened.
+    """
+
+    indexable = False
+
+    def __init__(self, client, infile):
+        if not isinstance(infile, basestring):
+            raise TypeError("The SQLite backend needs a file name.")
+        self._local = threading.local()
+        self._connections = []
+        self._connlock = threading.Lock()
+        super(SQLiteDumpFileReader, self).__init__(client, infile)
+
+    def __exit__(self, type, value, traceback):
+        with self._connlock:
+            connections = self._connections
+            self._connections = []
+        for conn in connections:
+            conn.close()
+
+    def _file_open(self, filename):
+        if filename == "-":
+            raise ValueError("The SQLite backend cannot read from stdin.")
+        # Raise the appropriate error if the file does not exist,
+        # rather then creating an empty database.
+        open(filename, self.mode).close()
+        return self._connection()
+
+    def _connection(self):
+        """Return the database connection for the current thread."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # Each connection is only used in its own thread, but it
+            # is closed from the thread closing the reader.
+            conn = sqlite3.connect(self.filename, check_same_thread=False)
+            self._local.conn = conn
+            with self._connlock:
+                self._connections.append(conn)
+        return conn
+
+    def _chunkrecords(self, chunk):
+        """Iterate over the records of the objects in a chunk."""
+        cur = self._connection().execute("SELECT type, key, obj "
+                                         "FROM objects WHERE chunk = ? "
+                                         "ORDER BY seq", (chunk,))
+        for name, key, obj in cur:
+            yield {'type': name, 'key': key, 'obj': _loads(obj)}
+
+    def _hasrefs(self, data):
+        cur = self._connection().execute("SELECT type FROM objects "
+                                         "WHERE chunk = ? ORDER BY seq "
+                                         "LIMIT 1", (data,))
+        row = cur.fetchone()
+        return bool(row) and row[0].endswith("Ref")
+
+    def gethead(self):
+        """Return the meta information from the data file as a dict.
+        """
+        cur = self._connection().execute("SELECT name, value FROM head")
+        return dict(cur)
+
+    def getdata(self):
+        """Iterate over the chunks in the data file.
+
+        Yield the number of each chunk.
+        """
+        cur = self._connection().execute("SELECT DISTINCT chunk "
+                                         "FROM objects ORDER BY chunk")
+        for n in [ row[0] for row in cur ]:
+            yield n
+
+    def findchunk(self, key):
+        """Return the number of the chunk having the object with key.
+
+        :param key: the key of the object.
+        :type key: :class:`str`
+        :return: the chunk number or :const:`None` if no object with
+            that key is found.
+        :rtype: :class:`int`
+        """
+        cur = self._connection().execute("SELECT chunk FROM objects "
+                                         "WHERE key = ?", (key,))
+        row = cur.fetchone()
+        return row[0] if row else None
+
+    def getobj(self, key, objindex):
+        """Read a single object from the data file.
+
+        :param key: the key of the object.
+        :type key: :class:`str`
+        :param objindex: cache of previously retrieved objects, used
+            to resolve the references to other objects.
+        :type objindex: :class:`dict`
+        :return: a new entity object, initialized from the data, but
+            not yet created at the client.
+        :rtype: :class:`icat.entity.Entity`
+        :raise KeyError: if no object with that key is found.
+        """
+        cur = self._connection().execute("SELECT type, obj FROM objects "
+                                         "WHERE key = ?", (key,))
+        row = cur.fetchone()
+        if not row:
+            raise KeyError(key)
+        return self._dict2entity(_loads(row[1]), row[0], objindex)
+
+    def getobjs_from_data(self, data, objindex):
+        """Iterate over the objects in a data chunk.
+
+        Yield a new entity object in each iteration.  The object is
+        initialized from the data, but not yet created at the client.
+        """
+        records = self._chunkrecords(data)
+        return super(SQLiteDumpFileReader, self).getobjs_from_data(records,
+                                                                   objindex)
+
+    def getrecords_from_data(self, data, refs=False):
+        """Iterate over the records of the objects in a data chunk.
+        """
+        records = self._chunkrecords(data)
+        return super(SQLiteDumpFileReader, self).getrecords_from_data(records,
+                                                                      refs)
+
+
+# ------------------------------------------------------------
+# SQLiteDumpFileWriter
+# ------------------------------------------------------------
+
+class SQLiteDumpFileWriter(JSONLDumpFileWriter):
+    """Backend for writing ICAT data to a SQLite database file.
+
+    The objects are inserted into the database as they are added and
+    committed in transactions of
+    :attr:`~icat.dumpfile_sqlite.SQLiteDumpFileWriter.commitsize`
+    objects and at the end of each chunk.  The indexes are created
+    when finalizing the data file.
+    """
+
+    mode = "wb"
+    """File mode suitable for this backend.
+
+    Not used, as the database is written by :mod:`sqlite3`.
+    """
+
+    indexable = False
+
+    commitsize = 1000
+    """Maximum number of objects to insert in one transaction.
+    """
+
+    def __init__(self, client, outfile):
+        if not isinstance(outfile, basestring):
+            raise TypeError("The SQLite backend needs a file name.")
+        super(SQLiteDumpFileWriter, self).__init__(client, outfile)
+        self.pending = 0
+
+    def _file_open(self, filename):
+        if filename == "-":
+            raise ValueError("The SQLite backend cannot write to stdout.")
+        if os.path.exists(filename):
+            os.remove(filename)
+        conn = sqlite3.connect(filename)
+        # There is no point in protecting an incomplete data file
+        # against system crashes.
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.executescript(_schema)
+        return conn
+
+    def _commit(self):
+        self.outfile.commit()
+        self.pending = 0
+
+    def head(self):
+        """Write a header with some meta information to the data file."""
+        date = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S+00:00")
+        head = [
+            ("date", date),
+            ("service", self.client.url),
+            ("apiversion", str(self.client.apiversion)),
+            ("generator", "icatdump (python-icat %s)" % icat.__version__),
+        ]
+        self.outfile.executemany("INSERT INTO head (name, value) "
+                                 "VALUES (?, ?)", head)
+        self._commit()
+
+    def startdata(self):
+        """Start a new data chunk.
+
+        Commit the objects from the current chunk.
+        """
+        if self.pending:
+            self._commit()
+        self.datastarted = False
+
+    def _insert(self, name, key, objdata):
+        if not self.datastarted:
+            self.chunkcount += 1
+            self.datastarted = True
+        self.outfile.execute("INSERT INTO objects (chunk, type, key, obj) "
+                             "VALUES (?, ?, ?, ?)",
+                             (self.chunkcount - 1, name, key, objdata))
+        self.pending += 1
+        if self.pending >= self.commitsize:
+            self._commit()
+
+    def writeobj(self, key, obj, keyindex):
+        """Add an entity object to the current data chunk."""
+        objdata = _dumps(self._entity2dict(obj, keyindex)).decode('utf-8')
+        self._insert(obj.instancetype, key, objdata)
+
+    def writeref(self, key, obj):
+        """Add a reference to an entity object to the current data chunk.
+        """
+        self._insert("%sRef" % obj.instancetype, key, "null")
+
+    def writerecord(self, name, key, d, schema):
+        """Add a record of an object to the current data chunk.
+        """
+        if d is None:
+            self._insert("%sRef" % name, key, "null")
+        else:
+            objdata = _dumps(_sorteddict(d)).decode('utf-8')
+            self._insert(name, key, objdata)
+
+    def finalize(self):
+        """Finalize the data file."""
+        self.startdata()
+        self.outfile.executescript(_indexes)
+        self._commit()
+
+
+icat.dumpfile.register_backend("SQLITE", SQLiteDumpFileReader,
+                               SQLiteDumpFileWriter)
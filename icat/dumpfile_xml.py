@@ -3,6 +3,7 @@
 
 import sys
 import os
+import copy
 import datetime
 from lxml import etree
 import icat
@@ -22,6 +23,41 @@ except AttributeError:
 # XMLDumpFileReader
 # ------------------------------------------------------------
 
+class _XMLChunk(object):
+    """A data chunk that is parsed while iterating over its objects.
+
+    Iterating over this object yields the child elements of the data
+    element as soon as they have been parsed completely.  Each element
+    is cleared and removed from the tree when the iteration proceeds.
+    The chunk can only be iterated once.
+    """
+
+    def __init__(self, events, data):
+        self.events = events
+        self.data = data
+        self.done = False
+
+    def __iter__(self):
+        if self.done:
+            return
+        for event, elem in self.events:
+            if event != 'end':
+                continue
+            if elem is self.data:
+                break
+            if elem.getparent() is self.data:
+                yield elem
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del self.data[0]
+        self.done = True
+
+    def skip(self):
+        """Consume the remainder of the chunk."""
+        for elem in self:
+            pass
+
+
 class XMLDumpFileReader(icat.dumpfile.DumpFileReader):
     """Backend for reading ICAT data from a XML file.
 
@@ -35,10 +71,13 @@ class XMLDumpFileReader(icat.dumpfile.DumpFileReader):
     """File mode suitable for this backend.
     """
 
+    indexable = True
+
     def __init__(self, client, infile):
         super(XMLDumpFileReader, self).__init__(client, infile)
-        self.insttypemap = { c.BeanName:t 
-                             for t,c in self.client.typemap.iteritems() }
+        if client is not None:
+            self.insttypemap = { c.BeanName:t 
+                                 for t,c in self.client.typemap.iteritems() }
         if isinstance(self.infile, etree._ElementTree):
             self.getdata = self.getdata_etree
         else:
@@ -51,7 +90,7 @@ class XMLDumpFileReader(icat.dumpfile.DumpFileReader):
             sys.stdin.close()
             return f
         else:
-            return open(filename, self.mode)
+            return icat.dumpfile.open_compressed(filename, self.mode)
 
     def _searchByReference(self, element, objtype, objindex):
         """Search for a referenced object.
@@ -89,12 +128,46 @@ class XMLDumpFileReader(icat.dumpfile.DumpFileReader):
                                  % (subelem.tag, element.tag))
         return obj
 
+    def _elem2dict(self, element):
+        """Convert XML element data to a dict of attributes."""
+        d = {}
+        for subelem in element:
+            if not isinstance(subelem.tag, basestring):
+                continue
+            attr = subelem.tag
+            if len(subelem):
+                # embedded object in a one to many relation.
+                d.setdefault(attr, []).append(self._elem2dict(subelem))
+            elif subelem.get('ref'):
+                d[attr] = subelem.get('ref')
+            elif subelem.keys():
+                # related object referenced by attributes.
+                d[attr] = dict(subelem.attrib)
+            else:
+                d[attr] = subelem.text
+        return d
+
     def getdata_file(self):
         """Iterate over the chunks in the data file.
+
+        The chunks are parsed lazily while iterating over their
+        objects.  Elements that have been processed are removed from
+        the tree, so that the memory consumption does not depend on
+        the size of the chunks.
         """
-        for event, data in etree.iterparse(self.infile, tag='data'):
-            yield data
-            data.clear()
+        events = etree.iterparse(self.infile, events=('start', 'end'))
+        for event, elem in events:
+            if event != 'start' or elem.tag != 'data':
+                continue
+            root = elem.getparent()
+            if root is None or root.getparent() is not None:
+                continue
+            chunk = _XMLChunk(events, elem)
+            yield chunk
+            chunk.skip()
+            elem.clear()
+            while elem.getprevious() is not None:
+                del root[0]
 
     def getdata_etree(self):
         """Iterate over the chunks from a XML tree object.
@@ -103,6 +176,42 @@ class XMLDumpFileReader(icat.dumpfile.DumpFileReader):
             if elem.tag == 'data':
                 yield elem
 
+    def detachdata(self, data):
+        """Return a data chunk that stays valid after the iteration.
+
+        :meth:`~icat.dumpfile_xml.XMLDumpFileReader.getdata_file`
+        parses the chunk while iterating and clears the elements once
+        the iteration proceeds, so read the complete chunk into a new
+        element in this case.
+        """
+        if isinstance(data, _XMLChunk):
+            elem = etree.Element("data")
+            for objelem in data:
+                elem.append(copy.deepcopy(objelem))
+            return elem
+        else:
+            return data
+
+    def _parsechunk(self, buf):
+        return etree.fromstring(buf)
+
+    def _hasrefs(self, data):
+        for elem in data:
+            if isinstance(elem.tag, basestring):
+                return elem.tag.endswith("Ref")
+        return False
+
+    def getrecords_from_data(self, data, refs=False):
+        """Iterate over the records of the objects in a data chunk.
+        """
+        for elem in data:
+            if not isinstance(elem.tag, basestring):
+                continue
+            elif not elem.tag.endswith("Ref"):
+                yield elem.tag, elem.get('id'), self._elem2dict(elem)
+            elif refs:
+                yield elem.tag[:-3], elem.get('id'), None
+
     def getobjs_from_data(self, data, objindex):
         """Iterate over the objects in a data chunk.
 
@@ -138,9 +247,11 @@ class XMLDumpFileWriter(icat.dumpfile.DumpFileWriter):
     """File mode suitable for this backend.
     """
 
+    indexable = True
+
     def __init__(self, client, outfile):
         super(XMLDumpFileWriter, self).__init__(client, outfile)
-        self.data = etree.Element("data")
+        self.datastarted = False
 
     def _file_open(self, filename):
         if filename == "-":
@@ -149,7 +260,7 @@ class XMLDumpFileWriter(icat.dumpfile.DumpFileWriter):
             sys.stdout.close()
             return f
         else:
-            return open(filename, self.mode)
+            return icat.dumpfile.open_compressed(filename, self.mode)
 
     def _entity2elem(self, obj, tag, keyindex):
         """Convert an entity object to an etree.Element."""
@@ -211,25 +322,105 @@ class XMLDumpFileWriter(icat.dumpfile.DumpFileWriter):
 """)
         self.outfile.write(etree.tostring(head, pretty_print=True))
 
+    def _dict2elem(self, d, name, tag, schema):
+        """Convert a dict of attributes to an etree.Element."""
+        elem = etree.Element(tag)
+        attrs = { 'attr': [], 'rel': [], 'mrel': [] }
+        for attr in d:
+            kind, rtype = schema.getattrtype(name, attr)
+            attrs[kind].append((attr, rtype))
+        for attr, atype in sorted(attrs['attr']):
+            v = d[attr]
+            if v is None:
+                continue
+            elif isinstance(v, bool):
+                v = str(v).lower()
+            elif not isinstance(v, basestring):
+                v = str(v)
+            etree.SubElement(elem, attr).text = v
+        for attr, rtype in sorted(attrs['rel']):
+            if d[attr] is not None:
+                etree.SubElement(elem, attr, ref=d[attr])
+        for attr, rtype in sorted(attrs['mrel']):
+            for rd in d[attr]:
+                elem.append(self._dict2elem(rd, rtype, attr, schema))
+        return elem
+
+    def _elem2bytes(self, elem):
+        """Serialize an object element as it appears in a data chunk.
+
+        The element is serialized inside a temporary data element, so
+        that the indentation is the same as if the whole chunk would
+        be serialized at once.  The enclosing tags are stripped from
+        the result.
+        """
+        data = etree.Element("data")
+        data.append(elem)
+        s = etree.tostring(data, pretty_print=True)
+        return s[len(b"<data>\n"):-len(b"</data>\n")]
+
     def startdata(self):
         """Start a new data chunk.
 
-        If the current chunk contains any data, write it to the data
+        If the current chunk contains any data, close it in the data
         file.
         """
-        if len(self.data) > 0:
-            self.outfile.write(etree.tostring(self.data, pretty_print=True))
-        self.data = etree.Element("data")
+        if self.datastarted:
+            self.outfile.write(b"</data>\n")
+            self.datastarted = False
+
+    def _writeelem(self, elem, isref=False):
+        """Write an object element to the current data chunk.
+
+        The chunk is opened in the data file if this is its first
+        element.
+        """
+        self._indexobj(not self.datastarted, isref=isref)
+        if not self.datastarted:
+            self.outfile.write(b"<data>\n")
+            self.datastarted = True
+        self.outfile.write(self._elem2bytes(elem))
+
+    def _refelem(self, name, key):
+        """Create an element referencing an object by its key.
+        """
+        elem = etree.Element("%sRef" % name)
+        elem.set('id', key)
+        elem.set('ref', key)
+        return elem
 
     def writeobj(self, key, obj, keyindex):
-        """Add an entity object to the current data chunk."""
+        """Add an entity object to the current data chunk.
+
+        The object is written to the data file right away.
+        """
         elem = self._entity2elem(obj, None, keyindex)
         elem.set('id', key)
-        self.data.append(elem)
+        self._writeelem(elem)
+
+    def writeref(self, key, obj):
+        """Add a reference to an entity object to the current data chunk.
+
+        The reference is written as an element having the name of
+        the entity type with `Ref` appended, referencing the object by
+        its key.
+        """
+        self._writeelem(self._refelem(obj.instancetype, key), isref=True)
+
+    def writerecord(self, name, key, d, schema):
+        """Add a record of an object to the current data chunk.
+        """
+        if d is None:
+            self._writeelem(self._refelem(name, key), isref=True)
+        else:
+            elem = self._dict2elem(d, name, name, schema)
+            elem.set('id', key)
+            self._writeelem(elem)
 
     def finalize(self):
         """Finalize the data file."""
         self.startdata()
+        self._indexend()
         self.outfile.write(b"</icatdata>\n")
 
 
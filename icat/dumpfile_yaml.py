@@ -3,9 +3,11 @@
 
 import sys
 import datetime
+import re
 import yaml
 import icat
 import icat.dumpfile
+from icat.dumpfile import entitytypes
 try:
     utc = datetime.timezone.utc
 except AttributeError:
@@ -15,55 +17,227 @@ except AttributeError:
     except ImportError:
         utc = None
 
+# Use the LibYAML bindings if available, as these are much faster
+# than the pure Python implementation.
+try:
+    from yaml import CSafeLoader as Loader, CSafeDumper as Dumper
+except ImportError:
+    from yaml import SafeLoader as Loader, SafeDumper as Dumper
+
+# The LibYAML emitter differs from the pure Python emitter in the way
+# long double quoted scalars are folded and in the maximum length of
+# simple keys.  Strings are emitted double quoted only if they contain
+# characters other than printable ASCII.
+_specialchar_re = re.compile(r'[^\x20-\x7e]')
+_linestart_re = re.compile(r'^(?=.)', re.MULTILINE)
+
+def _isplain(data, iskey=False):
+    """Check whether the LibYAML emitter would format data the same
+    way as the pure Python emitter.
+    """
+    if isinstance(data, dict):
+        return all(_isplain(k, iskey=True) and _isplain(v)
+                   for k, v in data.iteritems())
+    elif isinstance(data, list):
+        return all(_isplain(v) for v in data)
+    elif isinstance(data, basestring):
+        if iskey and 120 <= len(data) <= 130:
+            return False
+        return not _specialchar_re.search(data)
+    else:
+        return True
 
-# List of entity types.  This defines in particular the order in which
-# the types must be restored.
-entitytypes = [
-    'user',
-    'grouping',
-    'userGroup',
-    'rule',
-    'publicStep',
-    'facility',
-    'instrument',
-    'instrumentScientist',
-    'parameterType',
-    'permissibleStringValue',
-    'investigationType',
-    'sampleType',
-    'datasetType',
-    'datafileFormat',
-    'facilityCycle',
-    'application',
-    'investigation',
-    'investigationParameter',
-    'keyword',
-    'publication',
-    'shift',
-    'investigationGroup',
-    'investigationInstrument',
-    'investigationUser',
-    'sample',
-    'sampleParameter',
-    'dataset',
-    'datasetParameter',
-    'datafile',
-    'datafileParameter',
-    'study',
-    'studyInvestigation',
-    'relatedDatafile',
-    'dataCollection',
-    'dataCollectionParameter',
-    'dataCollectionDataset',
-    'dataCollectionDatafile',
-    'job',
-]
+def _dumpobj(key, d):
+    """Format one object as an entry in the mapping of its entity type.
+
+    The result is the same as the corresponding part of the output
+    from dumping the whole chunk at once.  The object is formatted at
+    the top level and indented afterwards, reducing the line width
+    accordingly.  This allows to use the LibYAML emitter for all
+    objects, but those that it would format differently.
+    """
+    data = {key: d}
+    dumper = Dumper if _isplain(data) else yaml.SafeDumper
+    text = yaml.dump(data, Dumper=dumper,
+                     default_flow_style=False, width=78)
+    return _linestart_re.sub("  ", text)
 
 
 # ------------------------------------------------------------
 # YAMLDumpFileReader
 # ------------------------------------------------------------
 
+# The header line declaring that the entity types in each chunk are
+# in the order in which they must be restored.
+_orderhead = "# Order: restore"
+_orderhead_re = re.compile(r'#\s*Order\s*:\s*restore\s*$')
+
+def _isrefname(name):
+    """Check whether name is the entry for references to an entity type.
+    """
+    return name.endswith("Ref") and name[:-3] in entitytypes
+
+def _isordered(names):
+    """Check whether the entity types are in the order of entitytypes.
+
+    Entries for references may only appear before all entity types.
+    """
+    refs = [ n for n in names if _isrefname(n) ]
+    if names[:len(refs)] != refs:
+        return False
+    try:
+        idx = [entitytypes.index(n) for n in names[len(refs):]]
+    except ValueError:
+        return False
+    return idx == sorted(idx)
+
+def _compose(loader, anchors):
+    """Compose the next node from the events of loader.
+
+    This is a simplified version of yaml.composer.Composer that
+    works on the parser level, such that it may be used to compose
+    parts of a document.
+    """
+    event = loader.get_event()
+    if isinstance(event, yaml.AliasEvent):
+        if event.anchor not in anchors:
+            raise yaml.composer.ComposerError(None, None,
+                                              "found undefined alias %r"
+                                              % event.anchor,
+                                              event.start_mark)
+        return anchors[event.anchor]
+    if isinstance(event, yaml.ScalarEvent):
+        tag = event.tag
+        if tag is None or tag == '!':
+            tag = loader.resolve(yaml.ScalarNode, event.value,
+                                 event.implicit)
+        node = yaml.ScalarNode(tag, event.value,
+                               event.start_mark, event.end_mark,
+                               style=event.style)
+    elif isinstance(event, yaml.SequenceStartEvent):
+        tag = event.tag
+        if tag is None or tag == '!':
+            tag = loader.resolve(yaml.SequenceNode, None, event.implicit)
+        node = yaml.SequenceNode(tag, [], event.start_mark, None,
+                                 flow_style=event.flow_style)
+        while not loader.check_event(yaml.SequenceEndEvent):
+            node.value.append(_compose(loader, anchors))
+        node.end_mark = loader.get_event().end_mark
+    elif isinstance(event, yaml.MappingStartEvent):
+        tag = event.tag
+        if tag is None or tag == '!':
+            tag = loader.resolve(yaml.MappingNode, None, event.implicit)
+        node = yaml.MappingNode(tag, [], event.start_mark, None,
+                                flow_style=event.flow_style)
+        while not loader.check_event(yaml.MappingEndEvent):
+            key = _compose(loader, anchors)
+            value = _compose(loader, anchors)
+            node.value.append((key, value))
+        node.end_mark = loader.get_event().end_mark
+    else:
+        raise yaml.composer.ComposerError(None, None,
+                                          "unexpected %s" % event.id,
+                                          event.start_mark)
+    if event.anchor is not None:
+        anchors[event.anchor] = node
+    return node
+
+
+class _YAMLChunk(object):
+    """A data chunk that is parsed while iterating over its objects.
+
+    Iterating over this object yields a tuple (name, key, d) for each
+    object as soon as it has been parsed, where name is the entity
+    type, key the object's key, and d the dict of its attributes.
+    The entity types must appear in the order of entitytypes, after
+    the entries for references, if any.  The chunk can only be
+    iterated once.
+    """
+
+    def __init__(self, loader):
+        self.loader = loader
+        self.anchors = {}
+        self.state = 'start'
+        self.name = None
+        self.section = None
+
+    def _construct(self):
+        node = _compose(self.loader, self.anchors)
+        return self.loader.construct_document(node)
+
+    def __iter__(self):
+        loader = self.loader
+        if self.state == 'start':
+            if loader.check_event(yaml.MappingStartEvent):
+                loader.get_event()
+                self.state = 'sections'
+            elif self._construct() is None:
+                # An empty document.
+                self.state = 'end'
+            else:
+                raise RuntimeError("Invalid data chunk in the data.")
+        while self.state != 'end':
+            if self.state == 'sections':
+                if loader.check_event(yaml.MappingEndEvent):
+                    loader.get_event()
+                    self.state = 'end'
+                    break
+                name = self._construct()
+                if _isrefname(name):
+                    if self.name is not None:
+                        raise RuntimeError("Entry %s out of order "
+                                           "in the data." % name)
+                else:
+                    if name not in entitytypes:
+                        raise RuntimeError("Unknown entry %s in the data."
+                                           % name)
+                    if (self.name is not None and
+                        entitytypes.index(name) <
+                        entitytypes.index(self.name)):
+                        raise RuntimeError("Entry %s out of order "
+                                           "in the data." % name)
+                    self.name = name
+                self.section = name
+                if loader.check_event(yaml.MappingStartEvent):
+                    loader.get_event()
+                    self.state = 'objects'
+                elif self._construct():
+                    raise RuntimeError("Invalid entry %s in the data."
+                                       % name)
+            else:
+                if loader.check_event(yaml.MappingEndEvent):
+                    loader.get_event()
+                    self.state = 'sections'
+                    continue
+                key = self._construct()
+                d = self._construct()
+                yield self.section, key, d
+
+    def skip(self):
+        """Consume the remainder of the chunk."""
+        for item in self:
+            pass
+
+
+class _HeadStream(object):
+    """Put the header lines back in front of the rest of the input."""
+
+    def __init__(self, head, infile):
+        self.head = head
+        self.infile = infile
+
+    def read(self, size=-1):
+        if not self.head:
+            return self.infile.read(size)
+        if size < 0:
+            data = self.head + self.infile.read()
+            self.head = self.head[:0]
+        else:
+            data = self.head[:size]
+            self.head = self.head[size:]
+        return data
+
+
 class YAMLDumpFileReader(icat.dumpfile.DumpFileReader):
     """Backend for reading ICAT data from a YAML file."""
 
@@ -71,10 +245,13 @@ class YAMLDumpFileReader(icat.dumpfile.DumpFileReader):
     """File mode suitable for this backend.
     """
 
+    indexable = True
+
     def __init__(self, client, infile):
         super(YAMLDumpFileReader, self).__init__(client, infile)
-        self.insttypemap = { c.BeanName:t 
-                             for t,c in self.client.typemap.iteritems() }
+        if client is not None:
+            self.insttypemap = { c.BeanName:t 
+                                 for t,c in self.client.typemap.iteritems() }
 
     def _dict2entity(self, d, objtype, objindex):
         """Create an entity object from a dict of attributes."""
@@ -98,12 +275,90 @@ class YAMLDumpFileReader(icat.dumpfile.DumpFileReader):
                                  % (k, objtype))
         return obj
 
+    def _readhead(self):
+        """Read the comments and directives at the start of the data file.
+
+        Return the text read, including the first line following the
+        header, and whether the header declares the entity types in
+        each chunk to be in the order in which they must be restored.
+        """
+        lines = []
+        ordered = False
+        while True:
+            line = self.infile.readline()
+            lines.append(line)
+            if not line.startswith(('#', '%')):
+                break
+            if _orderhead_re.match(line):
+                ordered = True
+        return lines[0][:0].join(lines), ordered
+
     def getdata(self):
         """Iterate over the chunks in the data file.
+
+        If the header of the data file declares the entity types in
+        each chunk to appear in the order in which they must be
+        restored, the chunks are parsed lazily while iterating over
+        their objects, so that only one object at a time needs to be
+        kept in memory.  Otherwise, e.g. for files written by older
+        versions that sorted the entity types alphabetically, each
+        chunk is read completely.
+        """
+        head, ordered = self._readhead()
+        loader = Loader(_HeadStream(head, self.infile))
+        try:
+            loader.get_event()
+            while loader.check_event(yaml.DocumentStartEvent):
+                loader.get_event()
+                if ordered:
+                    data = _YAMLChunk(loader)
+                    yield data
+                    data.skip()
+                else:
+                    node = _compose(loader, {})
+                    yield loader.construct_document(node)
+                loader.get_event()
+        finally:
+            loader.dispose()
+
+    def detachdata(self, data):
+        """Return a data chunk that stays valid after the iteration.
+
+        Read the complete chunk if it is parsed lazily.
+        """
+        if isinstance(data, _YAMLChunk):
+            d = {}
+            for name, key, objd in data:
+                d.setdefault(name, {})[key] = objd
+            return d
+        else:
+            return data
+
+    def _parsechunk(self, buf):
+        return yaml.load(buf.decode('utf-8'), Loader=Loader)
+
+    def _hasrefs(self, data):
+        return any(_isrefname(name) for name in data)
+
+    def getrecords_from_data(self, data, refs=False):
+        """Iterate over the records of the objects in a data chunk.
         """
-        # yaml.load_all() returns a generator that yield one chunk
-        # (YAML document) from the file in each iteration.
-        return yaml.safe_load_all(self.infile)
+        if isinstance(data, _YAMLChunk):
+            for name, key, d in data:
+                if not _isrefname(name):
+                    yield name, key, d
+                elif refs:
+                    yield name[:-3], key, None
+            return
+        if refs:
+            for name in entitytypes:
+                if "%sRef" % name in data:
+                    for key in sorted(data["%sRef" % name].keys()):
+                        yield name, key, None
+        for name in entitytypes:
+            if name in data:
+                for key in sorted(data[name].keys()):
+                    yield name, key, data[name][key]
 
     def getobjs_from_data(self, data, objindex):
         """Iterate over the objects in a data chunk.
@@ -111,10 +366,25 @@ class YAMLDumpFileReader(icat.dumpfile.DumpFileReader):
         Yield a new entity object in each iteration.  The object is
         initialized from the data, but not yet created at the client.
         """
+        if isinstance(data, _YAMLChunk):
+            for name, key, d in data:
+                if _isrefname(name):
+                    objindex[key] = self.client.searchUniqueKey(key,
+                                                                objindex)
+                else:
+                    yield key, self._dict2entity(d, name, objindex)
+            return
         # check first that the chunk contains only known entries
         for name in data.keys():
-            if name not in entitytypes:
+            if name not in entitytypes and not _isrefname(name):
                 raise RuntimeError("Unknown entry %s in the data." % name)
+        # references to already existing objects are not yielded,
+        # but added to the objindex.
+        for name in sorted(data.keys()):
+            if _isrefname(name):
+                for key in sorted(data[name].keys()):
+                    objindex[key] = self.client.searchUniqueKey(key,
+                                                                objindex)
         for name in entitytypes:
             if name in data:
                 for key in sorted(data[name].keys()):
@@ -133,9 +403,13 @@ class YAMLDumpFileWriter(icat.dumpfile.DumpFileWriter):
     """File mode suitable for this backend.
     """
 
+    indexable = True
+
     def __init__(self, client, outfile):
         super(YAMLDumpFileWriter, self).__init__(client, outfile)
-        self.data = {}
+        self.datastarted = False
+        self.section = None
+        self.sections = []
 
     def _entity2dict(self, obj, keyindex):
         """Convert an entity object to a dict."""
@@ -191,28 +465,69 @@ class YAMLDumpFileWriter(icat.dumpfile.DumpFileWriter):
 # Service: %s
 # ICAT-API: %s
 # Generator: icatdump (python-icat %s)
-""" % (date, self.client.url, self.client.apiversion, icat.__version__)
+%s
+""" % (date, self.client.url, self.client.apiversion, icat.__version__,
+       _orderhead)
         self.outfile.write(head)
 
     def startdata(self):
         """Start a new data chunk.
-
-        If the current chunk contains any data, write it to the data
-        file.
         """
-        if self.data:
-            yaml.dump(self.data, self.outfile, 
-                      default_flow_style=False, explicit_start=True)
-        self.data = {}
+        self.datastarted = False
 
     def writeobj(self, key, obj, keyindex):
-        """Add an entity object to the current data chunk."""
+        """Add an entity object to the current data chunk.
+
+        The object is written to the data file right away.  Objects
+        of the same type must be added consecutively and the entity
+        types in the order in which they must be restored.
+
+        :raise ValueError: if the entity type is unknown or out of
+            order in the current chunk.
+        """
         tag = obj.instancetype
         if tag not in entitytypes:
             raise ValueError("Unknown entity type '%s'" % tag)
-        if tag not in self.data:
-            self.data[tag] = {}
-        self.data[tag][key] = self._entity2dict(obj, keyindex)
+        self._writeentry(tag, key, self._entity2dict(obj, keyindex))
+
+    def writeref(self, key, obj):
+        """Add a reference to an entity object to the current data chunk.
+
+        References are written in an entry having the name of the
+        entity type with `Ref` appended, mapping the key of the object
+        to null.
+        """
+        self._writeentry("%sRef" % obj.instancetype, key, None, isref=True)
+
+    def writerecord(self, name, key, d, schema):
+        """Add a record of an object to the current data chunk.
+        """
+        if d is None:
+            self._writeentry("%sRef" % name, key, None, isref=True)
+        else:
+            if name not in entitytypes:
+                raise ValueError("Unknown entity type '%s'" % name)
+            self._writeentry(name, key, d)
+
+    def _writeentry(self, tag, key, d, isref=False):
+        # The header declares the chunks to be in restore order, so
+        # that the reader may parse them lazily.  Do not write
+        # anything that would break this promise.
+        if (self.datastarted and tag != self.section and
+            (tag in self.sections or not _isordered(self.sections + [tag]))):
+            raise ValueError("Entry '%s' out of restore order in the chunk"
+                             % tag)
+        self._indexobj(not self.datastarted, isref=isref)
+        if not self.datastarted:
+            self.outfile.write("---\n")
+            self.datastarted = True
+            self.section = None
+            self.sections = []
+        if tag != self.section:
+            self.outfile.write("%s:\n" % tag)
+            self.section = tag
+            self.sections.append(tag)
+        self.outfile.write(_dumpobj(key, d))
 
     def finalize(self):
         """Finalize the data file."""
@@ -0,0 +1,340 @@
+"""Write and read ICAT data as a directory of shards.
+
+A single data file is a serialization point, both when writing it and
+when reading it again.  As an alternative, the data may be written to
+a directory containing several data files, the shards.  The data
+chunks written by icatdump are distributed as follows:
+
+1. The shard `base` contains the chunks with the objects that define
+   authorization and the static content.
+2. The investigation chunks are distributed over a number of shards
+   `shard-000`, `shard-001`, and so forth.  The chunks are either
+   assigned round robin, or each chunk is assigned to the shard
+   having the fewest objects so far.
+3. The shard `other` contains the last chunk with all remaining
+   stuff.
+
+The directory also contains a manifest file `manifest.json`, listing
+the shards in the order they need to be processed along with the
+names of the shards each of them depends on.  The investigation
+shards only depend on the base shard, so they may be processed
+concurrently.  The manifest is written last, so a directory having a
+manifest is complete.
+"""
+
+import os
+import json
+import icat.dumpfile
+from icat.dumpfile import open_dumpfile
+from icat.exception import ShardError
+from icat.helper import WorkerPool
+
+__all__ = ['ShardedDumpWriter', 'ShardedDumpReader']
+
+manifestname = "manifest.json"
+"""Name of the manifest file in the directory."""
+
+
+# ------------------------------------------------------------
+# ShardedDumpWriter
+# ------------------------------------------------------------
+
+class ShardedDumpWriter(object):
+    """Write ICAT data to a directory of shards.
+
+    This provides the same methods to write data as
+    :class:`~icat.dumpfile.DumpFileWriter`, so that it can be used in
+    its place.  The chunks written with
+    :meth:`~icat.dumpshard.ShardedDumpWriter.writedata` go to the base
+    shard until :meth:`~icat.dumpshard.ShardedDumpWriter.writechunks`
+    is called for the first time and to the other shard afterwards.
+    The chunks written with
+    :meth:`~icat.dumpshard.ShardedDumpWriter.writechunks` are
+    distributed over the investigation shards.  The writer must be
+    used as a context manager.
+
+    :param client: the client to search the objects with.
+    :type client: :class:`icat.client.Client`
+    :param dirname: name of the directory.  It is created if needed.
+        Any existing shards in it are overwritten.
+    :type dirname: :class:`str`
+    :param formatname: name of the file format of the shards.
+    :type formatname: :class:`str`
+    :param shards: number of investigation shards.
+    :type shards: :class:`int`
+    :param assign: how to assign the investigation chunks to the
+        shards, either `'roundrobin'` or `'size'`.  In the latter
+        case, each chunk goes to the shard having the fewest objects
+        so far.
+    :type assign: :class:`str`
+    :param index: flag whether to write a chunk index along with each
+        shard, see :meth:`icat.dumpfile.DumpFileWriter.setindex`.
+    :type index: :class:`bool`
+    :raise ValueError: if any of the arguments is not valid.
+    """
+
+    def __init__(self, client, dirname, formatname, shards,
+                 assign="roundrobin", index=False):
+        if formatname not in icat.dumpfile.Backends:
+            raise ValueError("Unknown data file format '%s'" % formatname)
+        if shards < 1:
+            raise ValueError("Invalid number of shards %d." % shards)
+        if assign not in ("roundrobin", "size"):
+            raise ValueError("Invalid shard assignment '%s'." % assign)
+        self.client = client
+        self.dirname = dirname
+        self.formatname = formatname
+        self.nshards = shards
+        self.assign = assign
+        self.index = index
+        self.base = None
+        self.shards = []
+        self.other = None
+        self._keycachesize = None
+        self._chunkcount = 0
+        self._started = False
+
+    @property
+    def keycachesize(self):
+        """Maximum number of keys to keep in the internal key index.
+
+        See :attr:`icat.dumpfile.DumpFileWriter.keycachesize`.  This
+        applies to all shards.
+        """
+        return self._keycachesize
+
+    @keycachesize.setter
+    def keycachesize(self, value):
+        self._keycachesize = value
+        for w in self._writers():
+            w.keycachesize = value
+
+    def _writers(self):
+        writers = list(self.shards)
+        if self.base:
+            writers.insert(0, self.base)
+        if self.other:
+            writers.append(self.other)
+        return writers
+
+    def _filename(self, name):
+        return "%s.%s" % (name, self.formatname.lower())
+
+    def _open(self, name):
+        fname = os.path.join(self.dirname, self._filename(name))
+        writer = open_dumpfile(self.client, fname, self.formatname, 'w',
+                               index=self.index)
+        writer.__enter__()
+        writer.keycachesize = self._keycachesize
+        return writer
+
+    def __enter__(self):
+        if not os.path.isdir(self.dirname):
+            os.makedirs(self.dirname)
+        manifest = os.path.join(self.dirname, manifestname)
+        if os.path.exists(manifest):
+            os.remove(manifest)
+        try:
+            self.base = self._open("base")
+            for i in range(self.nshards):
+                self.shards.append(self._open("shard-%03d" % i))
+            self.other = self._open("other")
+        except:
+            for w in self._writers():
+                w.__exit__(None, None, None)
+            raise
+        # Generic keys are numbered across all shards.
+        for w in self._writers():
+            w.idcounter = self.base.idcounter
+        return self
+
+    def __exit__(self, type, value, traceback):
+        for w in self._writers():
+            w.__exit__(type, value, traceback)
+        if type is None:
+            self._writemanifest()
+
+    def _writemanifest(self):
+        def shard(name, writer, depends):
+            return {
+                'name': name,
+                'file': self._filename(name),
+                'depends': depends,
+                'objects': writer.objcount,
+            }
+        names = [ "shard-%03d" % i for i in range(self.nshards) ]
+        shards = [ shard("base", self.base, []) ]
+        for name, w in zip(names, self.shards):
+            shards.append(shard(name, w, ["base"]))
+        shards.append(shard("other", self.other, ["base"] + names))
+        manifest = {
+            'format': self.formatname,
+            'shards': shards,
+        }
+        fname = os.path.join(self.dirname, manifestname)
+        with open(fname + ".tmp", "wt") as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+            f.write("\n")
+        os.rename(fname + ".tmp", fname)
+
+    def _nextshard(self):
+        if self.assign == "size":
+            return min(self.shards, key=lambda w: w.objcount)
+        else:
+            w = self.shards[self._chunkcount % self.nshards]
+            self._chunkcount += 1
+            return w
+
+    def writedata(self, objs, keyindex=None, chunksize=100, chunklimit=None):
+        """Write a data chunk to the base or the other shard.
+
+        See :meth:`icat.dumpfile.DumpFileWriter.writedata` for the
+        parameters.
+        """
+        writer = self.other if self._started else self.base
+        writer.writedata(objs, keyindex=keyindex, chunksize=chunksize,
+                         chunklimit=chunklimit)
+
+    def writechunks(self, chunks, clients=None, window=None, chunksize=100,
+                    chunklimit=None, keyindex=None):
+        """Write a sequence of data chunks to the investigation shards.
+
+        See :meth:`icat.dumpfile.DumpFileWriter.writechunks` for the
+        parameters.
+        """
+        self._started = True
+        searched = self.base._searchchunks(chunks, clients, window,
+                                           chunksize)
+        try:
+            for objs in searched:
+                writer = self._nextshard()
+                writer.writedata(objs, keyindex=writer._newkeyindex(keyindex),
+                                 chunksize=chunksize, chunklimit=chunklimit)
+        finally:
+            searched.close()
+
+
+# ------------------------------------------------------------
+# ShardedDumpReader
+# ------------------------------------------------------------
+
+class ShardedDumpReader(object):
+    """Read ICAT data from a directory of shards.
+
+    :param client: the client to create the objects with.
+    :type client: :class:`icat.client.Client`
+    :param dirname: name of the directory.
+    :type dirname: :class:`str`
+    :raise ValueError: if the dependencies in the manifest are not
+        valid.
+    """
+
+    objcachesize = None
+    """Maximum number of objects to keep in memory per chunk.
+
+    See :attr:`icat.dumpfile.DumpFileReader.objcachesize`.
+    """
+
+    def __init__(self, client, dirname):
+        self.client = client
+        self.dirname = dirname
+        with open(os.path.join(dirname, manifestname), "rt") as f:
+            manifest = json.load(f)
+        self.formatname = manifest['format']
+        self.shards = manifest['shards']
+        self.stages = self._getstages()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        pass
+
+    def _getstages(self):
+        """Group the shards in stages according to their dependencies.
+
+        The shards in each stage only depend on shards in previous
+        stages, so they are independent of each other.
+        """
+        stages = []
+        level = {}
+        for shard in self.shards:
+            try:
+                l = max([ level[d] + 1 for d in shard['depends'] ] or [0])
+            except KeyError as e:
+                raise ValueError("Shard %s depends on %s, which is not "
+                                 "listed before it." % (shard['name'], e))
+            level[shard['name']] = l
+            while len(stages) <= l:
+                stages.append([])
+            stages[l].append(shard)
+        return stages
+
+    def _open(self, client, shard):
+        fname = os.path.join(self.dirname, shard['file'])
+        reader = open_dumpfile(client, fname, self.formatname, 'r')
+        reader.objcachesize = self.objcachesize
+        return reader
+
+    def getobjs(self):
+        """Iterate over the objects in all shards.
+
+        The shards are read one after the other in the order of the
+        manifest.
+        """
+        for shard in self.shards:
+            with self._open(self.client, shard) as reader:
+                for obj in reader.getobjs():
+                    yield obj
+
+    def _processshard(self, client, shard, func, batchsize):
+        with self._open(client, shard) as reader:
+            reader.processobjs(func, batchsize=batchsize)
+
+    def processobjs(self, func, clients=None, batchsize=None):
+        """Call a function on all objects in all shards.
+
+        The shards are processed in stages according to their
+        dependencies.  If `clients` is set, the shards within one
+        stage are dispatched to a pool of worker threads, one for each
+        client in `clients`.  Each worker processes the chunks of one
+        shard at a time serially.  The objects passed to `func` are
+        bound to the client of the worker, so `func` should use
+        `obj.client` for any further client calls.
+
+        If any shard fails in a worker thread, the remaining shards
+        of the same stage are still processed.  A
+        :exc:`~icat.exception.ShardError` listing all failed shards is
+        raised at the end of the stage and the following stages are
+        not processed in this case.
+
+        :param func: function to call on each object, see
+            :meth:`icat.dumpfile.DumpFileReader.processobjs`.
+        :type func: callable
+        :param clients: clients for the worker threads.  They must be
+            logged in.  If this is :const:`None` or empty, all shards
+            are processed serially.
+        :type clients: :class:`list` of :class:`icat.client.Client`
+        :param batchsize: if set, `func` is called with lists of
+            objects rather then with single objects, see
+            :meth:`~icat.dumpfile.DumpFileReader.getchunkbatches`.
+        :type batchsize: :class:`int`
+        :raise ShardError: if processing of any of the shards in the
+            worker threads failed.
+        """
+        for stage in self.stages:
+            if not clients or len(stage) == 1:
+                for shard in stage:
+                    self._processshard(self.client, shard, func, batchsize)
+                continue
+            pool = WorkerPool(clients)
+            names = {}
+            try:
+                for shard in stage:
+                    seq = pool.submit(self._processshard, shard, func,
+                                      batchsize)
+                    names[seq] = shard['name']
+            finally:
+                errors = pool.close()
+            if errors:
+                raise ShardError([(names[s], e) for s, e in errors])
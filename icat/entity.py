@@ -2,6 +2,7 @@
 """
 
 import re
+import itertools
 from warnings import warn
 import suds.sudsobject
 from icat.listproxy import ListProxy
@@ -11,6 +12,38 @@ from icat.helper import simpleqp_quote
 __all__ = ['Entity']
 
 
+# The sort keys and unique keys are cached in the instance objects.
+# Each instance has a generation number that is bumped whenever an
+# attribute that its keys are built from gets modified, which also
+# drops its own cached keys.  The cached values also depend on the
+# keys of related objects.  So along with each cached key, the
+# generation numbers of all the instances it depends on are recorded.
+# The cached key is only used as long as none of these have changed.
+_generations = itertools.count(1)
+
+def _getGeneration(instance):
+    return getattr(instance, '__icatgen__', 0)
+
+def _keysValid(deps):
+    for instance, generation in deps:
+        if _getGeneration(instance) != generation:
+            return False
+    return True
+
+def _addKeyDeps(deps, obj, objdeps):
+    """Add a related object to the dependencies of a key.
+
+    `objdeps` are the dependencies of the related object's key.  The
+    result is :const:`None`, meaning the key may not be cached, if
+    any of `deps` or `objdeps` is :const:`None`.
+    """
+    if deps is None or objdeps is None:
+        return None
+    return deps + objdeps + ((obj.instance, _getGeneration(obj.instance)),)
+
+_keyprefix_re = re.compile(r'^[A-Z-a-z]+_')
+
+
 class Entity(object):
     """The base of the classes representing the entities in the ICAT schema.
 
@@ -203,9 +236,12 @@ class Entity(object):
             l.extend(value)
         elif attr in self.AttrAlias:
             setattr(self, self.AttrAlias[attr], value)
+            return
         else:
             raise AttributeError("%s object cannot set attribute '%s'" %
                                  (type(self).__name__, attr))
+        if attr in self._getKeyAttrs():
+            self._invalidateKeys()
 
     def __delattr__(self, attr):
         if attr in (self.InstAttr | self.InstRel):
@@ -218,9 +254,71 @@ class Entity(object):
                 delattr(self.instance, attr)
         elif attr in self.AttrAlias:
             delattr(self, self.AttrAlias[attr])
+            return
         else:
             raise AttributeError("%s object cannot delete attribute '%s'" %
                                  (type(self).__name__, attr))
+        if attr in self._getKeyAttrs():
+            self._invalidateKeys()
+
+    @classmethod
+    def _getKeySpec(cls):
+        """Return the compiled key builder for this class.
+
+        This is a tuple of two lists, one for the unique key and one
+        for the sort key.  Each list contains the attribute names
+        along with their kind, one of 'attr', 'rel', or 'mrel'.  The
+        result is computed once and stored in the class.
+        """
+        spec = cls.__dict__.get('_keyspec')
+        if spec is None:
+            def kind(attr):
+                if attr in cls.InstAttr:
+                    return 'attr'
+                elif attr in cls.InstRel:
+                    return 'rel'
+                elif attr in cls.InstMRel:
+                    return 'mrel'
+                else:
+                    return None
+            sortattrs = cls.SortAttrs or cls.Constraint
+            keyspec = [ (a, kind(a)) for a in cls.Constraint ]
+            sortspec = [ (a, kind(a)) for a in sortattrs ]
+            spec = (keyspec, sortspec)
+            cls._keyspec = spec
+            cls._keyattrs = frozenset(cls.Constraint) | frozenset(sortattrs)
+        return spec
+
+    @classmethod
+    def _getKeyAttrs(cls):
+        """Return the set of attributes that keys are built from.
+        """
+        if '_keyattrs' not in cls.__dict__:
+            cls._getKeySpec()
+        return cls._keyattrs
+
+    def _getKeyCache(self):
+        """Return the cache of keys for this object.
+
+        The cache is kept in the instance, so that it is shared by
+        all Entity objects wrapping the same instance.  Suds does not
+        marshal attributes having a name with leading and trailing
+        double underscores.
+        """
+        cache = getattr(self.instance, '__icatkeys__', None)
+        if cache is None:
+            cache = {}
+            self.instance.__icatkeys__ = cache
+        return cache
+
+    def _invalidateKeys(self):
+        """Drop the cached keys of this object.
+
+        This also invalidates the cached keys of all other objects
+        depending on this one.
+        """
+        self.instance.__icatgen__ = next(_generations)
+        self.instance.__icatkeys__ = None
 
 
     def copy(self):
@@ -292,12 +390,29 @@ class Entity(object):
         :class:`~icat.entity.Entity` objects, you can sort it using:
 
         >>> l.sort(key=icat.entity.Entity.__sortkey__)
+
+        The key is a tuple.  It is cached in the object as long as
+        none of the attributes it is built from gets modified, neither
+        in this object nor in the related objects.
         """
-        sortattrs = self.SortAttrs or self.Constraint
+        return self._getSortKey()[0]
+
+    def _getSortKey(self):
+        """Return the sort key and its dependencies.
+
+        The dependencies are a tuple of the instances that the key has
+        been built from along with their generation numbers, or
+        :const:`None` if the key may not be cached.
+        """
+        cache = self._getKeyCache()
+        cached = cache.get('sortkey')
+        if cached is not None and _keysValid(cached[1]):
+            return cached
+        deps = ()
         s = [ self.BeanName ]
-        for attr in sortattrs:
+        for attr, kind in self._getKeySpec()[1]:
             v = getattr(self, attr, None)
-            if attr in self.InstAttr:
+            if kind == 'attr':
                 if v is None:
                     v = ''
                 else:
@@ -305,19 +420,26 @@ class Entity(object):
                         v = str(v)
                     except UnicodeError:
                         v = unicode(v)
-            elif attr in self.InstRel:
+            elif kind == 'rel':
                 if v is None:
-                    v = []
+                    v = ()
                 else:
-                    v = v.__sortkey__()
-            elif attr in self.InstMRel:
-                v = [ r.__sortkey__() for r in v ]
-                v.sort()
+                    e = v
+                    v, d = e._getSortKey()
+                    deps = _addKeyDeps(deps, e, d)
+            elif kind == 'mrel':
+                # The list of related objects may be modified without
+                # notice, so we cannot cache the result.
+                v = tuple(sorted([ r._getSortKey()[0] for r in v ]))
+                deps = None
             else:
                 raise InternalError("Invalid sorting attribute '%s' in %s."
                                     % (attr, self.BeanName))
             s.append(v)
-        return s
+        s = tuple(s)
+        if deps is not None:
+            cache['sortkey'] = (s, deps)
+        return s, deps
 
     def as_dict(self):
         """Return a dict with the object's attributes.
@@ -384,20 +506,41 @@ class Entity(object):
             constraint is not set.
         """
 
+        return self._getUniqueKey(keyindex)[0]
+
+    def _getUniqueKey(self, keyindex):
+        """Return the unique key and its dependencies.
+
+        The dependencies are as for
+        :meth:`~icat.entity.Entity._getSortKey`.  Keys taken from the
+        key index or built from the id are not cached, as they are not
+        determined by the object's attributes.
+        """
         kid = (self.BeanName, self.id)
         if keyindex is not None and kid in keyindex:
-            return keyindex[kid]
+            return keyindex[kid], None
+
+        cache = self._getKeyCache()
+        cached = cache.get('key')
+        if cached is not None and _keysValid(cached[1]):
+            if keyindex is not None:
+                keyindex[kid] = cached[0]
+            return cached
 
+        deps = ()
         key = self.BeanName
-        for c in self.Constraint:
+        for c, kind in self._getKeySpec()[0]:
             key += "_"
-            if c in self.InstAttr:
+            if kind == 'attr':
+                if c == 'id':
+                    deps = None
                 key += "%s-%s" % (c, simpleqp_quote(getattr(self, c, None)))
-            elif c in self.InstRel:
+            elif kind == 'rel':
                 e = getattr(self, c, None)
                 if e:
-                    ek = e.getUniqueKey(keyindex)
-                    key += "%s-(%s)" % (c, re.sub(r'^[A-Z-a-z]+_', '', ek))
+                    ek, ed = e._getUniqueKey(keyindex)
+                    deps = _addKeyDeps(deps, e, ed)
+                    key += "%s-(%s)" % (c, _keyprefix_re.sub('', ek))
                 else:
                     raise DataConsistencyError("Required relation '%s' "
                                                "not present in %s"
@@ -405,9 +548,11 @@ class Entity(object):
             else:
                 raise InternalError("Invalid constraint '%s' in %s."
                                     % (c, self.BeanName))
+        if deps is not None:
+            cache['key'] = (key, deps)
         if keyindex is not None:
             keyindex[kid] = key
-        return key
+        return key, deps
 
     def create(self):
         """Call :meth:`icat.client.Client.create` to create the object in the
@@ -30,7 +30,11 @@ __all__ = [
     # icat.client, icat.entity
     'ClientVersionWarning', 'ICATDeprecationWarning', 
     'EntityTypeError', 'VersionMethodError', 'SearchResultError', 
-    'SearchAssertionError', 'DataConsistencyError', 
+    'SearchAssertionError', 'DataConsistencyError', 'UploadError', 
+    # icat.dumpfile
+    'ChunkError', 
+    # icat.dumpshard
+    'ShardError', 
     # icat.ids
     'IDSResponseError', 
     # icat.icatcheck
@@ -401,6 +405,62 @@ class DataConsistencyError(_BaseException):
     """Some data is not consistent with rules or constraints."""
     pass
 
+class UploadError(_BaseException):
+    """Uploading one or more files to IDS failed.
+
+    This exception is raised when files have been uploaded
+    concurrently and some of them failed.  The individual errors are
+    collected in the attribute `errors`, a list of tuples of the
+    index of the file and the exception raised while uploading it.
+    The ids of the Datafiles created by the successful uploads are in
+    the attribute `datafileIds`.
+    """
+    def __init__(self, errors, datafileIds):
+        errors = sorted(errors, key=lambda e: e[0])
+        details = "; ".join(["file %d: %s" % (n, e) for n, e in errors])
+        msg = "%d upload(s) failed: %s" % (len(errors), details)
+        super(UploadError, self).__init__(msg)
+        self.errors = errors
+        self.datafileIds = datafileIds
+
+
+# =============== Exceptions raised in icat.dumpfile ===============
+
+class ChunkError(_BaseException):
+    """Processing of one or more data chunks failed.
+
+    This exception is raised when data chunks have been processed
+    concurrently and some of them failed.  The individual errors are
+    collected in the attribute `errors`, a list of tuples of the
+    chunk number and the exception raised while processing that
+    chunk.
+    """
+    def __init__(self, errors):
+        errors = sorted(errors, key=lambda e: e[0])
+        details = "; ".join(["chunk %d: %s" % (n, e) for n, e in errors])
+        msg = "%d data chunk(s) failed: %s" % (len(errors), details)
+        super(ChunkError, self).__init__(msg)
+        self.errors = errors
+
+
+# =============== Exceptions raised in icat.dumpshard ==============
+
+class ShardError(_BaseException):
+    """Processing of one or more shards of a data file failed.
+
+    This exception is raised when shards have been processed
+    concurrently and some of them failed.  The individual errors are
+    collected in the attribute `errors`, a list of tuples of the
+    name of the shard and the exception raised while processing that
+    shard.
+    """
+    def __init__(self, errors):
+        errors = sorted(errors, key=lambda e: e[0])
+        details = "; ".join(["shard %s: %s" % (n, e) for n, e in errors])
+        msg = "%d shard(s) failed: %s" % (len(errors), details)
+        super(ShardError, self).__init__(msg)
+        self.errors = errors
+
 
 # ================= Exceptions raised in icat.ids ==================
 
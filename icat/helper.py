@@ -35,8 +35,13 @@ True
 
 import sys
 import datetime
+import logging
+import threading
+import Queue
 import suds.sax.date
 
+log = logging.getLogger(__name__)
+
 
 def simpleqp_quote(obj):
     """Simple quote in quoted-printable style."""
@@ -219,3 +224,122 @@ def ms_timestamp(dt):
             dt = dt.replace(tzinfo=None) - offs
         ts = 1000 * (dt - datetime.datetime(1970, 1, 1)).total_seconds()
     return int(ts)
+
+
+# ------------------------------------------------------------
+# WorkerPool
+# ------------------------------------------------------------
+
+class WorkerPool(object):
+    """Run tasks concurrently in a pool of worker threads.
+
+    Each worker thread is bound to one of the clients passed to the
+    constructor.  A task is a function that gets called with that
+    client as first argument.  Suds clients are not safe to be shared
+    between threads, so each client must only be used by its worker.
+
+    The number of tasks in flight is bounded by `window`.  If
+    `ordered` is :const:`False`, a task leaves the window as soon as
+    it is done, :meth:`submit` blocks while the window is full, and
+    errors are collected to be returned by :meth:`close`.  If
+    `ordered` is :const:`True`, results are kept until they are
+    fetched in the order of submission with :meth:`get` and only
+    then leave the window.  The caller is responsible to fetch results
+    before submitting new tasks if the window is full.
+    """
+
+    def __init__(self, clients, window=None, ordered=False):
+        self.window = window or 2*len(clients)
+        self.ordered = ordered
+        self.tasks = Queue.Queue()
+        self.cond = threading.Condition()
+        self.submitted = 0
+        self.done = 0
+        self.results = {}
+        self.errors = []
+        self.threads = []
+        for c in clients:
+            t = threading.Thread(target=self._run, args=(c,))
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+
+    def _run(self, client):
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                break
+            seq, func, args = task
+            try:
+                res = (func(client, *args), None)
+            except Exception as e:
+                log.error("task %d failed: %s", seq, e)
+                res = (None, e)
+            with self.cond:
+                if self.ordered:
+                    self.results[seq] = res
+                else:
+                    if res[1] is not None:
+                        self.errors.append((seq, res[1]))
+                    self.done += 1
+                self.cond.notify_all()
+
+    def pending(self):
+        """Return the number of tasks in the window."""
+        with self.cond:
+            return self.submitted - self.done
+
+    def wait(self):
+        """Wait until all submitted tasks are done.
+
+        Only valid if `ordered` is :const:`False`.
+        """
+        with self.cond:
+            while self.done < self.submitted:
+                self.cond.wait()
+
+    def submit(self, func, *args):
+        """Submit a task.  Return its sequence number.
+        """
+        with self.cond:
+            if self.ordered:
+                if self.submitted - self.done >= self.window:
+                    raise RuntimeError("Window is full, must fetch "
+                                       "results first.")
+            else:
+                while self.submitted - self.done >= self.window:
+                    self.cond.wait()
+            seq = self.submitted
+            self.submitted += 1
+        self.tasks.put((seq, func, args))
+        return seq
+
+    def get(self):
+        """Wait for the next task in order and return its result.
+
+        Re-raise the exception if the task failed.  Only valid if
+        `ordered` is :const:`True`.
+        """
+        with self.cond:
+            seq = self.done
+            if seq >= self.submitted:
+                raise RuntimeError("No pending task.")
+            while seq not in self.results:
+                self.cond.wait()
+            res, err = self.results.pop(seq)
+            self.done += 1
+        if err is not None:
+            raise err
+        return res
+
+    def close(self):
+        """Wait for all tasks to finish and stop the worker threads.
+
+        Return the list of errors as tuples of the sequence number and
+        the exception.
+        """
+        for t in self.threads:
+            self.tasks.put(None)
+        for t in self.threads:
+            t.join()
+        return self.errors
@@ -9,6 +9,11 @@ author.
 """
 
 import sys
+import os
+import stat
+import mmap
+import threading
+import Queue
 try:
     # Python 3.3 and newer
     from collections.abc import Mapping, Iterable
@@ -87,22 +92,139 @@ class IDSHTTPErrorHandler(HTTPDefaultErrorHandler):
 class ChunkedFileReader(object):
     """An iterator that yields chunks of data read from a file.
     As a side effect, a checksum of the read data is calulated.
+
+    The chunks are read using :meth:`readinto` into reusable buffers
+    of `chunksize` bytes and yielded as :class:`memoryview`, so a
+    chunk is only valid until the next one is requested.  If
+    `readahead` is larger then zero, a background thread reads up to
+    that many chunks ahead, so that reading from disk overlaps with
+    sending the data.  If `usemmap` is :const:`True` and the input is
+    a regular file, the file is memory mapped and the chunks are
+    slices of the map, avoiding any copy.  In any case, the position
+    of `inputfile` is at the end of the data after the last chunk has
+    been yielded.  :meth:`close` must be called if the iteration is
+    abandoned before the end.
     """
-    def __init__(self, inputfile, chunksize=8192):
+    def __init__(self, inputfile, chunksize=8192, readahead=0, 
+                 usemmap=False):
         self.inputfile = inputfile
         self.chunksize = chunksize
         self.crc32 = 0
+        self._mmap = None
+        self._thread = None
+        if usemmap:
+            self._mapfile()
+        if self._mmap is not None:
+            self._chunks = self._mapchunks()
+        elif readahead > 0 and hasattr(inputfile, 'readinto'):
+            self._startreadahead(readahead + 1)
+            self._chunks = self._readaheadchunks()
+        else:
+            self._chunks = self._readchunks()
+
+    def _mapfile(self):
+        try:
+            fileno = self.inputfile.fileno()
+            pos = self.inputfile.tell()
+            st = os.fstat(fileno)
+        except (AttributeError, EnvironmentError, ValueError):
+            return
+        if not stat.S_ISREG(st.st_mode) or st.st_size <= pos:
+            return
+        mm = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+        try:
+            self._mapview = memoryview(mm)
+        except TypeError:
+            # Python 2: mmap does not support memoryview.
+            mm.close()
+            return
+        self._mmap = mm
+        self._mapstart = pos
+        self._mapsize = st.st_size
+
+    def _mapchunks(self):
+        view = self._mapview
+        for pos in xrange(self._mapstart, self._mapsize, self.chunksize):
+            yield view[pos:pos+self.chunksize]
+        self.inputfile.seek(self._mapsize)
+
+    def _readchunks(self):
+        if hasattr(self.inputfile, 'readinto'):
+            buf = bytearray(self.chunksize)
+            view = memoryview(buf)
+            while True:
+                n = self.inputfile.readinto(buf)
+                if not n:
+                    break
+                yield view[:n]
+        else:
+            while True:
+                chunk = self.inputfile.read(self.chunksize)
+                if not chunk:
+                    break
+                yield chunk
+
+    def _startreadahead(self, nbuffers):
+        self._free = Queue.Queue()
+        self._filled = Queue.Queue()
+        self._stop = False
+        for i in range(nbuffers):
+            self._free.put(bytearray(self.chunksize))
+        self._thread = threading.Thread(target=self._readahead)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _readahead(self):
+        try:
+            while True:
+                buf = self._free.get()
+                if self._stop:
+                    break
+                n = self.inputfile.readinto(buf)
+                self._filled.put((buf, n, None))
+                if not n:
+                    break
+        except Exception as e:
+            self._filled.put((None, 0, e))
+
+    def _readaheadchunks(self):
+        while True:
+            buf, n, err = self._filled.get()
+            if err is not None:
+                raise err
+            if not n:
+                break
+            yield memoryview(buf)[:n]
+            self._free.put(buf)
+        self._thread.join()
+        self._thread = None
 
     def __iter__(self):
         return self
 
     def next(self):
-        chunk = self.inputfile.read(self.chunksize)
-        if chunk:
-            self.crc32 = zlib.crc32(chunk, self.crc32)
-            return chunk
-        else:
-            raise StopIteration
+        chunk = next(self._chunks)
+        self.crc32 = zlib.crc32(chunk, self.crc32)
+        return chunk
+
+    def close(self):
+        """Stop reading ahead and release the memory map, if any.
+        """
+        if self._thread is not None:
+            self._stop = True
+            self._free.put(None)
+            self._thread.join()
+            self._thread = None
+        self._chunks.close()
+        if self._mmap is not None:
+            self._mapview = None
+            try:
+                self._mmap.close()
+            except BufferError:
+                # Some chunk is still referenced somewhere.  Leave it
+                # to the garbage collector.
+                pass
+            self._mmap = None
 
 
 class DataSelection(object):
@@ -181,6 +303,20 @@ class IDSClient(object):
     from the ICAT client.
     """
 
+    chunksize = 1048576
+    """Size of the chunks to send in :meth:`put`.
+    """
+
+    readahead = 0
+    """Number of chunks to read ahead from the input in a background
+    thread in :meth:`put`.
+    """
+
+    usemmap = False
+    """Whether to memory map the input in :meth:`put` if it is a
+    regular file.
+    """
+
     def __init__(self, url, sessionId=None, sslContext=None, proxy=None):
         """Create an IDSClient.
         """
@@ -499,11 +635,16 @@ class IDSClient(object):
         if not inputStream:
             raise ValueError("Input stream is null")
 
-        inputreader = ChunkedFileReader(inputStream)
-        req = IDSRequest(self.url + "put", parameters, 
-                         data=inputreader, method="PUT")
-        req.add_header('Content-Type', 'application/octet-stream')
-        result = self.opener.open(req).read().decode('ascii')
+        inputreader = ChunkedFileReader(inputStream, self.chunksize, 
+                                        readahead=self.readahead, 
+                                        usemmap=self.usemmap)
+        try:
+            req = IDSRequest(self.url + "put", parameters, 
+                             data=inputreader, method="PUT")
+            req.add_header('Content-Type', 'application/octet-stream')
+            result = self.opener.open(req).read().decode('ascii')
+        finally:
+            inputreader.close()
         crc = inputreader.crc32 & 0xffffffff
         om = json.loads(result)
         if om["checksum"] != crc:
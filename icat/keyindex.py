@@ -0,0 +1,442 @@
+"""Provide key and object indexes having bounded memory consumption.
+
+.. note::
+   This module is mostly intended as a helper for the icatdump and
+   icatingest scripts.  Most users will not need to use it directly
+   or even care about it.
+
+When writing a data file, the keys generated by
+:meth:`icat.entity.Entity.getUniqueKey` are cached in a key index.
+When reading a data file, the objects retrieved by
+:meth:`icat.client.Client.searchUniqueKey` are cached in an object
+index.  Both are plain dicts by default.  For very large data chunks,
+these dicts may use a lot of memory, because the keys are long nested
+strings, such as::
+
+    Datafile_dataset-(investigation-(facility-(name-ESNF)_name-...)_name-...)_name-...
+
+The classes defined in this module may be used instead.  They keep a
+limited number of recently used entries in memory and move the least
+recently used ones to a temporary SQLite database on disk.  In the
+database, the keys are stored in a compact form: each parenthesized
+part of a key is stored only once in a table of fragments and
+replaced by the numeric id of the fragment.
+
+When writing many data chunks that refer to the same set of objects
+known in advance, such as the static objects, each chunk may use its
+own index layered over a shared index of these keys, see
+:class:`~icat.keyindex.ChainIndex`.
+"""
+
+from collections import OrderedDict
+import itertools
+import pickle
+import re
+import sqlite3
+try:
+    # Python 3.3 and newer
+    from collections.abc import MutableMapping
+except ImportError:
+    # Python 2
+    from collections import MutableMapping
+import icat.dumpfile
+
+__all__ = ['KeyIndex', 'ObjIndex', 'ChainIndex']
+
+
+_innerfrag_re = re.compile(r"\(([^()]*)\)")
+_fragref_re = re.compile(r"\{(\d+)\}")
+
+class _Fragments(object):
+    """The table of key fragments in the database.
+
+    Encode a key by replacing each parenthesized part, starting with
+    the innermost ones, by a reference to an entry in the table.
+    The most recently used fragments are cached.
+    """
+
+    cachesize = 10000
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.conn.execute("CREATE TABLE fragment ("
+                          "id INTEGER PRIMARY KEY, "
+                          "text TEXT NOT NULL UNIQUE)")
+        self.ids = {}
+        self.texts = {}
+
+    def _getid(self, text, add):
+        try:
+            return self.ids[text]
+        except KeyError:
+            pass
+        row = self.conn.execute("SELECT id FROM fragment WHERE text = ?",
+                                (text,)).fetchone()
+        if row is not None:
+            fid = row[0]
+        elif add:
+            cur = self.conn.execute("INSERT INTO fragment (text) VALUES (?)",
+                                    (text,))
+            fid = cur.lastrowid
+        else:
+            raise KeyError(text)
+        if len(self.ids) >= self.cachesize:
+            self.ids.clear()
+        self.ids[text] = fid
+        return fid
+
+    def _gettext(self, fid):
+        try:
+            return self.texts[fid]
+        except KeyError:
+            pass
+        row = self.conn.execute("SELECT text FROM fragment WHERE id = ?",
+                                (fid,)).fetchone()
+        text = self.decode(row[0])
+        if len(self.texts) >= self.cachesize:
+            self.texts.clear()
+        self.texts[fid] = text
+        return text
+
+    def encode(self, key, add=True):
+        """Encode a key.
+
+        If `add` is :const:`False`, do not add new fragments to the
+        table, but return :const:`None` if any fragment is not known,
+        because the key cannot be in the database in this case.
+        """
+        repl = lambda m: "{%d}" % self._getid(m.group(1), add)
+        try:
+            while '(' in key:
+                key, n = _innerfrag_re.subn(repl, key)
+                if not n:
+                    break
+        except KeyError:
+            return None
+        return key
+
+    def decode(self, code):
+        """Decode a key."""
+        repl = lambda m: "(%s)" % self._gettext(int(m.group(1)))
+        return _fragref_re.sub(repl, code)
+
+
+class _SpillIndex(MutableMapping):
+    """Base class for a mapping spilling to a temporary database.
+
+    The `cachesize` most recently used entries are kept in memory.
+    Each entry is either in memory or in the database, but never in
+    both.  Subclasses must define the columns of the database table
+    and the conversion of the keys and values to and from rows.
+
+    Looking up entries other than the current one while iterating
+    over the index may move them around, so that their keys may be
+    skipped or yielded more than once.
+    """
+
+    keycolumns = ()
+    valuecolumns = ()
+
+    def __init__(self, cachesize=100000):
+        if cachesize < 1:
+            raise ValueError("cachesize must be positive.")
+        self.cachesize = cachesize
+        self._hot = OrderedDict()
+        self._conn = None
+        self._fragments = None
+        self._lastmiss = None
+
+    def _dbkey(self, key, add):
+        """Convert key to a tuple of column values.
+
+        Return :const:`None` if `add` is :const:`False` and the key
+        is known not to be in the database.
+        """
+        raise NotImplementedError
+
+    def _pykey(self, row):
+        raise NotImplementedError
+
+    def _dbvalue(self, value):
+        raise NotImplementedError
+
+    def _pyvalue(self, row):
+        raise NotImplementedError
+
+    def _spillable(self, key, value):
+        """Whether the entry may be moved to the database."""
+        return True
+
+    def _opendb(self):
+        # An empty file name creates a temporary database on disk
+        # that is deleted when the connection is closed.
+        self._conn = sqlite3.connect("", check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode = OFF")
+        self._conn.execute("PRAGMA synchronous = OFF")
+        cols = [ "%s NOT NULL" % c
+                 for c in self.keycolumns + self.valuecolumns ]
+        self._conn.execute("CREATE TABLE entry (%s, PRIMARY KEY (%s))"
+                           % (", ".join(cols), ", ".join(self.keycolumns)))
+        self._fragments = _Fragments(self._conn)
+
+    def _keycond(self):
+        return " AND ".join("%s = ?" % c for c in self.keycolumns)
+
+    def _dbload(self, key):
+        """Move an entry from the database to memory.
+
+        Raise :exc:`KeyError` if the key is not in the database.
+        """
+        dbkey = None
+        if self._conn is not None:
+            dbkey = self._dbkey(key, False)
+        if dbkey is None:
+            raise KeyError(key)
+        row = self._conn.execute("SELECT %s FROM entry WHERE %s"
+                                 % (", ".join(self.valuecolumns),
+                                    self._keycond()), dbkey).fetchone()
+        if row is None:
+            raise KeyError(key)
+        self._conn.execute("DELETE FROM entry WHERE %s" % self._keycond(),
+                           dbkey)
+        value = self._pyvalue(row)
+        self._hot[key] = value
+        self._evict()
+        return value
+
+    def _dbdelete(self, key):
+        if self._conn is None:
+            return False
+        dbkey = self._dbkey(key, False)
+        if dbkey is None:
+            return False
+        cur = self._conn.execute("DELETE FROM entry WHERE %s"
+                                 % self._keycond(), dbkey)
+        return cur.rowcount > 0
+
+    def _evict(self):
+        """Move the least recently used entries to the database.
+
+        If the cache is full, move entries until it is filled by
+        three quarters, so that the database is written in batches.
+        """
+        if len(self._hot) <= self.cachesize:
+            return
+        if self._conn is None:
+            self._opendb()
+        n = len(self._hot) - 3 * self.cachesize // 4
+        rows = []
+        keep = []
+        for key in list(itertools.islice(self._hot, n)):
+            value = self._hot.pop(key)
+            if self._spillable(key, value):
+                rows.append(self._dbkey(key, True) + self._dbvalue(value))
+            else:
+                keep.append((key, value))
+        self._hot.update(keep)
+        ncols = len(self.keycolumns) + len(self.valuecolumns)
+        self._conn.executemany("INSERT INTO entry VALUES (%s)"
+                               % ", ".join(["?"] * ncols), rows)
+        self._conn.commit()
+
+    def __getitem__(self, key):
+        try:
+            value = self._hot.pop(key)
+        except KeyError:
+            try:
+                return self._dbload(key)
+            except KeyError:
+                self._lastmiss = key
+                raise
+        self._hot[key] = value
+        return value
+
+    def __contains__(self, key):
+        try:
+            self[key]
+            return True
+        except KeyError:
+            return False
+
+    def __setitem__(self, key, value):
+        # Typically, a key is looked up first and only added if it
+        # has not been found.  We can save the database lookup in
+        # that case.
+        if key in self._hot:
+            del self._hot[key]
+        elif key != self._lastmiss:
+            self._dbdelete(key)
+        self._lastmiss = None
+        self._hot[key] = value
+        self._evict()
+
+    def __delitem__(self, key):
+        self._lastmiss = None
+        if key in self._hot:
+            del self._hot[key]
+        elif not self._dbdelete(key):
+            raise KeyError(key)
+
+    def __iter__(self):
+        # Fetch the keys from the database in pages, as the table may
+        # change while iterating.  Entries moved to the database in
+        # the meanwhile have already been yielded and get a higher
+        # rowid.
+        maxrowid = 0
+        if self._conn is not None:
+            maxrowid = self._conn.execute("SELECT MAX(rowid) FROM entry"
+                                          ).fetchone()[0] or 0
+        seen = set(self._hot)
+        for key in list(self._hot):
+            yield key
+        rowid = 0
+        while rowid < maxrowid:
+            rows = self._conn.execute("SELECT rowid, %s FROM entry "
+                                      "WHERE rowid > ? AND rowid <= ? "
+                                      "ORDER BY rowid LIMIT 1000"
+                                      % ", ".join(self.keycolumns),
+                                      (rowid, maxrowid)).fetchall()
+            if not rows:
+                break
+            for row in rows:
+                rowid = row[0]
+                key = self._pykey(row[1:])
+                if key not in seen:
+                    yield key
+
+    def __len__(self):
+        n = len(self._hot)
+        if self._conn is not None:
+            n += self._conn.execute("SELECT COUNT(*) FROM entry").fetchone()[0]
+        return n
+
+    def clear(self):
+        """Remove all entries and the temporary database."""
+        self._hot.clear()
+        self._lastmiss = None
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+            self._fragments = None
+
+
+class KeyIndex(_SpillIndex):
+    """A key index having bounded memory consumption.
+
+    This may be used in place of a dict as the `keyindex` argument to
+    :meth:`icat.entity.Entity.getUniqueKey`.  It maps tuples of the
+    entity type name and the id of objects to their keys.
+
+    :param cachesize: maximum number of entries to keep in memory.
+    :type cachesize: :class:`int`
+    """
+
+    keycolumns = ("name", "id")
+    valuecolumns = ("key",)
+
+    def _dbkey(self, key, add):
+        return tuple(key)
+
+    def _pykey(self, row):
+        return tuple(row)
+
+    def _dbvalue(self, value):
+        return (self._fragments.encode(value),)
+
+    def _pyvalue(self, row):
+        return self._fragments.decode(row[0])
+
+    def _spillable(self, key, value):
+        return key[1] is not None
+
+
+class ChainIndex(MutableMapping):
+    """An index layered over a shared read only index.
+
+    Lookups fall through from `index` to `shared`, while new entries
+    are only added to `index`.  This is similar to
+    :class:`collections.ChainMap`, that is not available in Python 2.
+    It avoids copying the shared index into the index of each data
+    chunk.  Entries in `shared` cannot be deleted.
+
+    :param index: the index to add new entries to.
+    :type index: :class:`dict` or :class:`~icat.keyindex.KeyIndex`
+    :param shared: the index to look up entries not found in `index`.
+        It is not modified.
+    :type shared: :class:`dict` or :class:`~icat.keyindex.KeyIndex`
+    """
+
+    def __init__(self, index, shared):
+        self.index = index
+        self.shared = shared
+
+    def __getitem__(self, key):
+        try:
+            return self.index[key]
+        except KeyError:
+            return self.shared[key]
+
+    def __contains__(self, key):
+        return key in self.index or key in self.shared
+
+    def __setitem__(self, key, value):
+        self.index[key] = value
+
+    def __delitem__(self, key):
+        del self.index[key]
+
+    def __iter__(self):
+        for key in self.index:
+            yield key
+        for key in self.shared:
+            if key not in self.index:
+                yield key
+
+    def __len__(self):
+        return len(self.index) + sum(1 for key in self.shared
+                                     if key not in self.index)
+
+
+class ObjIndex(_SpillIndex):
+    """An object index having bounded memory consumption.
+
+    This may be used in place of a dict as the `objindex` argument to
+    :meth:`icat.client.Client.searchUniqueKey`.  It maps keys to
+    entity objects.  Objects that have been moved to the database are
+    restored as new entity objects having the same attributes and
+    relations.  Objects not having an id are always kept in memory,
+    because they are supposed to get created at the ICAT server
+    later on.
+
+    :param client: the client to use to restore entity objects.
+    :type client: :class:`icat.client.Client`
+    :param cachesize: maximum number of entries to keep in memory.
+    :type cachesize: :class:`int`
+    """
+
+    keycolumns = ("key",)
+    valuecolumns = ("obj",)
+
+    def __init__(self, client, cachesize=100000):
+        super(ObjIndex, self).__init__(cachesize)
+        self.client = client
+
+    def _dbkey(self, key, add):
+        code = self._fragments.encode(key, add)
+        if code is None:
+            return None
+        return (code,)
+
+    def _pykey(self, row):
+        return self._fragments.decode(row[0])
+
+    def _dbvalue(self, value):
+        tree = icat.dumpfile._entity2tree(value)
+        return (sqlite3.Binary(pickle.dumps(tree, pickle.HIGHEST_PROTOCOL)),)
+
+    def _pyvalue(self, row):
+        tree = pickle.loads(bytes(row[0]))
+        return icat.dumpfile._tree2entity(self.client, tree)
+
+    def _spillable(self, key, value):
+        return getattr(value, 'id', None) is not None
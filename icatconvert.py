@@ -0,0 +1,63 @@
+#! /usr/bin/python
+#
+# Convert an ICAT dump file to another format without an ICAT server.
+
+import logging
+import icat
+import icat.config
+from icat.dumpfile import open_dumpfile
+try:
+    import icat.dumpfile_xml
+except ImportError:
+    pass
+try:
+    import icat.dumpfile_yaml
+except ImportError:
+    pass
+import icat.dumpfile_jsonl
+try:
+    import icat.dumpfile_sqlite
+except ImportError:
+    pass
+from icat.dumpconvert import SchemaSnapshot, convertdump
+
+logging.basicConfig(level=logging.INFO)
+
+formats = icat.dumpfile.Backends.keys()
+if len(formats) == 0:
+    raise RuntimeError("No datafile backends available.")
+
+config = icat.config.Config(defaultvars=False)
+config.add_variable('schema', ("--schema",),
+                    dict(help="schema snapshot file as written by "
+                         "icatdump --schema"))
+config.add_variable('infile', ("-i", "--inputfile"),
+                    dict(help="input file name or '-' for stdin"),
+                    default='-')
+config.add_variable('informat', ("-f", "--format"),
+                    dict(help="input file format", choices=formats),
+                    default='YAML')
+config.add_variable('outfile', ("-o", "--outputfile"),
+                    dict(help="output file name or '-' for stdout"),
+                    default='-')
+config.add_variable('outformat', ("-t", "--to-format"),
+                    dict(help="output file format", choices=formats),
+                    default='YAML')
+config.add_variable('compressthreads', ("--compress-threads",),
+                    dict(help="number of threads to compress the output "
+                         "file, if its name ends in .gz, .bz2, .xz, "
+                         "or .zst"),
+                    type=int, default=1)
+config.add_variable('index', ("--index",),
+                    dict(help="write a chunk index along with the "
+                         "output file"),
+                    type=icat.config.flag, default=False)
+_, conf = config.getconfig()
+
+schema = SchemaSnapshot.load(conf.schema)
+
+with open_dumpfile(None, conf.infile, conf.informat, 'r') as reader, \
+     open_dumpfile(schema, conf.outfile, conf.outformat, 'w',
+                   compressthreads=conf.compressthreads,
+                   index=conf.index) as writer:
+    convertdump(reader, writer, schema)
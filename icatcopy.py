@@ -0,0 +1,126 @@
+#! /usr/bin/python
+#
+# Copy the content of an ICAT to another ICAT server.
+
+import logging
+import threading
+import Queue
+import icat
+import icat.config
+from icat.query import Query
+from icat.dumpfile_queue import (QueueDumpFileReader, QueueDumpFileWriter,
+                                 put_error)
+from icat.dump_queries import *
+
+logging.basicConfig(level=logging.INFO)
+logging.getLogger('suds.client').setLevel(logging.CRITICAL)
+
+config = icat.config.Config(ids=False)
+config.add_variable('target', ("--target",),
+                    dict(help="section in the config file to configure "
+                         "the target ICAT"))
+config.add_variable('workers', ("--workers",),
+                    dict(help="number of concurrent sessions to search "
+                         "the investigation chunks at the source"),
+                    type=int, default=1)
+config.add_variable('targetworkers', ("--target-workers",),
+                    dict(help="number of concurrent sessions to create "
+                         "the investigation chunks at the target"),
+                    type=int, default=1)
+config.add_variable('queuesize', ("--queue-size",),
+                    dict(help="maximum number of data chunks to hold "
+                         "in memory"),
+                    type=int, default=10)
+config.add_variable('batchsize', ("--batch-size",),
+                    dict(help="maximum number of objects to create "
+                         "at the target at once"),
+                    type=int, default=100)
+config.add_variable('chunklimit', ("--chunk-limit",),
+                    dict(help="maximum number of objects in an "
+                         "investigation chunk"),
+                    type=int, optional=True)
+client, conf = config.getconfig()
+
+# The target is configured in another section of the same
+# configuration file.
+targetargs = ["-s", conf.target]
+if len(conf.configFile) == 1:
+    targetargs += ["-c", conf.configFile[0]]
+targetconfig = icat.config.Config(ids=False, args=targetargs)
+target, targetconf = targetconfig.getconfig()
+
+for c in (client, target):
+    if c.apiversion < '4.3':
+        raise RuntimeError("Sorry, ICAT version %s is too old, "
+                           "need 4.3.0 or newer." % c.apiversion)
+client.login(conf.auth, conf.credentials)
+target.login(targetconf.auth, targetconf.credentials)
+
+# The worker sessions at the source and at the target are logged in
+# below and logged out in the end, also if the copy fails.
+workers = []
+targetworkers = []
+
+
+def getInvestigationChunks(client):
+    investsearch = Query(client, "Investigation", attribute="id",
+                         order=["facility.name", "name", "visitId"])
+    for i in client.searchChunked(investsearch):
+        yield getInvestigationQueries(client, i, preloaded=True)
+
+def dump(chunkqueue):
+    """Search the objects at the source and put them into the queue.
+
+    Any error is also put into the queue, so that the main thread
+    does not wait for data forever.
+    """
+    dumpfile = None
+    try:
+        dumpfile = QueueDumpFileWriter(client, chunkqueue)
+        with dumpfile:
+            dumpfile.writedata(getAuthQueries(client))
+            dumpfile.writedata(getStaticQueries(client))
+            dumpfile.writechunks(getInvestigationChunks(client),
+                                 clients=workers, chunksize=5,
+                                 chunklimit=conf.chunklimit,
+                                 keyindex=getStaticKeyIndex(client))
+            dumpfile.writedata(getOtherQueries(client))
+    except Exception as e:
+        if dumpfile is None or not dumpfile.closed:
+            put_error(chunkqueue, e)
+        raise
+
+def create_batch(objs):
+    """Create a batch of objects of the same type at the target.
+    """
+    ids = objs[0].client.createMany(objs)
+    for obj, i in zip(objs, ids):
+        obj.id = i
+
+# The searches at the source run in a background thread, while the
+# objects are created at the target in the main thread.  The queue
+# in between has a maximum size, so that the source waits if the
+# target falls behind.  The thread is a daemon, so that it does not
+# keep the script alive if creating the objects fails.
+try:
+    if conf.workers > 1:
+        for i in range(conf.workers):
+            c = client.clone()
+            c.login(conf.auth, conf.credentials)
+            workers.append(c)
+    if conf.targetworkers > 1:
+        for i in range(conf.targetworkers):
+            c = target.clone()
+            c.login(targetconf.auth, targetconf.credentials)
+            targetworkers.append(c)
+    chunkqueue = Queue.Queue(maxsize=conf.queuesize)
+    source = threading.Thread(target=dump, args=(chunkqueue,))
+    source.daemon = True
+    source.start()
+    with QueueDumpFileReader(target, chunkqueue) as dumpfile:
+        dumpfile.processobjs(create_batch, clients=targetworkers,
+                             batchsize=conf.batchsize)
+    source.join()
+finally:
+    for c in workers + targetworkers:
+        c.logout()
@@ -0,0 +1,57 @@
+#! /usr/bin/python
+#
+# Compare the content of two ICAT dump files as created by icatdump.py.
+
+import sys
+import logging
+import icat
+import icat.config
+from icat.dumpfile import open_dumpfile
+try:
+    import icat.dumpfile_xml
+except ImportError:
+    pass
+try:
+    import icat.dumpfile_yaml
+except ImportError:
+    pass
+import icat.dumpfile_jsonl
+try:
+    import icat.dumpfile_sqlite
+except ImportError:
+    pass
+from icat.dumpdiff import diffdumps
+
+logging.basicConfig(level=logging.INFO)
+
+formats = icat.dumpfile.Backends.keys()
+if len(formats) == 0:
+    raise RuntimeError("No datafile backends available.")
+
+config = icat.config.Config(defaultvars=False)
+config.add_variable('file1', ("file1",),
+                    dict(metavar="FILE1", help="old dump file"))
+config.add_variable('file2', ("file2",),
+                    dict(metavar="FILE2", help="new dump file"))
+config.add_variable('format', ("-f", "--format"),
+                    dict(help="input file format", choices=formats),
+                    default='YAML')
+config.add_variable('buffersize', ("--buffer-size",),
+                    dict(help="maximum number of objects from each file "
+                         "to sort in memory"),
+                    type=int, default=10000)
+_, conf = config.getconfig()
+
+marks = { 'removed': '-', 'added': '+', 'changed': '~' }
+
+ndiff = 0
+with open_dumpfile(None, conf.file1, conf.format, 'r') as dump1, \
+     open_dumpfile(None, conf.file2, conf.format, 'r') as dump2:
+    for status, name, key, changes in diffdumps(dump1, dump2,
+                                                conf.buffersize):
+        ndiff += 1
+        print("%s %s %s" % (marks[status], name, key))
+        for attr, old, new in changes:
+            print("    %s: %r -> %r" % (attr, old, new))
+
+sys.exit(1 if ndiff else 0)
@@ -2,11 +2,14 @@
 #
 # Dump the content of the ICAT to a file or to stdout.
 
+import os
+import json
 import logging
 import icat
 import icat.config
 from icat.query import Query
 from icat.dumpfile import open_dumpfile
+from icat.dumpshard import ShardedDumpWriter
 try:
     import icat.dumpfile_xml
 except ImportError:
@@ -15,7 +18,14 @@ try:
     import icat.dumpfile_yaml
 except ImportError:
     pass
+import icat.dumpfile_jsonl
+try:
+    import icat.dumpfile_sqlite
+except ImportError:
+    pass
 from icat.dump_queries import *
+from icat.dumpconvert import SchemaSnapshot
+from icat.helper import parse_attr_string
 
 
 logging.basicConfig(level=logging.INFO)
@@ -27,11 +37,68 @@ if len(formats) == 0:
 
 config = icat.config.Config(ids=False)
 config.add_variable('file', ("-o", "--outputfile"), 
-                    dict(help="output file name or '-' for stdout"),
+                    dict(help="output file name or '-' for stdout, "
+                         "or the output directory with --shards"),
                     default='-')
 config.add_variable('format', ("-f", "--format"), 
                     dict(help="output file format", choices=formats),
                     default='YAML')
+config.add_variable('workers', ("--workers",), 
+                    dict(help="number of concurrent sessions to search "
+                         "the investigation chunks"),
+                    type=int, default=1)
+config.add_variable('compressthreads', ("--compress-threads",), 
+                    dict(help="number of threads to compress the output "
+                         "file, if its name ends in .gz, .bz2, .xz, "
+                         "or .zst"),
+                    type=int, default=1)
+config.add_variable('chunklimit', ("--chunk-limit",), 
+                    dict(help="maximum number of objects in an "
+                         "investigation chunk"),
+                    type=int, optional=True)
+config.add_variable('keycache', ("--key-cache",), 
+                    dict(help="maximum number of object keys to keep "
+                         "in memory per chunk"),
+                    type=int, optional=True)
+config.add_variable('index', ("--index",), 
+                    dict(help="write a chunk index along with the "
+                         "output file"), 
+                    type=icat.config.flag, default=False)
+config.add_variable('shards', ("--shards",), 
+                    dict(help="write the investigation chunks to this "
+                         "number of shards in the output directory"),
+                    type=int, optional=True)
+config.add_variable('shardassign', ("--shard-assign",), 
+                    dict(help="how to assign the investigation chunks "
+                         "to the shards", choices=["roundrobin", "size"]),
+                    default='roundrobin')
+config.add_variable('facility', ("--facility",), 
+                    dict(help="only dump the investigations and the "
+                         "static content of this facility"), 
+                    optional=True)
+config.add_variable('investigations', ("--investigations",), 
+                    dict(help="only dump the investigations having one "
+                         "of these names, given as a comma separated list"), 
+                    optional=True)
+config.add_variable('fromdate', ("--from-date",), 
+                    dict(help="only dump investigations having a start "
+                         "date not earlier than this"), 
+                    optional=True)
+config.add_variable('todate', ("--to-date",), 
+                    dict(help="only dump investigations having a start "
+                         "date earlier than this"), 
+                    optional=True)
+config.add_variable('since', ("--since",), 
+                    dict(help="only dump objects modified after this time"), 
+                    optional=True)
+config.add_variable('manifest', ("--manifest",), 
+                    dict(help="manifest file to keep the watermark "
+                         "for incremental dumps"), 
+                    optional=True)
+config.add_variable('schema', ("--schema",), 
+                    dict(help="also write a snapshot of the ICAT schema "
+                         "to this file"), 
+                    optional=True)
 client, conf = config.getconfig()
 
 if client.apiversion < '4.3':
@@ -39,17 +106,133 @@ if client.apiversion < '4.3':
                        % client.apiversion)
 client.login(conf.auth, conf.credentials)
 
+if conf.schema:
+    SchemaSnapshot.fromclient(client).save(conf.schema)
+
+# Incremental dumps: take the starting point either from the command
+# line or from the watermark recorded in the manifest by the previous
+# run.  The new watermark is taken from the server before we start,
+# so that objects modified while the dump is running will be caught
+# by the next run.  It is in the timezone of the server, which is
+# needed to compare with the modification times in the search.
+# The timezone of the server is also needed to convert the times
+# given on the command line.
+watermark = None
+servertz = None
+if conf.manifest:
+    watermark = getWatermark(client)
+    if watermark is not None:
+        servertz = watermark.tzinfo
+elif conf.since or conf.fromdate or conf.todate:
+    servertz = getServerTimezone(client)
+
+def servertime(d):
+    """Convert a time having timezone info to the timezone of the server.
+
+    Times without timezone info are taken to be in the local time of
+    the server.  Note that the offset of the server's timezone is
+    taken from a modification time at the server, it may differ at
+    other times of the year in the case of daylight saving time.
+    """
+    if d is not None and d.tzinfo is not None and servertz is not None:
+        d = d.astimezone(servertz)
+    return d
 
-with open_dumpfile(client, conf.file, conf.format, 'w') as dumpfile:
-    dumpfile.writedata(getAuthQueries(client))
-    dumpfile.writedata(getStaticQueries(client))
-    # Dump the investigations each in their own chunk
+since = None
+if conf.since:
+    since = servertime(parse_attr_string(conf.since, "Date"))
+elif conf.manifest and os.path.exists(conf.manifest):
+    with open(conf.manifest, "rt") as f:
+        since = parse_attr_string(json.load(f)['watermark'], "Date")
+
+# Selective dumps: the conditions restrict the search for the
+# investigations and are pushed into the dependent queries.
+invnames = None
+if conf.investigations:
+    invnames = [ n.strip() for n in conf.investigations.split(",") ]
+startfrom = None
+if conf.fromdate:
+    startfrom = servertime(parse_attr_string(conf.fromdate, "Date"))
+startto = None
+if conf.todate:
+    startto = servertime(parse_attr_string(conf.todate, "Date"))
+invconditions = getInvestigationConditions(facility=conf.facility, 
+                                           names=invnames, 
+                                           startfrom=startfrom, 
+                                           startto=startto)
+
+def getInvestigationChunks(client, preloaded=False):
+    if since is not None:
+        modified = getModifiedInvestigationIds(client, since, 
+                                               invconditions=invconditions)
     investsearch = Query(client, "Investigation", attribute="id", 
-                         order=["facility.name", "name", "visitId"])
+                         order=["facility.name", "name", "visitId"], 
+                         conditions=invconditions)
     for i in client.searchChunked(investsearch):
-        # We fetch Dataset including DatasetParameter.  This may lead
-        # to a large total number of objects even for a small number
-        # of Datasets fetched at once.  Set a very small chunksize to
-        # avoid hitting the limit.
-        dumpfile.writedata(getInvestigationQueries(client, i), chunksize=5)
-    dumpfile.writedata(getOtherQueries(client))
+        if since is None or i in modified:
+            yield getInvestigationQueries(client, i, since=since, 
+                                          preloaded=preloaded)
+
+if conf.shards:
+    if conf.file == '-':
+        raise RuntimeError("Need an output directory with --shards.")
+    outfile = ShardedDumpWriter(client, conf.file, conf.format, conf.shards,
+                                assign=conf.shardassign, index=conf.index)
+else:
+    outfile = open_dumpfile(client, conf.file, conf.format, 'w',
+                            compressthreads=conf.compressthreads,
+                            index=conf.index)
+
+# The searches for the investigation chunks may be dispatched to
+# worker sessions.  These are logged out in the end, also if the dump
+# fails.
+workers = []
+try:
+    if conf.workers > 1:
+        for i in range(conf.workers):
+            c = client.clone()
+            c.login(conf.auth, conf.credentials)
+            workers.append(c)
+    with outfile as dumpfile:
+        dumpfile.keycachesize = conf.keycache
+        dumpfile.writedata(getAuthQueries(client, since=since, 
+                                          invconditions=invconditions, 
+                                          facility=conf.facility))
+        dumpfile.writedata(getStaticQueries(client, since=since, 
+                                            facility=conf.facility))
+        # Dump the investigations each in their own chunk.  We fetch
+        # Dataset including DatasetParameter.  This may lead to a large
+        # total number of objects even for a small number of Datasets
+        # fetched at once.  Set a very small chunksize to avoid hitting
+        # the limit.
+        if workers or conf.shards:
+            # The queries do not include the facility of the static
+            # objects, their keys are taken from a preloaded index.
+            keyindex = getStaticKeyIndex(client, facility=conf.facility)
+            chunks = getInvestigationChunks(client, preloaded=True)
+            dumpfile.writechunks(chunks, clients=workers, chunksize=5, 
+                                 chunklimit=conf.chunklimit, 
+                                 keyindex=keyindex)
+        else:
+            for objs in getInvestigationChunks(client):
+                dumpfile.writedata(objs, chunksize=5, 
+                                   chunklimit=conf.chunklimit)
+        dumpfile.writedata(getOtherQueries(client, since=since, 
+                                           invconditions=invconditions))
+finally:
+    for c in workers:
+        c.logout()
+
+if conf.manifest:
+    manifest = {
+        'watermark': (watermark.isoformat() 
+                      if watermark is not None else None),
+        'since': since.isoformat() if since is not None else None,
+        'format': conf.format,
+        'file': conf.file,
+    }
+    tmpfname = conf.manifest + ".tmp"
+    with open(tmpfname, "wt") as f:
+        json.dump(manifest, f, indent=4, sort_keys=True)
+        f.write("\n")
+    os.rename(tmpfname, conf.manifest)
@@ -3,11 +3,13 @@
 # Restore the content of the ICAT from a dump file as created by
 # icatdump.py.
 
+import sys
 import os.path
 import logging
 import icat
 import icat.config
-from icat.dumpfile import open_dumpfile
+from icat.dumpfile import open_dumpfile, IngestJournal
+from icat.dumpshard import ShardedDumpReader
 try:
     import icat.dumpfile_xml
 except ImportError:
@@ -16,6 +18,11 @@ try:
     import icat.dumpfile_yaml
 except ImportError:
     pass
+import icat.dumpfile_jsonl
+try:
+    import icat.dumpfile_sqlite
+except ImportError:
+    pass
 from icat.helper import parse_attr_string
 
 logging.basicConfig(level=logging.INFO)
@@ -26,9 +33,22 @@ formats = icat.dumpfile.Backends.keys()
 if len(formats) == 0:
     raise RuntimeError("No datafile backends available.")
 
+def chunkrange(value):
+    """Parse a range of chunk numbers of the form START:STOP.
+
+    Either START or STOP may be omitted.
+    """
+    start, sep, stop = value.partition(':')
+    if not sep:
+        raise ValueError("invalid chunk range '%s'" % value)
+    start = int(start) if start else 0
+    stop = int(stop) if stop else sys.maxsize
+    return xrange(start, stop)
+
 config = icat.config.Config(ids="optional")
 config.add_variable('file', ("-i", "--inputfile"), 
-                    dict(help="input file name or '-' for stdin"),
+                    dict(help="input file name or '-' for stdin, or a "
+                         "directory written by icatdump --shards"),
                     default='-')
 config.add_variable('format', ("-f", "--format"), 
                     dict(help="input file format", choices=formats),
@@ -43,6 +63,29 @@ config.add_variable('duplicate', ("--duplicate",),
                     dict(help="behavior in case of duplicate objects",
                          choices=["THROW", "IGNORE", "CHECK", "OVERWRITE"]), 
                     default='THROW')
+config.add_variable('workers', ("--workers",), 
+                    dict(help="number of concurrent sessions to ingest "
+                         "the investigation chunks"),
+                    type=int, default=1)
+config.add_variable('prefetch', ("--prefetch",), 
+                    dict(help="search existing objects in batches "
+                         "beforehand to deal with duplicates"), 
+                    type=icat.config.flag, default=False)
+config.add_variable('chunks', ("--chunks",), 
+                    dict(help="only ingest the chunks in the range "
+                         "START:STOP"), 
+                    type=chunkrange, optional=True)
+config.add_variable('objcache', ("--object-cache",), 
+                    dict(help="maximum number of objects to keep in "
+                         "memory per chunk"),
+                    type=int, optional=True)
+config.add_variable('journal', ("--journal",), 
+                    dict(help="journal file to record the progress"), 
+                    optional=True)
+config.add_variable('resume', ("--resume",), 
+                    dict(help="resume an interrupted ingest, "
+                         "skipping what the journal records as done"), 
+                    type=icat.config.flag, default=False)
 client, conf = config.getconfig()
 
 if conf.uploadDatafiles:
@@ -57,8 +100,11 @@ if client.apiversion < '4.3':
 client.login(conf.auth, conf.credentials)
 
 
-def check_duplicate(obj):
+def check_duplicate(obj, dobj=None):
     """Deal with duplicate objects according conf.duplicate.
+
+    dobj is the already existing object in ICAT.  It will be searched
+    if it is not known yet.
     """
     if conf.duplicate == "THROW":
         raise
@@ -67,14 +113,17 @@ def check_duplicate(obj):
         if getattr(obj, r):
             raise ValueError("Cannot %s duplicate on %s if %s is not empty."
                              % (conf.duplicate, obj.BeanName, r))
-    dobj = client.searchMatching(obj, includes="1")
+    if dobj is None:
+        dobj = obj.client.searchMatching(obj, includes="1")
     if conf.duplicate == "IGNORE":
         pass
     elif conf.duplicate == "CHECK":
         for a in obj.InstAttr:
             v = parse_attr_string(getattr(obj, a), obj.getAttrType(a))
             if v is not None and getattr(dobj, a) != v:
-                raise
+                raise icat.ICATObjectExistsError("%s already exists "
+                                                 "with a different %s."
+                                                 % (obj.BeanName, a))
     elif conf.duplicate == "OVERWRITE":
         for a in obj.InstAttr:
             v = getattr(obj, a)
@@ -83,13 +132,76 @@ def check_duplicate(obj):
         dobj.update()
     obj.id = dobj.id
 
-with open_dumpfile(client, conf.file, conf.format, 'r') as dumpfile:
-    for obj in dumpfile.getobjs():
-        if conf.uploadDatafiles and obj.BeanName == "Datafile":
-            fname = os.path.join(conf.dataDir, obj.name)
-            client.putData(fname, obj)
+def ingest(obj):
+    """Create the object, either in ICAT or by uploading to IDS.
+    """
+    if conf.uploadDatafiles and obj.BeanName == "Datafile":
+        fname = os.path.join(conf.dataDir, obj.name)
+        obj.id = obj.client.putData(fname, obj).id
+    else:
+        try:
+            obj.create()
+        except icat.ICATObjectExistsError:
+            check_duplicate(obj)
+
+def ingest_batch(objs):
+    """Create a batch of objects of the same type.
+
+    Search the already existing objects at once beforehand, so that
+    duplicates may be dealt with without trying to create them first.
+    """
+    if conf.uploadDatafiles and objs[0].BeanName == "Datafile":
+        dobjs = [None] * len(objs)
+    else:
+        dobjs = objs[0].client.searchMatchingMany(objs, includes="1")
+    for obj, dobj in zip(objs, dobjs):
+        if dobj is None:
+            ingest(obj)
+        else:
+            check_duplicate(obj, dobj)
+
+# The auth and static chunks at the beginning of the file and the
+# chunk with the remaining stuff at the end depend on each other and
+# on the investigation chunks.  Only the investigation chunks in
+# between are independent and may be ingested concurrently, each
+# worker in its own session.  The worker sessions are logged out in
+# the end, also if the ingest fails.
+workers = []
+
+# A directory of shards brings its own order of processing: the
+# investigation shards are ingested concurrently, one shard per
+# worker.
+sharded = conf.file != '-' and os.path.isdir(conf.file)
+if sharded and (conf.journal or conf.chunks):
+    raise RuntimeError("Options --journal and --chunks are not supported "
+                       "for a directory of shards.")
+
+if conf.journal:
+    journal = IngestJournal(conf.journal, resume=conf.resume)
+else:
+    journal = None
+
+try:
+    if conf.workers > 1:
+        for i in range(conf.workers):
+            c = client.clone()
+            c.login(conf.auth, conf.credentials)
+            workers.append(c)
+    if sharded:
+        infile = ShardedDumpReader(client, conf.file)
+    else:
+        infile = open_dumpfile(client, conf.file, conf.format, 'r',
+                               chunks=conf.chunks)
+    with infile as dumpfile:
+        dumpfile.objcachesize = conf.objcache
+        kwargs = {} if sharded else dict(journal=journal)
+        if conf.prefetch and conf.duplicate != "THROW":
+            dumpfile.processobjs(ingest_batch, clients=workers, 
+                                 batchsize=100, **kwargs)
         else:
-            try:
-                obj.create()
-            except icat.ICATObjectExistsError:
-                check_duplicate(obj)
+            dumpfile.processobjs(ingest, clients=workers, **kwargs)
+finally:
+    for c in workers:
+        c.logout()
+    if journal:
+        journal.close()
@@ -151,7 +151,8 @@ $long_description
 # Python 3
 rm -rf build
 %{__python3} setup.py install --optimize=1 --root=%{buildroot}
-for f in icatdump.py icatingest.py wipeicat.py
+for f in icatconvert.py icatcopy.py icatdiff.py icatdump.py \
+    icatingest.py wipeicat.py
 do
     mv %{buildroot}%{_bindir}/$$f %{buildroot}%{_bindir}/$$f-%{python3_version}
 done
@@ -160,7 +161,8 @@ done
 # Python 3 other
 rm -rf build
 %{__python3_other} setup.py install --optimize=1 --root=%{buildroot}
-for f in icatdump.py icatingest.py wipeicat.py
+for f in icatconvert.py icatcopy.py icatdiff.py icatdump.py \
+    icatingest.py wipeicat.py
 do
     mv %{buildroot}%{_bindir}/$$f %{buildroot}%{_bindir}/$$f-%{python3_other_version}
 done
@@ -170,7 +172,8 @@ done
 # Python 2
 rm -rf build
 %{__python2} setup.py install --optimize=1 --root=%{buildroot}
-for f in icatdump.py icatingest.py wipeicat.py
+for f in icatconvert.py icatcopy.py icatdiff.py icatdump.py \
+    icatingest.py wipeicat.py
 do
     mv %{buildroot}%{_bindir}/$$f %{buildroot}%{_bindir}/$$f-%{python2_version}
 done
@@ -193,6 +196,12 @@ done
 /usr/sbin/update-alternatives --install \
     %{_bindir}/icatdump             icatdump \
         %{_bindir}/icatdump.py-%{python2_version} 20 \
+    --slave %{_bindir}/icatconvert  icatconvert \
+        %{_bindir}/icatconvert.py-%{python2_version} \
+    --slave %{_bindir}/icatcopy     icatcopy \
+        %{_bindir}/icatcopy.py-%{python2_version} \
+    --slave %{_bindir}/icatdiff     icatdiff \
+        %{_bindir}/icatdiff.py-%{python2_version} \
     --slave %{_bindir}/icatingest   icatingest \
         %{_bindir}/icatingest.py-%{python2_version} \
     --slave %{_bindir}/wipeicat     wipeicat \
@@ -210,6 +219,12 @@ fi
 /usr/sbin/update-alternatives --install \
     %{_bindir}/icatdump             icatdump \
         %{_bindir}/icatdump.py-%{python3_version} 35 \
+    --slave %{_bindir}/icatconvert  icatconvert \
+        %{_bindir}/icatconvert.py-%{python3_version} \
+    --slave %{_bindir}/icatcopy     icatcopy \
+        %{_bindir}/icatcopy.py-%{python3_version} \
+    --slave %{_bindir}/icatdiff     icatdiff \
+        %{_bindir}/icatdiff.py-%{python3_version} \
     --slave %{_bindir}/icatingest   icatingest \
         %{_bindir}/icatingest.py-%{python3_version} \
     --slave %{_bindir}/wipeicat     wipeicat \
@@ -227,6 +242,12 @@ fi
 /usr/sbin/update-alternatives --install \
     %{_bindir}/icatdump             icatdump \
         %{_bindir}/icatdump.py-%{python3_other_version} 30 \
+    --slave %{_bindir}/icatconvert  icatconvert \
+        %{_bindir}/icatconvert.py-%{python3_other_version} \
+    --slave %{_bindir}/icatcopy     icatcopy \
+        %{_bindir}/icatcopy.py-%{python3_other_version} \
+    --slave %{_bindir}/icatdiff     icatdiff \
+        %{_bindir}/icatdiff.py-%{python3_other_version} \
     --slave %{_bindir}/icatingest   icatingest \
         %{_bindir}/icatingest.py-%{python3_other_version} \
     --slave %{_bindir}/wipeicat     wipeicat \
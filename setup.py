@@ -124,7 +124,7 @@ class build_test(distutils.core.Command):
         self.mkpath(destdir)
         refdumpfiles = ["icatdump-%s.%s" % (ver, ext)
                         for ver in ("4.4", "4.7", "4.10")
-                        for ext in ("xml", "yaml")]
+                        for ext in ("jsonl", "xml", "yaml")]
         files = ["example_data.yaml",
                  "ingest-datafiles.xml", "ingest-ds-params.xml"] + refdumpfiles
         for f in files:
@@ -166,7 +166,8 @@ setup(
     license = "Apache-2.0",
     requires = ["suds"],
     packages = ["icat"],
-    scripts = ["icatdump.py", "icatingest.py", "wipeicat.py"],
+    scripts = ["icatconvert.py", "icatcopy.py", "icatdiff.py",
+               "icatdump.py", "icatingest.py", "wipeicat.py"],
     classifiers = [
         "Development Status :: 5 - Production/Stable",
         "Intended Audience :: Developers",
@@ -0,0 +1,169 @@
+"""Test the conditions to select investigations in icat.dump_queries
+and the queries for incremental dumps.
+
+These tests do not need an ICAT server.
+"""
+
+import datetime
+from distutils.version import StrictVersion as Version
+import io
+import json
+from icat.dump_queries import (getInvestigationConditions,
+                               getInvestigationQueries, getAuthQueries,
+                               getOtherQueries)
+from icat.dumpfile_yaml import YAMLDumpFileReader, YAMLDumpFileWriter
+from icat.entities import getTypeMap
+from conftest import gettestdata
+
+
+class Field(dict):
+    """Stand in for an entityField, allowing item and attribute access."""
+    __getattr__ = dict.__getitem__
+
+class EntityInfo(object):
+    def __init__(self, fields):
+        self.fields = fields
+
+class SchemaClient(object):
+    """Stand in for a client, taking the entity information from a
+    schema snapshot.  The snapshot lacks the constraints and the
+    nullability of the attributes, so all entity types are keyed by
+    id and all attributes are taken to be not nullable.
+    """
+    metaattrs = { 'id': 'Long', 'createId': 'String', 'createTime': 'Date',
+                  'modId': 'String', 'modTime': 'Date' }
+
+    def __init__(self, fname):
+        with open(fname, "rt") as f:
+            schema = json.load(f)
+        self.url = schema['service']
+        self.apiversion = Version(schema['apiversion'])
+        self.entities = schema['entities']
+        params = [ e for n, e in self.entities.items()
+                   if n.endswith("Parameter") ]
+        self.entities['parameter'] = {
+            k: dict(set.intersection(*[ set(e[k].items()) for e in params ]))
+            for k in ('attrs', 'rels', 'mrels')
+        }
+        self.typemap = getTypeMap(self)
+
+    def getEntityNames(self):
+        return sorted(n[0].upper() + n[1:] for n in self.entities
+                      if n != 'parameter')
+
+    def getEntityInfo(self, beanName):
+        e = self.entities[beanName[0].lower() + beanName[1:]]
+        fields = [ Field(name=a, type=t, relType='ATTRIBUTE',
+                         notNullable=True)
+                   for a, t in self.metaattrs.items() ]
+        for kind, relType in (('attrs', 'ATTRIBUTE'), ('rels', 'ONE'),
+                              ('mrels', 'MANY')):
+            for a, t in e[kind].items():
+                if kind != 'attrs':
+                    t = t[0].upper() + t[1:]
+                fields.append(Field(name=a, type=t, relType=relType,
+                                    notNullable=True))
+        return EntityInfo(fields)
+
+    def getEntityClass(self, name):
+        for c in self.typemap.values():
+            if name == c.BeanName:
+                return c
+        raise ValueError("Invalid entity type '%s'." % name)
+
+    def searchChunked(self, query):
+        """Pretend that each search for ids finds the same objects.
+        """
+        self.searches.append(query)
+        return [3, 1, 2]
+
+def schemaclient():
+    client = SchemaClient(gettestdata("schema-4.10.json"))
+    client.searches = []
+    return client
+
+
+def test_conditions_empty():
+    """Without any criteria, all investigations are selected.
+    """
+    assert getInvestigationConditions() == {}
+
+def test_conditions_facility_names():
+    """Select by facility and names, quoting the string values.
+    """
+    conditions = getInvestigationConditions(facility="ESNF",
+                                            names=["12100409-ST",
+                                                   "O'Brien"])
+    assert conditions == {
+        "facility.name": "= 'ESNF'",
+        "name": "IN ('12100409-ST', 'O''Brien')",
+    }
+
+def test_conditions_dates():
+    """Select a range of start dates.
+    """
+    conditions = getInvestigationConditions(
+        startfrom=datetime.datetime(2020, 5, 1),
+        startto=datetime.datetime(2020, 6, 1, 12, 30))
+    assert conditions == {
+        "startDate": [">= {ts 2020-05-01 00:00:00}",
+                      "< {ts 2020-06-01 12:30:00}"],
+    }
+    conditions = getInvestigationConditions(
+        startfrom=datetime.datetime(2020, 5, 1))
+    assert conditions == {"startDate": [">= {ts 2020-05-01 00:00:00}"]}
+
+def test_modified_investigation_chunk():
+    """The queries for an incremental dump of an investigation come in
+    restore order, so that the objects fit in one chunk.
+    """
+    client = schemaclient()
+    since = datetime.datetime(2020, 5, 1)
+    queries = getInvestigationQueries(client, 42, since=since)
+    assert len(queries) > 4
+    f = io.StringIO()
+    writer = YAMLDumpFileWriter(client, f)
+    writer.head()
+    writer.startdata()
+    for i, query in enumerate(queries):
+        name = query.entity.BeanName[0].lower() + query.entity.BeanName[1:]
+        writer.writerecord(name, "%s_%d" % (name, i), {}, None)
+    writer.finalize()
+    f.seek(0)
+    reader = YAMLDumpFileReader(client, f)
+    chunks = [ list(data) for data in reader.getdata() ]
+    assert len(chunks) == 1
+    assert len(chunks[0]) == len(queries)
+
+def test_auth_queries_selective():
+    """In a selective dump, users and groups are fetched by their ids.
+    """
+    client = schemaclient()
+    invconditions = getInvestigationConditions(facility="ESNF")
+    queries = getAuthQueries(client, invconditions=invconditions,
+                             facility="ESNF")
+    assert [ q.entity.BeanName for q in queries ] == [
+        "User", "Grouping", "Rule", "Rule", "PublicStep"
+    ]
+    assert queries[0].conditions == {"id": "IN (1, 2, 3)"}
+    assert queries[1].conditions == {"id": "IN (1, 2, 3)"}
+    assert queries[3].conditions["grouping.id"] == "IN (1, 2, 3)"
+    assert all(q.entity.BeanName in ("User", "Grouping")
+               for q in client.searches)
+
+def test_other_queries_selective():
+    """In a selective dump, each data collection and job is fetched
+    by a single query.
+    """
+    client = schemaclient()
+    invconditions = getInvestigationConditions(names=["12100409-ST"])
+    queries = getOtherQueries(client, invconditions=invconditions)
+    assert [ q.entity.BeanName for q in queries ] == [
+        "Study", "StudyInvestigation", "RelatedDatafile", "DataCollection",
+        "DataCollectionDataset", "DataCollectionDatafile", "Job"
+    ]
+    assert queries[3].conditions == {"id": "IN (1, 2, 3)"}
+    assert queries[6].conditions == {
+        "inputDataCollection.id": "IN (1, 2, 3)",
+        "outputDataCollection.id": "IN (1, 2, 3)",
+    }
@@ -0,0 +1,119 @@
+"""Test converting data files between formats without an ICAT server.
+
+These tests do not need an ICAT server.  The schema snapshot in the
+test data has been derived from the XML Schema Definition for the
+ICAT 4.10 data file format.
+"""
+
+import os.path
+import re
+import pytest
+from icat.dumpfile import open_dumpfile
+from icat.dumpfile_jsonl import _dumps
+from icat.dumpconvert import SchemaSnapshot, convertdump
+from conftest import gettestdata
+
+backends = {
+    'JSONL': "icatdump-4.10.jsonl",
+}
+try:
+    import icat.dumpfile_xml
+    backends['XML'] = "icatdump-4.10.xml"
+except ImportError:
+    pass
+try:
+    import icat.dumpfile_yaml
+    backends['YAML'] = "icatdump-4.10.yaml"
+except ImportError:
+    pass
+
+# Lines in the header of the data file that differ from the reference.
+headline_re = re.compile(br'^(\{"head"|# |\s*<(date|apiversion|generator)>)')
+
+def datalines(fname):
+    """Read the lines of a data file, leaving out the header."""
+    with open(fname, "rb") as f:
+        return [ l for l in f if not headline_re.match(l) ]
+
+@pytest.fixture(scope="module")
+def schema():
+    return SchemaSnapshot.load(gettestdata("schema-4.10.json"))
+
+
+@pytest.mark.parametrize("outfmt", sorted(backends.keys()))
+@pytest.mark.parametrize("infmt", sorted(backends.keys()))
+def test_convert(tmpdirsec, schema, infmt, outfmt):
+    """Convert the reference data files to each other format.
+
+    The result must be the same as the reference file in the output
+    format, apart from the header.
+    """
+    infile = gettestdata(backends[infmt])
+    ext = os.path.splitext(backends[outfmt])[1]
+    outfile = os.path.join(tmpdirsec, "convert-%s%s" % (infmt, ext))
+    with open_dumpfile(None, infile, infmt, 'r') as reader, \
+         open_dumpfile(schema, outfile, outfmt, 'w') as writer:
+        convertdump(reader, writer, schema)
+    assert datalines(outfile) == datalines(gettestdata(backends[outfmt]))
+
+@pytest.mark.parametrize("outfmt", sorted(backends.keys()))
+def test_convert_refs(tmpdirsec, schema, outfmt):
+    """References to objects from other chunks are passed on.
+    """
+    infile = os.path.join(tmpdirsec, "convert-refs-input.jsonl")
+    fkey = "Facility_name-ESNF"
+    ikey = "Investigation_facility-(name-ESNF)_name-inv1_visitId-1"
+    records = [
+        {"chunk": 0},
+        {"type": "facility", "key": fkey,
+         "obj": {"name": "ESNF", "daysUntilRelease": 1826}},
+        {"chunk": 1},
+        {"type": "facilityRef", "key": fkey},
+        {"type": "investigation", "key": ikey,
+         "obj": {"facility": fkey, "name": "inv1", "title": "Test",
+                 "visitId": "1"}},
+    ]
+    with open(infile, "wb") as f:
+        for rec in records:
+            f.write(_dumps(rec) + b"\n")
+    ext = os.path.splitext(backends[outfmt])[1]
+    outfile = os.path.join(tmpdirsec, "convert-refs%s" % ext)
+    with open_dumpfile(None, infile, 'JSONL', 'r') as reader, \
+         open_dumpfile(schema, outfile, outfmt, 'w') as writer:
+        convertdump(reader, writer, schema)
+    chunks = []
+    with open_dumpfile(None, outfile, outfmt, 'r') as reader:
+        for data in reader.getdata():
+            recs = reader.getrecords_from_data(data, refs=True)
+            chunks.append([ (name, key, d and schema.typedrecord(name, d))
+                            for name, key, d in recs ])
+    assert chunks == [
+        [ ("facility", fkey, records[1]["obj"]) ],
+        [ ("facility", fkey, None), ("investigation", ikey, records[4]["obj"]) ],
+    ]
+
+def test_typedrecord(schema):
+    """Convert string values according to the attribute types.
+    """
+    d = {
+        "name": "e201215.nxs",
+        "fileSize": "368369",
+        "datafileCreateTime": "2008-06-18T07:31:11+00:00",
+        "dataset": "Dataset_name-e201215",
+        "parameters": [ {"numericValue": 5.0, "type": "ParameterType_a"} ],
+    }
+    assert schema.typedrecord("datafile", d) == {
+        "name": "e201215.nxs",
+        "fileSize": 368369,
+        "datafileCreateTime": "2008-06-18T07:31:11+00:00",
+        "dataset": "Dataset_name-e201215",
+        "parameters": [ {"numericValue": "5.0", "type": "ParameterType_a"} ],
+    }
+    d = {"name": "raw", "enforced": "true", "applicableToDatafile": "false"}
+    td = schema.typedrecord("parameterType", d)
+    assert td["enforced"] is True
+    assert td["applicableToDatafile"] is False
+    with pytest.raises(ValueError):
+        schema.typedrecord("datafile", {"name": "a", "invalid": "b"})
+    with pytest.raises(ValueError):
+        schema.typedrecord("datafile", {"dataset": {"name": "ds1"}})
@@ -0,0 +1,79 @@
+"""Test comparing the content of two data files.
+
+These tests do not need an ICAT server.
+"""
+
+import os.path
+import pytest
+from icat.dumpfile import open_dumpfile
+from icat.dumpfile_jsonl import _loads, _dumps
+from icat.dumpdiff import diffdumps
+from conftest import gettestdata
+
+backends = {
+    'JSONL': "icatdump-4.10.jsonl",
+}
+try:
+    import icat.dumpfile_xml
+    backends['XML'] = "icatdump-4.10.xml"
+except ImportError:
+    pass
+try:
+    import icat.dumpfile_yaml
+    backends['YAML'] = "icatdump-4.10.yaml"
+except ImportError:
+    pass
+
+
+def getkeys(fmt, fname):
+    """Read the entity type names and keys from a data file."""
+    with open_dumpfile(None, gettestdata(fname), fmt, 'r') as dumpfile:
+        return sorted((name, key) for n, name, key, d in dumpfile.getrecords())
+
+
+@pytest.mark.parametrize("fmt", sorted(backends.keys()))
+@pytest.mark.parametrize("buffersize", [10000, 20])
+def test_diff_same(fmt, buffersize):
+    """Comparing a data file with itself yields no differences.
+    """
+    fname = gettestdata(backends[fmt])
+    with open_dumpfile(None, fname, fmt, 'r') as dump1, \
+         open_dumpfile(None, fname, fmt, 'r') as dump2:
+        assert list(diffdumps(dump1, dump2, buffersize)) == []
+
+@pytest.mark.parametrize("fmt", sorted(backends.keys()))
+def test_records_keys(fmt):
+    """All backends read the same objects from the reference files.
+    """
+    assert getkeys(fmt, backends[fmt]) == getkeys('JSONL', backends['JSONL'])
+
+@pytest.mark.parametrize("buffersize", [10000, 20])
+def test_diff_modified(tmpdirsec, buffersize):
+    """Compare the reference data file with a modified copy.
+    """
+    fname = gettestdata("icatdump-4.10.jsonl")
+    modname = os.path.join(tmpdirsec, "icatdump-modified.jsonl")
+    with open(fname, "rb") as infile, open(modname, "wb") as outfile:
+        for line in infile:
+            rec = _loads(line)
+            if rec.get('key') == "User_name-db=2Fjdoe":
+                rec['obj']['email'] = "john.doe@example.org"
+                rec['obj']['orcidId'] = "0000-0002-3265"
+            elif rec.get('key') == "User_name-db=2Fahau":
+                continue
+            elif rec.get('key') == "User_name-db=2Fnbour":
+                outfile.write(_dumps(rec) + b"\n")
+                rec['key'] = "User_name-db=2Fnew"
+                rec['obj']['name'] = "db/new"
+            outfile.write(_dumps(rec) + b"\n")
+    with open_dumpfile(None, fname, 'JSONL', 'r') as dump1, \
+         open_dumpfile(None, modname, 'JSONL', 'r') as dump2:
+        diffs = list(diffdumps(dump1, dump2, buffersize))
+    assert diffs == [
+        ('removed', "user", "User_name-db=2Fahau", []),
+        ('changed', "user", "User_name-db=2Fjdoe", [
+            ('email', "jdoe@example.org", "john.doe@example.org"),
+            ('orcidId', None, "0000-0002-3265"),
+        ]),
+        ('added', "user", "User_name-db=2Fnew", []),
+    ]
@@ -0,0 +1,88 @@
+"""Test reading and writing compressed data files.
+
+These tests do not need an ICAT server.
+"""
+
+import os.path
+import shutil
+import pytest
+import icat.dumpfile
+from icat.dumpfile import open_compressed
+from icat.dumpfile_jsonl import JSONLDumpFileReader
+from conftest import gettestdata, DummyClient
+
+
+compressions = [
+    ("gzip", ".gz"),
+    ("bzip2", ".bz2"),
+    pytest.param("xz", ".xz", marks=pytest.mark.skipif(
+        icat.dumpfile.lzma is None, reason="lzma not available")),
+    pytest.param("zstd", ".zst", marks=pytest.mark.skipif(
+        icat.dumpfile.zstandard is None, reason="zstandard not available")),
+]
+
+def refdata():
+    with open(gettestdata("icatdump-4.10.jsonl"), "rb") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("threads", [None, 4])
+@pytest.mark.parametrize(("compression", "ext"), compressions)
+def test_compress_binary(tmpdirsec, compression, ext, threads,
+                         monkeypatch):
+    """Write and read back a compressed file in binary mode.
+    """
+    # Use a small block size to get several blocks in threaded mode.
+    monkeypatch.setattr(icat.dumpfile._BlockCompressor, "blocksize", 8192)
+    data = refdata()
+    fname = os.path.join(tmpdirsec, "data-%s-%s%s"
+                         % (compression, threads, ext))
+    with open_compressed(fname, "wb", threads=threads) as f:
+        for i in range(0, len(data), 1000):
+            f.write(data[i:i+1000])
+    with open(fname, "rb") as f:
+        assert f.read(len(data)) != data
+    assert icat.dumpfile._getcompression(fname, "rb") == compression
+    with open_compressed(fname, "rb") as f:
+        assert f.read() == data
+
+@pytest.mark.parametrize("threads", [None, 4])
+@pytest.mark.parametrize(("compression", "ext"), compressions)
+def test_compress_text(tmpdirsec, compression, ext, threads):
+    """Write and read back a compressed file in text mode.
+    """
+    text = refdata().decode("utf-8")
+    fname = os.path.join(tmpdirsec, "text-%s-%s%s"
+                         % (compression, threads, ext))
+    with open_compressed(fname, "wt", threads=threads) as f:
+        f.write(text)
+    with open_compressed(fname, "rt") as f:
+        assert f.read() == text
+
+def test_compress_detect(tmpdirsec):
+    """The compression is detected from the content when reading, even
+    if the file name has no or a different extension.
+    """
+    data = refdata()
+    gzname = os.path.join(tmpdirsec, "detect.jsonl.gz")
+    with open_compressed(gzname, "wb") as f:
+        f.write(data)
+    fname = os.path.join(tmpdirsec, "detect.jsonl")
+    shutil.copy(gzname, fname)
+    with open_compressed(fname, "rb") as f:
+        assert f.read() == data
+    with open_compressed(gettestdata("icatdump-4.10.jsonl"), "rb") as f:
+        assert f.read() == data
+
+def test_compress_reader(tmpdirsec):
+    """Read a compressed data file with a dump file reader.
+    """
+    fname = os.path.join(tmpdirsec, "icatdump.jsonl.bz2")
+    with open_compressed(fname, "wb", threads=2) as f:
+        f.write(refdata())
+    with JSONLDumpFileReader(DummyClient(), gettestdata("icatdump-4.10.jsonl")) \
+         as reader:
+        refchunks = [ reader.detachdata(data) for data in reader.getdata() ]
+    with JSONLDumpFileReader(DummyClient(), fname) as reader:
+        chunks = [ reader.detachdata(data) for data in reader.getdata() ]
+    assert chunks == refchunks
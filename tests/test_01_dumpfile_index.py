@@ -0,0 +1,169 @@
+"""Test the chunk index of data files.
+
+These tests do not need an ICAT server.  They write the content of
+the reference dump files along with a chunk index and read selected
+chunks back, using the index or not.
+"""
+
+import copy
+import io
+import os.path
+import pytest
+from lxml import etree
+import icat.dumpfile
+from icat.dumpfile_jsonl import (_loads,
+                                 JSONLDumpFileReader, JSONLDumpFileWriter)
+from icat.dumpfile_xml import XMLDumpFileReader, XMLDumpFileWriter
+from icat.dumpfile_yaml import YAMLDumpFileReader, YAMLDumpFileWriter
+from conftest import gettestdata, DummyClient, DummyObj, DictWriterMixin
+
+
+class JSONLDictWriter(DictWriterMixin, JSONLDumpFileWriter):
+    pass
+
+class YAMLDictWriter(DictWriterMixin, YAMLDumpFileWriter):
+    pass
+
+class XMLElemWriter(XMLDumpFileWriter):
+    def _entity2elem(self, obj, tag, keyindex):
+        return copy.deepcopy(obj.d)
+
+
+def jsonlchunks():
+    chunks = []
+    with open(gettestdata("icatdump-4.10.jsonl"), "rb") as f:
+        for line in f:
+            rec = _loads(line)
+            if 'chunk' in rec:
+                chunks.append([])
+            elif 'head' not in rec:
+                obj = DummyObj(rec['type'], d=rec['obj'])
+                chunks[-1].append((rec['key'], obj))
+    return chunks
+
+def xmlchunks():
+    chunks = []
+    parser = etree.XMLParser(remove_blank_text=True)
+    root = etree.parse(gettestdata("icatdump-4.10.xml"), parser).getroot()
+    for data in root.iter("data"):
+        chunk = []
+        for elem in data:
+            key = elem.attrib.pop('id')
+            chunk.append((key, DummyObj(elem.tag, d=elem)))
+        chunks.append(chunk)
+    return chunks
+
+backends = {
+    'JSONL': ("jsonl", jsonlchunks, JSONLDumpFileReader, JSONLDictWriter),
+    'XML': ("xml", xmlchunks, XMLDumpFileReader, XMLElemWriter),
+    'YAML': ("yaml", jsonlchunks, YAMLDumpFileReader, YAMLDictWriter),
+}
+
+def normalize(backend, data):
+    """Convert a data chunk to something that can be compared."""
+    if backend == 'XML':
+        return [ etree.tostring(e, with_tail=False) for e in data ]
+    else:
+        return data
+
+def countobjs(backend, data):
+    """Count the objects in a data chunk."""
+    if backend == 'YAML':
+        return sum(len(objs) for objs in data.values())
+    else:
+        return len(data)
+
+def readchunks(backend, fname, chunks=None):
+    reader_cls = backends[backend][2]
+    with reader_cls(DummyClient(), fname) as reader:
+        reader.chunks = chunks
+        return [ (n, normalize(backend, reader.detachdata(data)))
+                 for n, data in reader._enumdata() ]
+
+@pytest.fixture(scope="module", params=sorted(backends.keys()))
+def indexeddump(request, tmpdirsec):
+    backend = request.param
+    ext, getchunks, reader_cls, writer_cls = backends[backend]
+    fname = os.path.join(tmpdirsec, "icatdump.%s" % ext)
+    with writer_cls(DummyClient(), fname) as writer:
+        writer.setindex()
+        for chunk in getchunks():
+            writer.startdata()
+            for key, obj in chunk:
+                writer.writeobj(key, obj, None)
+    return backend, fname
+
+
+def test_index_content(indexeddump):
+    """The index records the number of objects in each chunk.
+    """
+    backend, fname = indexeddump
+    reader_cls = backends[backend][2]
+    with reader_cls(DummyClient(), fname) as reader:
+        index = reader.getindex()
+    chunks = readchunks(backend, fname)
+    assert index is not None
+    assert len(index) == len(chunks)
+    assert ([ c['count'] for c in index ] ==
+            [ countobjs(backend, d) for n, d in chunks ])
+
+def test_index_read_range(indexeddump):
+    """Read a range of chunks using the index.
+    """
+    backend, fname = indexeddump
+    chunks = readchunks(backend, fname)
+    assert len(chunks) > 4
+    selected = readchunks(backend, fname, chunks=range(2, 4))
+    assert selected == chunks[2:4]
+    selected = readchunks(backend, fname, chunks=range(3, 1000))
+    assert selected == chunks[3:]
+
+def test_index_stale(indexeddump, tmpdirsec):
+    """An index that does not match the data file is ignored.
+    """
+    backend, fname = indexeddump
+    chunks = readchunks(backend, fname)
+    stalename = os.path.join(tmpdirsec, "stale-" + os.path.basename(fname))
+    with open(fname, "rb") as f:
+        content = f.read()
+    with open(stalename, "wb") as f:
+        f.write(content + b"\n")
+    with open(fname + ".idx", "rb") as fi:
+        with open(stalename + ".idx", "wb") as fo:
+            fo.write(fi.read())
+    reader_cls = backends[backend][2]
+    with reader_cls(DummyClient(), stalename) as reader:
+        assert reader.getindex() is None
+    assert readchunks(backend, stalename, chunks=[1]) == chunks[1:2]
+
+def test_index_checksum(indexeddump, tmpdirsec):
+    """A corrupted chunk is detected by the checksum.
+    """
+    backend, fname = indexeddump
+    reader_cls = backends[backend][2]
+    with reader_cls(DummyClient(), fname) as reader:
+        c = reader.getindex()[1]
+    badname = os.path.join(tmpdirsec, "bad-" + os.path.basename(fname))
+    with open(fname, "rb") as f:
+        content = bytearray(f.read())
+    pos = c['offset'] + c['length'] // 2
+    content[pos] = ord(b"X") if content[pos] != ord(b"X") else ord(b"Y")
+    with open(badname, "wb") as f:
+        f.write(content)
+    with open(fname + ".idx", "rb") as fi:
+        with open(badname + ".idx", "wb") as fo:
+            fo.write(fi.read())
+    assert len(readchunks(backend, badname, chunks=[0])) == 1
+    with pytest.raises(RuntimeError):
+        readchunks(backend, badname, chunks=[1])
+
+def test_index_unsupported(tmpdirsec):
+    """The index requires an uncompressed data file opened by name.
+    """
+    writer = JSONLDictWriter(DummyClient(), io.BytesIO())
+    with pytest.raises(ValueError):
+        writer.setindex()
+    fname = os.path.join(tmpdirsec, "icatdump.jsonl.gz")
+    with JSONLDictWriter(DummyClient(), fname) as writer:
+        with pytest.raises(ValueError):
+            writer.setindex()
@@ -0,0 +1,62 @@
+"""Test the JSON Lines dump file backend.
+
+These tests do not need an ICAT server.  They check the structure of
+the data file and that the output does not depend on the JSON codec
+being used.
+"""
+
+from collections import OrderedDict
+import io
+import json
+import pytest
+import yaml
+import icat.dumpfile_jsonl
+from icat.dumpfile_jsonl import JSONLDumpFileReader
+from conftest import gettestdata, DummyClient
+
+
+def test_jsonl_read():
+    """Read the reference dump file and compare with the YAML version.
+    """
+    with open(gettestdata("icatdump-4.10.yaml"), "rt") as f:
+        refchunks = list(yaml.safe_load_all(f))
+    with open(gettestdata("icatdump-4.10.jsonl"), "rb") as f:
+        reader = JSONLDumpFileReader(DummyClient(), f)
+        chunks = []
+        for data in reader.getdata():
+            objs = {}
+            for rec in reader.detachdata(data):
+                objs.setdefault(rec['type'], {})[rec['key']] = rec['obj']
+            chunks.append(objs)
+    assert chunks == refchunks
+
+def test_jsonl_skip():
+    """Chunks that are not or only partially read are skipped.
+    """
+    with open(gettestdata("icatdump-4.10.jsonl"), "rb") as f:
+        reader = JSONLDumpFileReader(DummyClient(), f)
+        count = []
+        for data in reader.getdata():
+            if len(count) % 2:
+                count.append(None)
+            else:
+                count.append(len(reader.detachdata(data)))
+                for rec in data:
+                    assert False, "chunk should be exhausted"
+    assert count == [ 149, None, 5, None, 10, None ]
+
+def test_jsonl_codec():
+    """The fallback to the json module yields the same output as orjson.
+    """
+    if icat.dumpfile_jsonl.orjson is None:
+        pytest.skip("orjson not available")
+    with open(gettestdata("icatdump-4.10.jsonl"), "rb") as f:
+        for line in f:
+            rec = json.loads(line.decode('utf-8'),
+                             object_pairs_hook=OrderedDict)
+            s = json.dumps(rec, ensure_ascii=False, separators=(',', ':'))
+            assert s.encode('utf-8') + b"\n" == line
+            assert icat.dumpfile_jsonl._dumps(rec) + b"\n" == line
+    rec = OrderedDict([("name", u"Rudolph Beck-D\u00fclmen \u2028\x1f\x7f/")])
+    s = json.dumps(rec, ensure_ascii=False, separators=(',', ':'))
+    assert icat.dumpfile_jsonl._dumps(rec) == s.encode('utf-8')
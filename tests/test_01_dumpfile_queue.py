@@ -0,0 +1,103 @@
+"""Test passing data chunks through the in-memory queue backend.
+
+These tests do not need an ICAT server.  They pass the content of
+the JSON Lines reference dump file from a writer in a separate thread
+to a reader.
+"""
+
+import threading
+import Queue
+import pytest
+from icat.dumpfile_jsonl import _loads
+from icat.dumpfile_queue import (QueueDumpFileReader, QueueDumpFileWriter,
+                                 put_error)
+from conftest import gettestdata, DummyClient, DummyObj, DictWriterMixin
+
+
+class DictWriter(DictWriterMixin, QueueDumpFileWriter):
+    pass
+
+
+def refchunks():
+    """Read the chunks from the JSON Lines reference dump file."""
+    chunks = []
+    with open(gettestdata("icatdump-4.10.jsonl"), "rb") as f:
+        for line in f:
+            rec = _loads(line)
+            if 'chunk' in rec:
+                chunks.append([])
+            elif 'head' not in rec:
+                chunks[-1].append(rec)
+    return chunks
+
+def write(chunkqueue, chunks, fail=False):
+    with DictWriter(DummyClient(), chunkqueue) as writer:
+        for chunk in chunks:
+            writer.startdata()
+            for rec in chunk:
+                obj = DummyObj(rec['type'], d=rec['obj'])
+                writer.writeobj(rec['key'], obj, None)
+        if fail:
+            raise RuntimeError("search failed")
+
+
+def test_queue_chunks():
+    """All chunks are passed through a queue of limited size.
+    """
+    ref = refchunks()
+    chunkqueue = Queue.Queue(maxsize=2)
+    thread = threading.Thread(target=write, args=(chunkqueue, ref))
+    thread.daemon = True
+    thread.start()
+    with QueueDumpFileReader(DummyClient(), chunkqueue) as reader:
+        chunks = [ reader.detachdata(data) for data in reader.getdata() ]
+    thread.join(10)
+    assert not thread.is_alive()
+    assert chunks == ref
+
+def test_queue_writer_error():
+    """A failure in the writer is raised in the reader.
+
+    The chunk being written when the writer fails is discarded.
+    """
+    ref = refchunks()[:2]
+    chunkqueue = Queue.Queue()
+    def run():
+        try:
+            write(chunkqueue, ref, fail=True)
+        except RuntimeError:
+            pass
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    with QueueDumpFileReader(DummyClient(), chunkqueue) as reader:
+        data = reader.getdata()
+        assert len(next(data)) > 0
+        with pytest.raises(RuntimeError):
+            next(data)
+    thread.join(10)
+    assert not thread.is_alive()
+
+def test_queue_writer_head_error():
+    """A failure while writing the head is raised in the reader.
+    """
+    class FailingWriter(DictWriter):
+        def head(self):
+            raise RuntimeError("head failed")
+    chunkqueue = Queue.Queue()
+    with pytest.raises(RuntimeError):
+        with FailingWriter(DummyClient(), chunkqueue):
+            pass
+    with QueueDumpFileReader(DummyClient(), chunkqueue) as reader:
+        with pytest.raises(RuntimeError):
+            next(reader.getdata())
+
+def test_queue_put_error():
+    """An error put into the queue from outside the writer is raised
+    in the reader.
+    """
+    chunkqueue = Queue.Queue()
+    put_error(chunkqueue, RuntimeError("setup failed"))
+    with QueueDumpFileReader(DummyClient(), chunkqueue) as reader:
+        with pytest.raises(RuntimeError):
+            next(reader.getdata())
@@ -0,0 +1,37 @@
+"""Test sorting the objects in DumpFileWriter.writeobjs().
+
+These tests do not need an ICAT server.
+"""
+
+import pytest
+from icat.dumpfile import _sortobjs
+from conftest import DummyObj
+
+def names(objs):
+    return [ o.name for o in objs ]
+
+
+@pytest.mark.parametrize("presorted", [False, True])
+def test_sort_sorted(presorted):
+    """Objects already sorted are passed on unchanged.
+    """
+    objs = [ DummyObj("dummy", name=n) for n in ["a", "b", "b", "c"] ]
+    assert list(_sortobjs(None, objs, 100, presorted=presorted)) == objs
+
+def test_sort_misordered():
+    """Objects supposed to be presorted are passed on as they arrive.
+    If they turn out not to be in order, the remaining objects are
+    sorted.
+    """
+    order = ["A", "b", "B", "c", "a"]
+    seen = []
+    def objs():
+        for n in order:
+            seen.append(n)
+            yield DummyObj("dummy", name=n)
+    result = []
+    for o in _sortobjs(None, objs(), 100, presorted=True):
+        if len(result) < 2:
+            assert len(seen) == len(result) + 1
+        result.append(o.name)
+    assert result == ["A", "b", "B", "a", "c"]
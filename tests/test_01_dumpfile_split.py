@@ -0,0 +1,122 @@
+"""Test splitting large data chunks in DumpFileWriter.writedata().
+
+These tests do not need an ICAT server.  They write a small tree of
+stand in objects having many-to-one relations and check the chunks
+and the references in the data file.
+"""
+
+import io
+import pytest
+from icat.dumpfile_jsonl import JSONLDumpFileReader, JSONLDumpFileWriter
+from icat.dumpfile_yaml import YAMLDumpFileReader, YAMLDumpFileWriter
+from conftest import DummyClient, DummyObj
+
+
+class ChildObj(DummyObj):
+    """Stand in for an entity object having a parent relation."""
+    InstRel = frozenset(['parent'])
+    parent = None
+
+class GenericObj(ChildObj):
+    """Stand in for an entity object not having a uniqueness constraint."""
+    Constraint = ('id',)
+    def __init__(self, instancetype, **kwargs):
+        super(GenericObj, self).__init__(instancetype, **kwargs)
+        self.id = self.name
+
+def _entity2dict(obj):
+    d = {'name': obj.name}
+    if obj.parent is not None:
+        d['parent'] = obj.parent.getUniqueKey()
+    return d
+
+class JSONLDictWriter(JSONLDumpFileWriter):
+    def _entity2dict(self, obj, keyindex):
+        return _entity2dict(obj)
+
+class YAMLDictWriter(YAMLDumpFileWriter):
+    def _entity2dict(self, obj, keyindex):
+        return _entity2dict(obj)
+
+def records(backend, data):
+    """Return (type, key) tuples in a chunk."""
+    if backend == 'JSONL':
+        return [ (rec['type'], rec['key']) for rec in data ]
+    else:
+        return [ (name, key) for name in data for key in sorted(data[name]) ]
+
+backends = {
+    'JSONL': (io.BytesIO, JSONLDumpFileReader, JSONLDictWriter),
+    'YAML': (io.StringIO, YAMLDumpFileReader, YAMLDictWriter),
+}
+
+def writeread(backend, objs, chunklimit):
+    fileclass, reader_cls, writer_cls = backends[backend]
+    f = fileclass()
+    writer = writer_cls(DummyClient(), f)
+    writer.writedata(objs, chunklimit=chunklimit)
+    writer.finalize()
+    f.seek(0)
+    reader = reader_cls(DummyClient(), f)
+    chunks = []
+    for data in reader.getdata():
+        data = reader.detachdata(data)
+        chunks.append((reader._hasrefs(data), records(backend, data)))
+    return chunks
+
+def objtree(cls=ChildObj):
+    investigation = ChildObj("investigation", name="inv")
+    datasets = [ ChildObj("dataset", name="ds%d" % i, parent=investigation)
+                 for i in range(2) ]
+    datafiles = [ cls("datafile", name="df%d%d" % (i, j), parent=ds)
+                  for i, ds in enumerate(datasets) for j in range(3) ]
+    return [[investigation], datasets, datafiles]
+
+
+@pytest.mark.parametrize("backend", sorted(backends.keys()))
+def test_split_nolimit(backend):
+    """Without a limit, all objects are written in one chunk.
+    """
+    chunks = writeread(backend, objtree(), None)
+    assert len(chunks) == 1
+    assert chunks[0][0] is False
+    assert len(chunks[0][1]) == 9
+
+@pytest.mark.parametrize("backend", sorted(backends.keys()))
+def test_split_chunks(backend):
+    """Large chunks are split, the following chunks start with
+    references to the objects from the previous ones.
+    """
+    chunks = writeread(backend, objtree(), 4)
+    assert [ r for r, c in chunks ] == [False, True, True]
+    assert chunks[0][1] == [
+        ("investigation", "Investigation_inv"),
+        ("dataset", "Dataset_ds0"),
+        ("dataset", "Dataset_ds1"),
+        ("datafile", "Datafile_df00"),
+    ]
+    assert chunks[1][1] == [
+        ("datasetRef", "Dataset_ds0"),
+        ("datasetRef", "Dataset_ds1"),
+        ("datafile", "Datafile_df01"),
+        ("datafile", "Datafile_df02"),
+        ("datafile", "Datafile_df10"),
+        ("datafile", "Datafile_df11"),
+    ]
+    assert chunks[2][1] == [
+        ("datasetRef", "Dataset_ds1"),
+        ("datafile", "Datafile_df12"),
+    ]
+
+@pytest.mark.parametrize("backend", sorted(backends.keys()))
+def test_split_generic(backend):
+    """Chunks are not split after objects having a generic key.
+    """
+    chunks = writeread(backend, objtree(cls=GenericObj), 2)
+    assert [ r for r, c in chunks ] == [False, True]
+    assert chunks[1][1][:3] == [
+        ("datasetRef", "Dataset_ds0"),
+        ("investigationRef", "Investigation_inv"),
+        ("dataset", "Dataset_ds1"),
+    ]
+    assert len(chunks[1][1]) == 3 + 6
@@ -0,0 +1,96 @@
+"""Test the SQLite dump file backend.
+
+These tests do not need an ICAT server.  They write the content of
+the JSON Lines reference dump file to a SQLite data file and read it
+back.
+"""
+
+import os.path
+import sqlite3
+import threading
+import pytest
+from icat.dumpfile_jsonl import _loads
+from icat.dumpfile_sqlite import SQLiteDumpFileReader, SQLiteDumpFileWriter
+from conftest import gettestdata, DummyClient, DummyObj, DictWriterMixin
+
+
+class DictWriter(DictWriterMixin, SQLiteDumpFileWriter):
+    commitsize = 7
+
+
+def refchunks():
+    """Read the chunks from the JSON Lines reference dump file."""
+    chunks = []
+    with open(gettestdata("icatdump-4.10.jsonl"), "rb") as f:
+        for line in f:
+            rec = _loads(line)
+            if 'chunk' in rec:
+                chunks.append([])
+            elif 'head' not in rec:
+                chunks[-1].append(rec)
+    return chunks
+
+@pytest.fixture(scope="module")
+def sqlitedump(tmpdirsec):
+    fname = os.path.join(tmpdirsec, "icatdump.sqlite")
+    with DictWriter(DummyClient(), fname) as writer:
+        for chunk in refchunks():
+            writer.startdata()
+            for rec in chunk:
+                obj = DummyObj(rec['type'], d=rec['obj'])
+                writer.writeobj(rec['key'], obj, None)
+    return fname
+
+
+def test_sqlite_read(sqlitedump):
+    """Read all chunks back.
+    """
+    with SQLiteDumpFileReader(DummyClient(), sqlitedump) as reader:
+        assert reader.gethead()['apiversion'] == "4.10"
+        chunks = [ list(reader._chunkrecords(n)) for n in reader.getdata() ]
+    assert chunks == refchunks()
+
+def test_sqlite_random_access(sqlitedump):
+    """Find the chunk of an object and read only that one.
+    """
+    key = ("Investigation_facility-(name-ESNF)_name-12100409=2DST"
+           "_visitId-1=2E1=2DP")
+    ref = refchunks()
+    with SQLiteDumpFileReader(DummyClient(), sqlitedump) as reader:
+        n = reader.findchunk(key)
+        assert n is not None
+        assert key in [ rec['key'] for rec in ref[n] ]
+        assert list(reader._chunkrecords(n)) == ref[n]
+        assert reader.findchunk("Investigation_name-nonexisting") is None
+
+def test_sqlite_parallel(sqlitedump):
+    """Read chunks in several threads at the same time.
+
+    The connections of all threads are closed with the reader.
+    """
+    ref = refchunks()
+    results = {}
+    connections = []
+    with SQLiteDumpFileReader(DummyClient(), sqlitedump) as reader:
+        def read(n):
+            results[n] = list(reader._chunkrecords(n))
+            connections.append(reader._connection())
+        threads = [ threading.Thread(target=read, args=(n,))
+                    for n in reader.getdata() ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    assert [ results[n] for n in sorted(results) ] == ref
+    assert len(connections) == len(ref)
+    for conn in connections:
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1")
+
+def test_sqlite_nofile(tmpdirsec):
+    """Reading a nonexisting file fails rather then creating it.
+    """
+    fname = os.path.join(tmpdirsec, "nonexisting.sqlite")
+    with pytest.raises(IOError):
+        SQLiteDumpFileReader(DummyClient(), fname)
+    assert not os.path.exists(fname)
@@ -0,0 +1,171 @@
+"""Test the YAML dump file backend with and without LibYAML.
+
+These tests do not need an ICAT server.  They check that the LibYAML
+bindings, if available, yield the same results as the pure Python
+implementation and that the chunks are read lazily where possible.
+
+This module may also be called as a script to run a simple benchmark
+comparing both implementations:
+
+    python test_01_dumpfile_yaml.py [scale]
+"""
+
+from __future__ import print_function
+import io
+import sys
+import timeit
+import pytest
+import yaml
+from icat.dumpfile_yaml import (entitytypes,
+                                YAMLDumpFileReader, YAMLDumpFileWriter)
+from conftest import gettestdata, DummyClient, DummyObj, DictWriterMixin
+
+pytestmark = pytest.mark.skipif(not yaml.__with_libyaml__,
+                                reason="LibYAML bindings not available")
+
+refdump = "icatdump-4.10.yaml"
+
+# Strings that the LibYAML emitter would format differently from the
+# pure Python emitter.
+specialstrings = {
+    'a': u" ".join([u"Rudolph Beck-D\u00fclmen"] * 10),
+    'b': u" ".join([u"line\n"] * 40),
+    'c': u" ".join([u"paragraph\u2029separator"] * 10),
+    'd': u"key_" + 121*u"x",
+}
+
+class DictWriter(DictWriterMixin, YAMLDumpFileWriter):
+    pass
+
+
+def restoreorder(data):
+    """Rearrange a chunk to have the entity types in restore order.
+
+    Everything below the entity types is sorted.  This needs dicts
+    that keep the insertion order.
+    """
+    def sortdict(d):
+        if isinstance(d, dict):
+            return { k:sortdict(d[k]) for k in sorted(d.keys()) }
+        elif isinstance(d, list):
+            return [ sortdict(v) for v in d ]
+        else:
+            return d
+    return { name:sortdict(data[name])
+             for name in sorted(data.keys(), key=entitytypes.index) }
+
+def dumpchunks(chunks, dumper):
+    """Dump the chunks the same way as YAMLDumpFileWriter does."""
+    f = io.StringIO()
+    for data in chunks:
+        yaml.dump(restoreorder(data), f, Dumper=dumper, sort_keys=False,
+                  default_flow_style=False, explicit_start=True)
+    return f.getvalue()
+
+def writechunks(chunks, order=entitytypes.index, head=False):
+    """Dump the chunks using YAMLDumpFileWriter.
+
+    Write the entity types in the order of the function order,
+    default is the order of restoring them.  Write the header only
+    if head is set.
+    """
+    f = io.StringIO()
+    writer = DictWriter(DummyClient(), f)
+    if head:
+        writer.head()
+    for data in chunks:
+        writer.startdata()
+        for name in sorted(data.keys(), key=order):
+            for key in sorted(data[name].keys()):
+                writer.writeobj(key, DummyObj(name, d=data[name][key]), None)
+    writer.finalize()
+    return f.getvalue()
+
+def loadchunks(fname, loader):
+    with open(fname, "rt") as f:
+        return list(yaml.load_all(f, Loader=loader))
+
+
+def test_yaml_read():
+    """YAMLDumpFileReader yields the same chunks as the pure Python loader.
+    """
+    fname = gettestdata(refdump)
+    with open(fname, "rt") as f:
+        reader = YAMLDumpFileReader(DummyClient(), f)
+        chunks = [ reader.detachdata(data) for data in reader.getdata() ]
+    assert chunks == loadchunks(fname, yaml.SafeLoader)
+
+def test_yaml_read_lazy():
+    """Chunks are parsed lazily if the header declares them to be in
+    restore order.
+    """
+    refchunks = loadchunks(gettestdata(refdump), yaml.SafeLoader)
+    for head in (True, False):
+        f = io.StringIO(writechunks(refchunks, head=head))
+        reader = YAMLDumpFileReader(DummyClient(), f)
+        lazychunks = []
+        for data in reader.getdata():
+            lazychunks.append(not isinstance(data, dict))
+            assert reader.detachdata(data) == refchunks[len(lazychunks) - 1]
+        assert lazychunks == [head] * len(refchunks)
+
+def test_yaml_write_order():
+    """The writer refuses entity types out of restore order in a
+    chunk, so that all chunks may be parsed lazily.
+    """
+    refchunks = loadchunks(gettestdata(refdump), yaml.SafeLoader)
+    ordered = [ sorted(data.keys()) ==
+                sorted(data.keys(), key=entitytypes.index)
+                for data in refchunks ]
+    assert not all(ordered)
+    with pytest.raises(ValueError):
+        writechunks(refchunks, order=None, head=True)
+
+def test_yaml_write():
+    """YAMLDumpFileWriter yields the same text as the pure Python emitter.
+    """
+    chunks = loadchunks(gettestdata(refdump), yaml.SafeLoader)
+    assert writechunks(chunks) == dumpchunks(chunks, yaml.Dumper)
+
+def test_yaml_write_special():
+    """Same as test_yaml_write(), but with strings that need escaping.
+    """
+    chunks = loadchunks(gettestdata(refdump), yaml.SafeLoader)
+    for data in chunks:
+        for objs in data.values():
+            for key in objs:
+                objs[key]['description'] = specialstrings['a']
+    assert dumpchunks(chunks, yaml.CSafeDumper) != \
+        dumpchunks(chunks, yaml.Dumper)
+    assert writechunks(chunks) == dumpchunks(chunks, yaml.Dumper)
+    chunks = [ {'user': { k:{'name':s}, s:{'name':k} }}
+               for k, s in specialstrings.items() ]
+    assert writechunks(chunks) == dumpchunks(chunks, yaml.Dumper)
+
+
+def benchmark(scale):
+    """Compare the speed of LibYAML and the pure Python implementation.
+
+    Use the chunks from the reference dump file, repeated scale times.
+    """
+    fname = gettestdata(refdump)
+    with open(fname, "rt") as f:
+        text = f.read() * scale
+    chunks = list(yaml.load_all(text, Loader=yaml.SafeLoader))
+    print("%d chunks, %d bytes" % (len(chunks), len(text)))
+    def load(loader):
+        return lambda: list(yaml.load_all(text, Loader=loader))
+    tests = [
+        ("load", "Python", load(yaml.SafeLoader)),
+        ("load", "LibYAML", load(yaml.CSafeLoader)),
+        ("dump", "Python", lambda: dumpchunks(chunks, yaml.SafeDumper)),
+        ("dump", "LibYAML", lambda: dumpchunks(chunks, yaml.CSafeDumper)),
+        ("dump", "writer", lambda: writechunks(chunks)),
+    ]
+    for op, impl, func in tests:
+        t = min(timeit.repeat(func, number=1, repeat=3))
+        print("%s %-8s %8.3f s" % (op, impl, t))
+
+if __name__ == "__main__":
+    scale = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    benchmark(scale)
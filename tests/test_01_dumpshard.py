@@ -0,0 +1,140 @@
+"""Test writing and reading a directory of shards.
+
+These tests do not need an ICAT server.  They write stand in objects
+using the JSONL backend and read the plain records back.
+"""
+
+import json
+import os.path
+import threading
+import pytest
+import icat.dumpfile
+from icat.dumpfile_jsonl import JSONLDumpFileReader, JSONLDumpFileWriter
+from icat.dumpshard import ShardedDumpWriter, ShardedDumpReader
+from icat.exception import ShardError
+from conftest import DummyClient, DummyObj
+
+
+class DummyWriter(JSONLDumpFileWriter):
+    def _entity2dict(self, obj, keyindex):
+        return {'name': obj.name}
+
+class DummyReader(JSONLDumpFileReader):
+    def getobjs_from_data(self, data, objindex):
+        for rec in data:
+            yield rec['key'], DummyObj(rec['type'], name=rec['obj']['name'],
+                                       client=self.client)
+
+@pytest.fixture(autouse=True)
+def dummybackend(monkeypatch):
+    monkeypatch.setitem(icat.dumpfile.Backends, 'DUMMY',
+                        (DummyReader, DummyWriter))
+
+def invchunks(sizes):
+    """Investigation chunks having the given number of datasets."""
+    for i, n in enumerate(sizes):
+        inv = DummyObj("investigation", name="inv%d" % i)
+        datasets = [ DummyObj("dataset", name="ds%d_%d" % (i, j))
+                     for j in range(n) ]
+        yield [[inv], datasets]
+
+def writeshards(dirname, sizes, shards, assign="roundrobin"):
+    with ShardedDumpWriter(DummyClient(), dirname, 'DUMMY', shards,
+                           assign=assign) as writer:
+        writer.writedata([[DummyObj("facility", name="fac")]])
+        writer.writechunks(invchunks(sizes))
+        writer.writedata([[DummyObj("study", name="study")]])
+    with open(os.path.join(dirname, "manifest.json"), "rt") as f:
+        return json.load(f)
+
+def shardinvs(dirname, shard):
+    """Return the names of the investigations in a shard."""
+    fname = os.path.join(dirname, shard['file'])
+    with DummyReader(None, fname) as reader:
+        return [ d['name'] for n, name, key, d in reader.getrecords()
+                 if name == "investigation" ]
+
+
+def test_write_roundrobin(tmpdirsec):
+    """The investigation chunks are assigned to the shards in turn.
+    """
+    dirname = os.path.join(tmpdirsec, "shards-roundrobin")
+    manifest = writeshards(dirname, [1, 1, 1, 1, 1], 2)
+    assert manifest['format'] == 'DUMMY'
+    shards = manifest['shards']
+    assert [ s['name'] for s in shards ] == \
+        ["base", "shard-000", "shard-001", "other"]
+    assert [ s['depends'] for s in shards ] == [
+        [], ["base"], ["base"], ["base", "shard-000", "shard-001"]
+    ]
+    assert [ s['objects'] for s in shards ] == [1, 6, 4, 1]
+    assert shardinvs(dirname, shards[1]) == ["inv0", "inv2", "inv4"]
+    assert shardinvs(dirname, shards[2]) == ["inv1", "inv3"]
+
+def test_write_size(tmpdirsec):
+    """Each investigation chunk goes to the shard having the fewest
+    objects so far.
+    """
+    dirname = os.path.join(tmpdirsec, "shards-size")
+    manifest = writeshards(dirname, [5, 1, 1, 2], 2, assign="size")
+    shards = manifest['shards']
+    assert [ s['objects'] for s in shards ] == [1, 6, 7, 1]
+    assert shardinvs(dirname, shards[1]) == ["inv0"]
+    assert shardinvs(dirname, shards[2]) == ["inv1", "inv2", "inv3"]
+
+def test_write_fail(tmpdirsec):
+    """No manifest is written if writing fails.
+    """
+    dirname = os.path.join(tmpdirsec, "shards-fail")
+    with pytest.raises(RuntimeError):
+        with ShardedDumpWriter(DummyClient(), dirname, 'DUMMY', 2) as writer:
+            writer.writedata([[DummyObj("facility", name="fac")]])
+            raise RuntimeError("failed")
+    assert not os.path.exists(os.path.join(dirname, "manifest.json"))
+
+@pytest.mark.parametrize("workers", [0, 3])
+def test_process(tmpdirsec, workers):
+    """Process all objects, respecting the dependencies of the shards.
+    """
+    dirname = os.path.join(tmpdirsec, "shards-process-%d" % workers)
+    writeshards(dirname, [2, 1, 3, 1, 1, 2], 3)
+    client = DummyClient()
+    clients = [ DummyClient() for i in range(workers) ]
+    lock = threading.Lock()
+    processed = []
+    def func(obj):
+        with lock:
+            processed.append((obj.BeanName, obj.name, obj.client))
+    with ShardedDumpReader(client, dirname) as reader:
+        assert [ [ s['name'] for s in stage ] for stage in reader.stages ] \
+            == [["base"], ["shard-000", "shard-001", "shard-002"], ["other"]]
+        reader.processobjs(func, clients=clients)
+    assert len(processed) == 18
+    assert processed[0] == ("Facility", "fac", client)
+    assert processed[-1] == ("Study", "study", client)
+    invclients = set([ c for t, n, c in processed[1:-1] ])
+    if workers:
+        assert invclients <= set(clients)
+    else:
+        assert invclients == set([client])
+
+def test_process_error(tmpdirsec):
+    """Errors in the worker threads are collected per shard.  The
+    other shards of the same stage are still processed, the following
+    stages are not.
+    """
+    dirname = os.path.join(tmpdirsec, "shards-error")
+    writeshards(dirname, [1, 1, 1, 1], 2)
+    processed = []
+    def func(obj):
+        if obj.name == "inv1":
+            raise ValueError("invalid investigation")
+        processed.append(obj.name)
+    clients = [ DummyClient() for i in range(2) ]
+    with ShardedDumpReader(DummyClient(), dirname) as reader:
+        with pytest.raises(ShardError) as err:
+            reader.processobjs(func, clients=clients)
+    assert [ n for n, e in err.value.errors ] == ["shard-001"]
+    assert "inv2" in processed
+    assert "inv3" not in processed
+    assert "study" not in processed
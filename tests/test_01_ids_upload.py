@@ -0,0 +1,63 @@
+"""Test reading the data to upload to IDS in icat.ids.ChunkedFileReader.
+
+These tests do not need an IDS server.
+"""
+
+import io
+import os.path
+import zlib
+import pytest
+from icat.ids import ChunkedFileReader
+
+
+content = bytes(bytearray(range(256))) * 4099
+offset = 1000
+
+modes = [
+    dict(),
+    dict(readahead=3),
+    dict(usemmap=True),
+]
+
+@pytest.fixture(scope="module")
+def testfile(tmpdirsec):
+    fname = os.path.join(tmpdirsec, "upload.dat")
+    with open(fname, "wb") as f:
+        f.write(content)
+    return fname
+
+@pytest.mark.parametrize("kwargs", modes)
+def test_read_file(testfile, kwargs):
+    """Read a regular file, starting at some offset.
+    """
+    with open(testfile, "rb") as f:
+        f.seek(offset)
+        reader = ChunkedFileReader(f, 65536, **kwargs)
+        data = b"".join(bytes(chunk) for chunk in reader)
+        reader.close()
+        assert data == content[offset:]
+        assert reader.crc32 == zlib.crc32(content[offset:])
+        assert f.tell() == len(content)
+
+@pytest.mark.parametrize("kwargs", modes)
+def test_read_bytesio(kwargs):
+    """Read from a file object that can not be memory mapped.
+    """
+    f = io.BytesIO(content)
+    reader = ChunkedFileReader(f, 65536, **kwargs)
+    sizes = [ len(chunk) for chunk in reader ]
+    reader.close()
+    assert sum(sizes) == len(content)
+    assert max(sizes) == 65536
+    assert reader.crc32 == zlib.crc32(content)
+
+@pytest.mark.parametrize("kwargs", modes)
+def test_close_early(testfile, kwargs):
+    """Abandon the iteration, the input may be read again afterwards.
+    """
+    with open(testfile, "rb") as f:
+        reader = ChunkedFileReader(f, 4096, **kwargs)
+        assert bytes(next(reader)) == content[:4096]
+        reader.close()
+        f.seek(0)
+        assert f.read() == content
@@ -0,0 +1,126 @@
+"""Test the key and object indexes having bounded memory consumption.
+
+These tests do not need an ICAT server.
+"""
+
+import pytest
+from icat.keyindex import KeyIndex, ObjIndex, ChainIndex
+from conftest import DummyClient, DummyObj
+
+def datafilekeys():
+    """Generate keys as they would be used in a key index."""
+    keys = {}
+    for i in range(3):
+        for j in range(4):
+            for k in range(10):
+                key = ("Datafile_dataset-(investigation-(facility-"
+                       "(name-ESNF)_name-inv%d_visitId-1)_name-ds%d)"
+                       "_name-df%d" % (i, j, k))
+                keys[("Datafile", 100*i + 10*j + k)] = key
+    return keys
+
+
+def test_keyindex_spill():
+    """Add more keys than fit into the cache and read them back.
+    """
+    keys = datafilekeys()
+    index = KeyIndex(cachesize=20)
+    for kid in sorted(keys):
+        assert kid not in index
+        index[kid] = keys[kid]
+    assert len(index._hot) <= 20
+    assert len(index) == len(keys)
+    for kid in sorted(keys, reverse=True):
+        assert index[kid] == keys[kid]
+    assert len(index) == len(keys)
+    assert sorted(index) == sorted(keys)
+    assert dict(index.items()) == keys
+
+def test_keyindex_fragments():
+    """The common parts of the keys are stored only once.
+    """
+    keys = datafilekeys()
+    index = KeyIndex(cachesize=4)
+    index.update(keys)
+    conn = index._conn
+    nfrag = conn.execute("SELECT COUNT(*) FROM fragment").fetchone()[0]
+    # One facility, three investigations, twelve datasets.
+    assert nfrag == 1 + 3 + 12
+    code = conn.execute("SELECT key FROM entry WHERE name = ? AND id = ?",
+                        ("Datafile", 215)).fetchone()[0]
+    assert '(' not in code
+    assert index[("Datafile", 215)] == keys[("Datafile", 215)]
+
+def test_keyindex_modify():
+    """Overwrite and delete entries in memory and on disk.
+    """
+    keys = datafilekeys()
+    index = KeyIndex(cachesize=10)
+    index.update(keys)
+    index[("Datafile", 0)] = "Datafile_name-a"
+    index[("Datafile", 235)] = "Datafile_name-b"
+    assert len(index) == len(keys)
+    assert index[("Datafile", 0)] == "Datafile_name-a"
+    assert index[("Datafile", 235)] == "Datafile_name-b"
+    del index[("Datafile", 1)]
+    del index[("Datafile", 235)]
+    assert len(index) == len(keys) - 2
+    assert ("Datafile", 1) not in index
+    with pytest.raises(KeyError):
+        del index[("Datafile", 1)]
+    index.clear()
+    assert len(index) == 0
+    assert ("Datafile", 0) not in index
+
+def test_objindex_spill():
+    """Objects moved to disk are restored as new objects.
+    """
+    keys = datafilekeys()
+    client = DummyClient()
+    index = ObjIndex(client, cachesize=10)
+    for kid, key in keys.items():
+        index[key] = DummyObj("datafile", id=kid[1], name="df%d" % kid[1])
+    assert len(index) == len(keys)
+    for kid, key in keys.items():
+        obj = index[key]
+        assert obj.instancetype == "datafile"
+        assert obj.id == kid[1]
+        assert obj.name == "df%d" % kid[1]
+    assert "Datafile_name-nonexisting" not in index
+    assert ("Datafile_dataset-(investigation-(name-nonexisting))_name-df0"
+            not in index)
+
+def test_objindex_noid():
+    """Objects not having an id are kept in memory.
+    """
+    client = DummyClient()
+    index = ObjIndex(client, cachesize=4)
+    pending = [ DummyObj("datafile", name="new%d" % i) for i in range(4) ]
+    for i, obj in enumerate(pending):
+        index["Datafile_name-new%d" % i] = obj
+    for i in range(20):
+        index["Datafile_name-df%d" % i] = DummyObj("datafile", id=i)
+    for i, obj in enumerate(pending):
+        assert index["Datafile_name-new%d" % i] is obj
+    assert len(index) == 24
+
+@pytest.mark.parametrize("cachesize", [None, 8])
+def test_chainindex(cachesize):
+    """Look up keys in the shared index, add new ones to the own index.
+    """
+    keys = datafilekeys()
+    shared = dict(k for k in keys.items() if k[0][1] < 100)
+    index = KeyIndex(cachesize=cachesize) if cachesize else {}
+    chain = ChainIndex(index, shared)
+    for k, v in keys.items():
+        if k not in chain:
+            chain[k] = v
+    assert len(shared) == 40
+    assert len(index) == 80
+    assert len(chain) == 120
+    assert set(chain) == set(keys)
+    for k, v in keys.items():
+        assert chain[k] == v
+    assert ("Datafile", 1000) not in chain
+    with pytest.raises(KeyError):
+        chain[("Datafile", 1000)]
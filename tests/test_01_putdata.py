@@ -0,0 +1,128 @@
+"""Test the retries of uploads to IDS in icat.client.
+
+These tests do not need an ICAT server.  They use a stand in for the
+IDS client that fails a given number of times.
+"""
+
+import errno
+import io
+import socket
+import pytest
+try:
+    from urllib.error import URLError
+except ImportError:
+    from urllib2 import URLError
+from icat.client import Client, _putdata
+from icat.exception import (IDSInternalError, IDSResponseError,
+                            IDSBadRequestError, UploadError)
+from conftest import DummyObj
+
+
+def connreset(msg):
+    return socket.error(errno.ECONNRESET, msg)
+
+class DummyIDSClient(object):
+    """Stand in for IDSClient.put() failing the first few calls."""
+    def __init__(self, failures, exc=connreset):
+        self.failures = failures
+        self.exc = exc
+        self.calls = 0
+        self.content = []
+    def put(self, inputStream, name, datasetId, datafileFormatId, 
+            description=None, doi=None, datafileCreateTime=None, 
+            datafileModTime=None):
+        self.calls += 1
+        data = inputStream.read()
+        if self.calls <= self.failures:
+            raise self.exc("upload failed")
+        self.content.append(data)
+        return 4711
+
+class NamedIDSClient(object):
+    """Stand in for IDSClient.put() failing for some file names."""
+    def __init__(self, failnames):
+        self.failnames = failnames
+    def put(self, inputStream, name, datasetId, datafileFormatId, 
+            description=None, doi=None, datafileCreateTime=None, 
+            datafileModTime=None):
+        inputStream.read()
+        if name in self.failnames:
+            raise IDSInternalError("upload failed")
+        return 100 + int(name[1:])
+
+def datafile(name="e208341.dat"):
+    return DummyObj("datafile", name=name, description=None, doi=None,
+                    dataset=DummyObj(id=1), datafileFormat=DummyObj(id=2),
+                    datafileCreateTime=None,
+                    datafileModTime="2010-10-01T08:00:00+00:00")
+
+content = b"0123456789" * 100
+
+
+def test_putdata_retry():
+    """A failed upload is retried from the start of the input.
+    """
+    ids = DummyIDSClient(2)
+    f = io.BytesIO(b"head" + content)
+    f.read(4)
+    assert _putdata(ids, f, datafile(), retries=2) == (4711, len(content))
+    assert ids.calls == 3
+    assert ids.content == [content]
+
+def test_putdata_retries_exhausted():
+    """The error is raised if all retries fail.
+    """
+    ids = DummyIDSClient(3)
+    with pytest.raises(socket.error):
+        _putdata(ids, io.BytesIO(content), datafile(), retries=2)
+    assert ids.calls == 3
+
+def test_putdata_retry_urlerror():
+    """Connection errors wrapped by urllib are retried.
+    """
+    def refused(msg):
+        return URLError(socket.error(errno.ECONNREFUSED, msg))
+    ids = DummyIDSClient(1, exc=refused)
+    assert _putdata(ids, io.BytesIO(content), datafile(), retries=2) \
+        == (4711, len(content))
+    assert ids.calls == 2
+
+@pytest.mark.parametrize("exc", [IDSBadRequestError, IDSInternalError])
+def test_putdata_noretry(exc):
+    """Errors reported by IDS are not retried.
+    """
+    ids = DummyIDSClient(1, exc=exc)
+    with pytest.raises(exc):
+        _putdata(ids, io.BytesIO(content), datafile(), retries=2)
+    assert ids.calls == 1
+
+def test_putdata_noretry_ioerror():
+    """Errors reading the input file are not retried.
+    """
+    def readerror(msg):
+        return IOError(errno.EIO, msg)
+    ids = DummyIDSClient(1, exc=readerror)
+    with pytest.raises(IOError):
+        _putdata(ids, io.BytesIO(content), datafile(), retries=2)
+    assert ids.calls == 1
+
+def test_putdata_noretry_response():
+    """A checksum mismatch is not retried, as IDS already created the
+    Datafile.
+    """
+    ids = DummyIDSClient(1, exc=IDSResponseError)
+    with pytest.raises(IDSResponseError):
+        _putdata(ids, io.BytesIO(content), datafile(), retries=2)
+    assert ids.calls == 1
+
+def test_putdatamany_error():
+    """If an upload fails, no further uploads are started and the ids
+    of the successful uploads are attached to the error.
+    """
+    client = Client.__new__(Client)
+    client.ids = NamedIDSClient({"f2"})
+    items = [ (io.BytesIO(content), datafile("f%d" % i)) for i in range(6) ]
+    with pytest.raises(UploadError) as err:
+        client.putDataMany(items, workers=2, window=2)
+    assert [ n for n, e in err.value.errors ] == [2]
+    assert err.value.datafileIds == [100, 101, 103]
@@ -4,6 +4,8 @@
 import os.path
 import re
 import filecmp
+import json
+import time
 import pytest
 try:
     from pytest_dependency import depends
@@ -12,12 +14,21 @@ except ImportError:
         pass
 import icat
 import icat.config
+from icat.dumpfile import open_dumpfile
+import icat.dumpfile_jsonl
+import icat.dumpfile_xml
+import icat.dumpfile_yaml
 from conftest import (getConfig, icat_version,
                       gettestdata, get_reference_dumpfile, callscript,
-                      filter_file, yaml_filter, xml_filter)
+                      filter_file, yaml_filter, xml_filter, jsonl_filter)
 
 
 backends = {
+    'JSONL': {
+        'refdump': get_reference_dumpfile("jsonl"),
+        'fileext': '.jsonl',
+        'filter': jsonl_filter,
+    },
     'XML': {
         'refdump': get_reference_dumpfile("xml"),
         'fileext': '.xml',
@@ -181,3 +192,26 @@ def test_check_queries(ingestcheck, client, query, result):
     """
     res = client.search(query)
     assert sorted(res) == result
+
+def test_check_incremental(ingestcheck, client, standardCmdArgs, tmpdirsec):
+    """Create a full dump with a manifest and an incremental dump
+    right afterwards.  The latter should not contain any objects.
+    """
+    backend, filetype = ingestcheck
+    fileext = backends[backend]['fileext']
+    manifest = os.path.join(tmpdirsec, "manifest.json")
+    full = os.path.join(tmpdirsec, "dump-full" + fileext)
+    incr = os.path.join(tmpdirsec, "dump-incr" + fileext)
+    if os.path.exists(manifest):
+        os.unlink(manifest)
+    # Make sure that the watermark is after the last modification.
+    time.sleep(1)
+    args = standardCmdArgs + ["-f", backend, "--manifest", manifest]
+    callscript("icatdump.py", args + ["-o", full])
+    with open(manifest, "rt") as f:
+        assert json.load(f)['since'] is None
+    callscript("icatdump.py", args + ["-o", incr])
+    with open(manifest, "rt") as f:
+        assert json.load(f)['since'] is not None
+    with open_dumpfile(client, incr, backend, 'r') as dumpfile:
+        assert list(dumpfile.getobjs()) == []
@@ -5,9 +5,12 @@ rather then calling icatdump and icatingest as external scripts, it
 uses the internal API icat.dumpfile.
 """
 
+from collections import OrderedDict
 import io
+import json
 import os.path
 import filecmp
+import sqlite3
 from lxml import etree
 import pytest
 try:
@@ -19,14 +22,28 @@ import icat
 import icat.config
 from icat.query import Query
 from icat.dumpfile import open_dumpfile
+import icat.dumpfile_jsonl
+import icat.dumpfile_sqlite
 import icat.dumpfile_xml
 import icat.dumpfile_yaml
 from icat.dump_queries import *
 from conftest import (getConfig, get_reference_dumpfile, callscript,
-                      filter_file, yaml_filter, xml_filter)
+                      filter_file, yaml_filter, xml_filter, jsonl_filter)
 
 
 backends = {
+    'JSONL': {
+        'refdump': get_reference_dumpfile("jsonl"),
+        'fileext': '.jsonl',
+        'filter': jsonl_filter,
+    },
+    'SQLITE': {
+        # There is no reference file for SQLite, the data is
+        # converted from and to JSON Lines instead.
+        'refdump': get_reference_dumpfile("jsonl"),
+        'fileext': '.sqlite',
+        'filter': jsonl_filter,
+    },
     'XML': {
         'refdump': get_reference_dumpfile("xml"),
         'fileext': '.xml',
@@ -43,13 +60,15 @@ assert backends.keys() == icat.dumpfile.Backends.keys()
 # The following cases are tuples of a backend and a file type (regular
 # file, stdin/stdout, in-memory stream).  They are used for both,
 # input and output.  We test all combinations, e.g. reading from a XML
-# file and writing it back as YAML to stdout.
+# file and writing it back as YAML to stdout.  The SQLite backend
+# only supports regular files.
 cases = [ (b, t) 
           for b in backends.keys() 
-          for t in ('FILE', 'MEMORY') ]
-icases = cases + [ ('XML','ETREE') ]
+          for t in ('FILE', 'MEMORY')
+          if b != 'SQLITE' or t == 'FILE' ]
+icases = cases + [ ('XML','ETREE') ] + [ (b, 'PARALLEL') for b in backends ]
 icaseids = [ "%s-%s" % t for t in icases ]
-ocases = cases
+ocases = cases + [ (b, t) for b in backends for t in ('PARALLEL', 'SPILL') ]
 
 # Test queries and results for test_check_queries().  This is mostly
 # to verify that object relations are kept intact after an icatdump /
@@ -77,21 +96,75 @@ queries = [
 
 # ======== function equivalents to icatdump and icatingest ===========
 
-def icatingest(client, f, backend):
+def icatingest(client, f, backend, workers=None):
     with open_dumpfile(client, f, backend, 'r') as dumpfile:
-        for obj in dumpfile.getobjs():
-            obj.create()
+        dumpfile.processobjs(lambda obj: obj.create(), clients=workers)
 
-def icatdump(client, f, backend):
+def icatdump(client, f, backend, workers=None, sortbuffer=None):
     with open_dumpfile(client, f, backend, 'w') as dumpfile:
+        if sortbuffer:
+            dumpfile.sortbuffer = sortbuffer
         dumpfile.writedata(getAuthQueries(client))
         dumpfile.writedata(getStaticQueries(client))
         investsearch = Query(client, "Investigation", attribute="id", 
                              order=["facility.name", "name", "visitId"])
-        for i in client.searchChunked(investsearch):
-            dumpfile.writedata(getInvestigationQueries(client, i), chunksize=5)
+        if workers:
+            chunks = (getInvestigationQueries(client, i, preloaded=True) 
+                      for i in client.searchChunked(investsearch))
+            dumpfile.writechunks(chunks, clients=workers, chunksize=5, 
+                                 keyindex=getStaticKeyIndex(client))
+        else:
+            for i in client.searchChunked(investsearch):
+                dumpfile.writedata(getInvestigationQueries(client, i), 
+                                   chunksize=5)
         dumpfile.writedata(getOtherQueries(client))
 
+def jsonl2sqlite(infile, outfile):
+    """Convert a JSON Lines data file to SQLite.
+    """
+    conn = sqlite3.connect(outfile)
+    conn.executescript(icat.dumpfile_sqlite._schema)
+    with open(infile, "rb") as f:
+        for line in f:
+            rec = json.loads(line.decode('utf-8'))
+            if 'head' in rec:
+                conn.executemany("INSERT INTO head VALUES (?, ?)",
+                                 rec['head'].items())
+            elif 'chunk' in rec:
+                chunk = rec['chunk']
+            else:
+                obj = json.dumps(rec['obj'], ensure_ascii=False,
+                                 separators=(',', ':'), sort_keys=True)
+                conn.execute("INSERT INTO objects (chunk, type, key, obj) "
+                             "VALUES (?, ?, ?, ?)",
+                             (chunk, rec['type'], rec['key'], obj))
+    conn.executescript(icat.dumpfile_sqlite._indexes)
+    conn.commit()
+    conn.close()
+
+def sqlite2jsonl(infile, outfile):
+    """Convert a SQLite data file to JSON Lines.
+    """
+    def dumps(rec):
+        s = json.dumps(rec, ensure_ascii=False, separators=(',', ':'))
+        return s.encode('utf-8') + b"\n"
+    conn = sqlite3.connect(infile)
+    with open(outfile, "wb") as f:
+        head = dict(conn.execute("SELECT name, value FROM head"))
+        names = ("date", "service", "apiversion", "generator")
+        f.write(dumps({"head": OrderedDict((n, head[n]) for n in names)}))
+        chunk = None
+        for row in conn.execute("SELECT chunk, type, key, obj "
+                                "FROM objects ORDER BY seq"):
+            if row[0] != chunk:
+                chunk = row[0]
+                f.write(dumps({"chunk": chunk}))
+            obj = json.loads(row[3], object_pairs_hook=OrderedDict)
+            rec = OrderedDict([("type", row[1]), ("key", row[2]),
+                               ("obj", obj)])
+            f.write(dumps(rec))
+    conn.close()
+
 # ============================ fixtures ==============================
 
 @pytest.fixture(scope="module")
@@ -115,11 +188,15 @@ def ingestcheck(ingestcase, request):
 # ============================= tests ================================
 
 @pytest.mark.dependency()
-def test_ingest(ingestcase, client):
+def test_ingest(ingestcase, client, tmpdirsec):
     """Restore the ICAT content from a dumpfile.
     """
     backend, filetype = ingestcase
     refdump = backends[backend]['refdump']
+    if backend == 'SQLITE':
+        jsonl = refdump
+        refdump = os.path.join(tmpdirsec, "refdump.sqlite")
+        jsonl2sqlite(jsonl, refdump)
     if filetype == 'FILE':
         icatingest(client, refdump, backend)
     elif filetype == 'MEMORY':
@@ -135,6 +212,16 @@ def test_ingest(ingestcase, client):
         with open(refdump, "rb") as f:
             icatdata = etree.parse(f)
         icatingest(client, icatdata, backend)
+    elif filetype == 'PARALLEL':
+        _, conf = getConfig()
+        workers = []
+        for i in range(3):
+            c = client.clone()
+            c.login(conf.auth, conf.credentials)
+            workers.append(c)
+        icatingest(client, refdump, backend, workers=workers)
+        for c in workers:
+            c.logout()
     else:
         raise RuntimeError("Invalid file type %s" % filetype)
 
@@ -164,8 +251,25 @@ def test_check_content(ingestcheck, client, tmpdirsec, case):
             stream.close()
         with open(dump, "wb") as f:
             f.write(icatdata)
+    elif filetype == 'PARALLEL':
+        _, conf = getConfig()
+        workers = []
+        for i in range(3):
+            c = client.clone()
+            c.login(conf.auth, conf.credentials)
+            workers.append(c)
+        icatdump(client, dump, backend, workers=workers)
+        for c in workers:
+            c.logout()
+    elif filetype == 'SPILL':
+        # Force sorting with temporary files.
+        icatdump(client, dump, backend, sortbuffer=3)
     else:
         raise RuntimeError("Invalid file type %s" % filetype)
+    if backend == 'SQLITE':
+        sqlite = dump
+        dump = os.path.join(tmpdirsec, "dump.jsonl")
+        sqlite2jsonl(sqlite, dump)
     filter_file(dump, fdump, *backends[backend]['filter'])
     assert filecmp.cmp(reffdump, fdump), "content of ICAT was not as expected"
 
@@ -175,3 +279,33 @@ def test_check_queries(ingestcheck, client, query, result):
     """
     res = client.search(query)
     assert sorted(res) == result
+
+def test_ingest_journal(tmpdirsec):
+    """Record progress in an IngestJournal and read it back on resume.
+    """
+    fname = os.path.join(tmpdirsec, "ingest-journal.jsonl")
+    with icat.dumpfile.IngestJournal(fname) as journal:
+        journal.addobjs(0, [("Facility_name-ESNF", 1)])
+        journal.done(0)
+        journal.addobjs(2, [("Investigation_name-08100122", 7)])
+        journal.addobjs(2, [("Dataset_name-e208339", 11),
+                            ("Dataset_name-e208341", 12)])
+    # Simulate an interrupted write.
+    with open(fname, "at") as f:
+        f.write('{"chunk": 2, "key"')
+    with icat.dumpfile.IngestJournal(fname, resume=True) as journal:
+        assert journal.isdone(0)
+        assert not journal.isdone(1)
+        assert not journal.isdone(2)
+        assert journal.getids(0) == {}
+        assert journal.getids(2) == {
+            "Investigation_name-08100122": 7,
+            "Dataset_name-e208339": 11,
+            "Dataset_name-e208341": 12,
+        }
+        journal.done(2)
+    with icat.dumpfile.IngestJournal(fname, resume=True) as journal:
+        assert journal.isdone(2)
+        assert journal.getids(2) == {}
+    with icat.dumpfile.IngestJournal(fname) as journal:
+        assert not journal.isdone(0)
@@ -366,3 +366,34 @@ def test_searchMatching_include(client):
     assert obj.name == "e208945"
     assert len(obj.datafiles) > 0
 
+def test_searchMatchingMany(client):
+    """Search several objects at once with searchMatchingMany()
+    """
+    facility = client.searchMatching(client.new("facility", name="ESNF"))
+    investigation = client.new("investigation", 
+                               name="12100409-ST", visitId="1.1-P",
+                               facility=facility)
+    investigation = client.searchMatching(investigation)
+    names = ["e208945", "e208947", "no-such-dataset"]
+    datasets = [ client.new("dataset", name=n, investigation=investigation)
+                 for n in names ]
+    objs = client.searchMatchingMany(datasets)
+    assert len(objs) == 3
+    for ds, obj in zip(datasets[:2], objs[:2]):
+        assert obj.BeanName == "Dataset"
+        assert obj.id
+        assert obj.name == ds.name
+    assert objs[2] is None
+    # Datafiles in different datasets: one search per dataset.
+    datafiles = [ client.new("datafile", name="e208945.nxs", dataset=objs[0]),
+                  client.new("datafile", name="e208947.nxs", dataset=objs[1]),
+                  client.new("datafile", name="e208945.dat", dataset=objs[0]) ]
+    dfobjs = client.searchMatchingMany(datafiles, includes="1")
+    for df, obj in zip(datafiles, dfobjs):
+        assert obj.BeanName == "Datafile"
+        assert obj.name == df.name
+        assert obj.dataset.id == df.dataset.id
+    # Objects related to objects not yet created can not be searched.
+    newds = client.new("dataset", name="e208945")
+    assert client.searchMatchingMany([newds]) == [None]
+
@@ -334,6 +334,31 @@ def test_putData_datafileCreateTime(tmpdirsec, client):
     if tzinfo is not None:
         assert df.datafileCreateTime == createTime
 
+def test_putDataMany(tmpdirsec, client):
+    """Upload several files concurrently with client.putDataMany().
+    """
+    case = testdatafiles[0]
+    dataset = getDataset(client, case)
+    datafileformat = client.assertedSearch("DatafileFormat [name='other']")[0]
+    items = []
+    for i in range(7):
+        dfname = "test_putDataMany_%02d.dat" % i
+        f = DummyDatafile(tmpdirsec, dfname, 1000 + 100*i)
+        datafile = client.new("datafile", name=f.name, 
+                              dataset=dataset, datafileFormat=datafileformat)
+        items.append((f, datafile))
+    progress = []
+    def report(nfiles, nbytes, elapsed):
+        progress.append((nfiles, nbytes))
+    datafiles = client.putDataMany([ (f.fname, df) for f, df in items ], 
+                                   workers=3, progress=report)
+    assert [ df.name for df in datafiles ] == [ f.name for f, _ in items ]
+    for (f, _), df in zip(items, datafiles):
+        assert df.id
+        assert df.fileSize == f.size
+    assert [ n for n, _ in progress ] == list(range(1, 8))
+    assert progress[-1][1] == sum(f.size for f, _ in items)
+
 @pytest.mark.parametrize(("case"), markeddatasets)
 def test_write(client, case):
     """Call write() on a dataset.
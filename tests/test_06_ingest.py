@@ -122,7 +122,8 @@ def test_ingest_duplicate_throw(client, dataset, cmdargs):
     })
 
 
-def test_ingest_duplicate_ignore(client, dataset, cmdargs):
+@pytest.mark.parametrize("prefetch", [False, True])
+def test_ingest_duplicate_ignore(client, dataset, cmdargs, prefetch):
     """Ingest with a collision of a duplicate object.
 
     Same test as above, but now ignore the duplicate.
@@ -133,6 +134,8 @@ def test_ingest_duplicate_ignore(client, dataset, cmdargs):
                    dataset=dataset, type=ptype)
     p.create()
     args = cmdargs + ["-i", ds_params, "--duplicate", "IGNORE"]
+    if prefetch:
+        args.append("--prefetch")
     callscript("icatingest.py", args)
     verify_dataset_params(client, dataset, { 
         ("Magnetic field", 5.3, "T"), 
@@ -141,7 +144,8 @@ def test_ingest_duplicate_ignore(client, dataset, cmdargs):
     })
 
 
-def test_ingest_duplicate_check_err(client, dataset, cmdargs):
+@pytest.mark.parametrize("prefetch", [False, True])
+def test_ingest_duplicate_check_err(client, dataset, cmdargs, prefetch):
     """Ingest with a collision of a duplicate object.
 
     Same test as above, but use CHECK which fails due to mismatch.
@@ -152,6 +156,8 @@ def test_ingest_duplicate_check_err(client, dataset, cmdargs):
                    dataset=dataset, type=ptype)
     p.create()
     args = cmdargs + ["-i", ds_params, "--duplicate", "CHECK"]
+    if prefetch:
+        args.append("--prefetch")
     # FIXME: should inspect stderr and verify ICATObjectExistsError.
     with pytest.raises(CalledProcessError) as err:
         callscript("icatingest.py", args)
@@ -161,7 +167,8 @@ def test_ingest_duplicate_check_err(client, dataset, cmdargs):
     })
 
 
-def test_ingest_duplicate_check_ok(client, dataset, cmdargs):
+@pytest.mark.parametrize("prefetch", [False, True])
+def test_ingest_duplicate_check_ok(client, dataset, cmdargs, prefetch):
     """Ingest with a collision of a duplicate object.
 
     Same test as above, but now it matches, so CHECK should return ok.
@@ -172,6 +179,8 @@ def test_ingest_duplicate_check_ok(client, dataset, cmdargs):
                    dataset=dataset, type=ptype)
     p.create()
     args = cmdargs + ["-i", ds_params, "--duplicate", "CHECK"]
+    if prefetch:
+        args.append("--prefetch")
     callscript("icatingest.py", args)
     verify_dataset_params(client, dataset, { 
         ("Magnetic field", 5.3, "T"), 
@@ -180,7 +189,8 @@ def test_ingest_duplicate_check_ok(client, dataset, cmdargs):
     })
 
 
-def test_ingest_duplicate_overwrite(client, dataset, cmdargs):
+@pytest.mark.parametrize("prefetch", [False, True])
+def test_ingest_duplicate_overwrite(client, dataset, cmdargs, prefetch):
     """Ingest with a collision of a duplicate object.
 
     Same test as above, but now overwrite the old value.
@@ -191,6 +201,8 @@ def test_ingest_duplicate_overwrite(client, dataset, cmdargs):
                    dataset=dataset, type=ptype)
     p.create()
     args = cmdargs + ["-i", ds_params, "--duplicate", "OVERWRITE"]
+    if prefetch:
+        args.append("--prefetch")
     callscript("icatingest.py", args)
     verify_dataset_params(client, dataset, { 
         ("Magnetic field", 5.3, "T"), 
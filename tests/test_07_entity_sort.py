@@ -261,3 +261,47 @@ def test_sortattrs_dependencies(client):
             continue
         deplist = checkSortDependency(cls)
         print("%s: %s" % (cls.BeanName, ", ".join(deplist)))
+
+
+def test_sortkey_cache(client):
+    """Sort keys are cached, but must follow modifications.
+
+    The sort key of a Datafile depends on the sort key of the related
+    Dataset.  Modifying the name of the Dataset after the sort key of
+    the Datafile has been computed must be taken into account.
+    """
+    ds1 = client.new("dataset", id=592, name="ds_a")
+    ds2 = client.new("dataset", id=341, name="ds_b")
+    df1 = client.new("datafile", id=429, name="df_a", dataset=ds1)
+    df2 = client.new("datafile", id=229, name="df_b", dataset=ds2)
+    datafiles = [ df2, df1 ]
+    datafiles.sort(key=icat.entity.Entity.__sortkey__)
+    assert datafiles == [ df1, df2 ]
+    assert df1.__sortkey__() is df1.__sortkey__()
+    ds1.name = "ds_c"
+    datafiles.sort(key=icat.entity.Entity.__sortkey__)
+    assert datafiles == [ df2, df1 ]
+    df1.dataset.name = "ds_a"
+    datafiles.sort(key=icat.entity.Entity.__sortkey__)
+    assert datafiles == [ df1, df2 ]
+
+def test_sortkey_cache_unrelated(client):
+    """Modifying an object does not invalidate the cached keys of
+    unrelated objects, but those of objects depending on it.
+    """
+    inv = client.new("investigation", id=82, name="inv_a", visitId="1")
+    ds1 = client.new("dataset", id=592, name="ds_a", investigation=inv)
+    ds2 = client.new("dataset", id=341, name="ds_b", investigation=inv)
+    df1 = client.new("datafile", id=429, name="df_a", dataset=ds1)
+    df2 = client.new("datafile", id=229, name="df_b", dataset=ds2)
+    key1 = df1.__sortkey__()
+    key2 = df2.__sortkey__()
+    assert isinstance(key1, tuple)
+    ds2.name = "ds_c"
+    assert df1.__sortkey__() is key1
+    assert df2.__sortkey__() is not key2
+    assert df2.__sortkey__() > key2
+    key2 = df2.__sortkey__()
+    inv.name = "inv_b"
+    assert df1.__sortkey__() > key1
+    assert df2.__sortkey__() > key2